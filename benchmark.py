@@ -0,0 +1,343 @@
+"""
+
+This module times, and measures the memory of, each stage of loading and analysing messages on synthetic data, see
+synthetic_data.py, and records the results so a change can be compared against earlier runs.
+
+Each run appends a line of JSON per stage to a results file, holding the commit, the size of the dataset, the seconds
+the stage took and its peak memory.  The run is then compared to the previous run on the same dataset, and stages
+that got slower, or use more memory, by more than the regression threshold are reported.
+
+    python benchmark.py -n 100000          # Writes the data on the first run, later runs reuse it.
+    python benchmark.py -n 1000000 --stages iphone.get_cleaned_fully_merged_messages message_cube.build_cube
+
+Peak memory is measured with tracemalloc in a separate pass, since tracing slows Python down a lot.  It sees what
+Python, numpy and pandas allocate, but not what SQLite allocates itself.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import collections
+import contextlib
+import datetime
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import contact_clustering
+import facebook_connector
+import iphone_connector
+import message_cube
+import message_search
+import steamgraph
+import synthetic_data
+import tfidf_engine
+import word_frequencies
+
+DEFAULT_BENCHMARK_DIRECTORY = os.path.join(os.path.expanduser('~'), '.sms_analysis_cache', 'benchmark')
+RESULTS_FILENAME = 'benchmark_results.jsonl'
+# A stage regressed if it takes, or peaks at, more than this times what it did in the previous run.
+REGRESSION_THRESHOLD = 1.2
+# Differences below these are noise, however large relative to the previous run.
+_MIN_SECONDS_DIFFERENCE = .05
+_MIN_PEAK_MB_DIFFERENCE = 1
+
+
+# Each stage takes the results of the stages before it, by name, and returns its own result.  Stages write their
+# caches to the scratch directory so every run starts cold.
+def __get_message_df(results, scratch_directory):
+    return iphone_connector.get_message_df()
+
+
+def __get_address_book(results, scratch_directory):
+    return iphone_connector.get_address_book()
+
+
+def __get_merged_message_df(results, scratch_directory):
+    return iphone_connector.get_merged_message_df(results['iphone.get_message_df'],
+                                                  results['iphone.get_address_book'])
+
+
+def __get_cleaned_fully_merged_messages(results, scratch_directory):
+    return iphone_connector.get_cleaned_fully_merged_messages()[0]
+
+
+def __get_fully_merged_messages_from_sql(results, scratch_directory):
+    return iphone_connector.get_fully_merged_messages_from_sql()[0]
+
+
+def __build_cube(results, scratch_directory):
+    return message_cube.build_cube(results['iphone.get_cleaned_fully_merged_messages'])
+
+
+def __get_steamgraph_data(results, scratch_directory):
+    return steamgraph.get_steamgraph_data(results['message_cube.build_cube'], max_points=400)
+
+
+def __update_search_index(results, scratch_directory):
+    return message_search.update_search_index(os.path.join(scratch_directory, message_search.SEARCH_INDEX_FILENAME),
+                                              results['iphone.get_cleaned_fully_merged_messages'], rebuild=True)
+
+
+def __fit_contact_tfidf(results, scratch_directory):
+    return tfidf_engine.fit_contact_tfidf(results['iphone.get_cleaned_fully_merged_messages'],
+                                          cache_path=os.path.join(scratch_directory, 'contact_tfidf.pkl'),
+                                          force_refit=True)
+
+
+def __count_terms_by_contact(results, scratch_directory):
+    return word_frequencies.count_terms_by_contact(results['iphone.get_cleaned_fully_merged_messages'])
+
+
+def __get_contact_clusters(results, scratch_directory):
+    return contact_clustering.get_contact_clusters(results['tfidf_engine.fit_contact_tfidf'], min_texts_required=10,
+                                                   cache_path=os.path.join(scratch_directory, 'contact_clusters.pkl'),
+                                                   force_refit=True)
+
+
+def __get_facebook_messages(results, scratch_directory):
+    return facebook_connector.get_cleaned_fully_merged_messages()[0]
+
+
+# In the order they run, a stage only relies on stages before it.
+STAGES = collections.OrderedDict([
+    ('iphone.get_message_df', __get_message_df),
+    ('iphone.get_address_book', __get_address_book),
+    ('iphone.get_merged_message_df', __get_merged_message_df),
+    ('iphone.get_cleaned_fully_merged_messages', __get_cleaned_fully_merged_messages),
+    ('iphone.get_fully_merged_messages_from_sql', __get_fully_merged_messages_from_sql),
+    ('message_cube.build_cube', __build_cube),
+    ('steamgraph.get_steamgraph_data', __get_steamgraph_data),
+    ('message_search.update_search_index', __update_search_index),
+    ('tfidf_engine.fit_contact_tfidf', __fit_contact_tfidf),
+    ('word_frequencies.count_terms_by_contact', __count_terms_by_contact),
+    ('contact_clustering.get_contact_clusters', __get_contact_clusters),
+    ('facebook.get_cleaned_fully_merged_messages', __get_facebook_messages),
+])
+_STAGE_DEPENDENCIES = {
+    'iphone.get_merged_message_df': ['iphone.get_message_df', 'iphone.get_address_book'],
+    'message_cube.build_cube': ['iphone.get_cleaned_fully_merged_messages'],
+    'steamgraph.get_steamgraph_data': ['message_cube.build_cube'],
+    'message_search.update_search_index': ['iphone.get_cleaned_fully_merged_messages'],
+    'tfidf_engine.fit_contact_tfidf': ['iphone.get_cleaned_fully_merged_messages'],
+    'word_frequencies.count_terms_by_contact': ['iphone.get_cleaned_fully_merged_messages'],
+    'contact_clustering.get_contact_clusters': ['tfidf_engine.fit_contact_tfidf'],
+}
+
+
+# Adds the stages the passed stages rely on, and returns them all in the order they run.
+def __resolve_stages(stage_names):
+    needed = set()
+    pending = list(stage_names)
+    while pending:
+        stage_name = pending.pop()
+        if stage_name not in needed:
+            needed.add(stage_name)
+            pending.extend(_STAGE_DEPENDENCIES.get(stage_name, []))
+    return [stage_name for stage_name in STAGES if stage_name in needed]
+
+
+# Returns the commit the benchmark runs at, or None outside of a git checkout.
+def __get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_synthetic_data(benchmark_directory, number_of_messages, number_of_contacts=200, group_chat_ratio=.2, seed=0):
+    """
+    Returns the synthetic iPhone backup and Facebook archive for these settings, writing them on the first call.
+
+    Args:
+        benchmark_directory: the directory the data is kept in, under a subdirectory per settings
+        number_of_messages: see synthetic_data.write_iphone_backup()
+        number_of_contacts: see synthetic_data.write_iphone_backup()
+        group_chat_ratio: see synthetic_data.write_iphone_backup()
+        seed: see synthetic_data.write_iphone_backup()
+
+    Returns:
+        a tuple of the backup directory and the archive directory
+    """
+    data_directory = os.path.join(benchmark_directory, 'data', 'messages{0}_contacts{1}_groups{2}_seed{3}'.format(
+        number_of_messages, number_of_contacts, group_chat_ratio, seed))
+    backup_directory = os.path.join(data_directory, 'iphone')
+    archive_directory = os.path.join(data_directory, 'facebook')
+    # Written last, so data that was only partly written is written again.
+    complete_path = os.path.join(data_directory, 'complete')
+    if not os.path.isfile(complete_path):
+        print('Writing {0:,} synthetic messages to {1}'.format(number_of_messages, data_directory))
+        synthetic_data.write_iphone_backup(backup_directory, number_of_messages, number_of_contacts,
+                                           group_chat_ratio, seed)
+        synthetic_data.write_facebook_archive(archive_directory, number_of_messages, number_of_contacts,
+                                              group_chat_ratio, seed)
+        open(complete_path, 'w').close()
+    return backup_directory, archive_directory
+
+
+def run_stages(stage_names=None, measure_memory=True, repeat=1):
+    """
+    Runs stages against the data iphone_connector and facebook_connector were initialized with.  Their output is
+    suppressed.
+
+    Args:
+        stage_names: the stages to measure, see STAGES, defaults to all of them.  The stages they rely on are run too
+        measure_memory: if true, each stage is run once more under tracemalloc to measure its peak memory
+        repeat: the number of times each stage is timed, the fastest time is kept
+
+    Returns:
+        a list of dicts of each stage's "stage", "seconds", "peak_mb", None if memory isn't measured, and "rows" of
+        its result, None if it has no length
+    """
+    stage_names = __resolve_stages(stage_names or list(STAGES))
+    scratch_directory = tempfile.mkdtemp(prefix='sms_benchmark_')
+    results, measurements = {}, []
+    try:
+        for stage_name in stage_names:
+            stage = STAGES[stage_name]
+            timings = []
+            for _ in range(max(1, repeat)):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    results[stage_name] = stage(results, scratch_directory)
+                    timings.append(time.perf_counter() - start)
+
+            peak_mb = None
+            if measure_memory:
+                tracemalloc.start()
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        stage(results, scratch_directory)
+                    peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                finally:
+                    tracemalloc.stop()
+
+            result = results[stage_name]
+            measurements.append({'stage': stage_name, 'seconds': min(timings), 'peak_mb': peak_mb,
+                                 'rows': len(result) if hasattr(result, '__len__') else None})
+            print('{0:<45} {1:>9.3f}s {2:>12}'.format(
+                stage_name, min(timings), '{0:,.1f} MB'.format(peak_mb) if peak_mb is not None else ''))
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+    return measurements
+
+
+def read_results(results_path):
+    """
+    Reads the results recorded by record_results(), or an empty list if there are none yet.
+    """
+    if not os.path.isfile(results_path):
+        return []
+    with io.open(results_path, 'rt', encoding='utf-8') as results_file:
+        return [json.loads(line) for line in results_file if line.strip()]
+
+
+def record_results(results_path, measurements, dataset):
+    """
+    Appends the measurements of a run to the results file, a line of JSON per stage.
+
+    Args:
+        results_path: the results file, it's created if needed
+        measurements: the measurements returned by run_stages()
+        dataset: a dict of the settings the synthetic data was written with
+
+    Returns:
+        the recorded lines as dicts
+    """
+    run = {'run': datetime.datetime.now().isoformat(), 'commit': __get_commit(), 'dataset': dataset}
+    records = [dict(run, **measurement) for measurement in measurements]
+    results_directory = os.path.dirname(results_path)
+    if results_directory and not os.path.isdir(results_directory):
+        os.makedirs(results_directory)
+    with io.open(results_path, 'at', encoding='utf-8') as results_file:
+        for record in records:
+            results_file.write(json.dumps(record, sort_keys=True) + u'\n')
+    return records
+
+
+def find_regressions(records, previous_records, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares a run to the previous run on the same dataset.
+
+    Args:
+        records: the lines recorded for the run, see record_results()
+        previous_records: every line recorded before the run, see read_results()
+        threshold: a stage regressed if its seconds or peak memory grew past this times its previous value
+
+    Returns:
+        a list of tuples of the stage, the measure that regressed, i.e. "seconds" or "peak_mb", its previous value
+        and its value in this run
+    """
+    if not records:
+        return []
+    same_dataset = [record for record in previous_records if record['dataset'] == records[0]['dataset']]
+    if not same_dataset:
+        return []
+    previous_run = same_dataset[-1]['run']
+    previous_by_stage = {record['stage']: record for record in same_dataset if record['run'] == previous_run}
+
+    regressions = []
+    for record in records:
+        previous = previous_by_stage.get(record['stage'])
+        if previous is None:
+            continue
+        for measure, min_difference in (('seconds', _MIN_SECONDS_DIFFERENCE), ('peak_mb', _MIN_PEAK_MB_DIFFERENCE)):
+            value, previous_value = record.get(measure), previous.get(measure)
+            if value is None or previous_value is None:
+                continue
+            if value > previous_value * threshold and value - previous_value > min_difference:
+                regressions.append((record['stage'], measure, previous_value, value))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time and measure the memory of each stage of loading and '
+                                                 'analysing messages, on synthetic data.')
+    parser.add_argument('-n', '--messages', type=int, default=100000, dest='messages',
+                        help='The number of synthetic messages.  Default 100000.')
+    parser.add_argument('--contacts', type=int, default=200, dest='contacts',
+                        help='The number of synthetic contacts.  Default 200.')
+    parser.add_argument('--group-chat-ratio', type=float, default=.2, dest='group_chat_ratio',
+                        help='The fraction of messages sent in group chats.  Default 0.2.')
+    parser.add_argument('--seed', type=int, default=0, dest='seed', help='Seeds the synthetic data.  Default 0.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), dest='stages',
+                        help='If passed, only these stages, and those they rely on, are measured.')
+    parser.add_argument('--repeat', type=int, default=1, dest='repeat',
+                        help='The number of times each stage is timed, the fastest time is kept.  Default 1.')
+    parser.add_argument('--no-memory', action='store_false', dest='memory',
+                        help='If passed, peak memory isn\'t measured, which halves the time a run takes.')
+    parser.add_argument('--directory', default=DEFAULT_BENCHMARK_DIRECTORY, dest='directory',
+                        help='The directory the synthetic data and results are kept in.  Default {0}.'.format(
+                            DEFAULT_BENCHMARK_DIRECTORY))
+    parser.add_argument('--fail-on-regression', action='store_true', dest='fail_on_regression',
+                        help='If passed, exit with status 1 when a stage regressed since the previous run.')
+    args = parser.parse_args()
+
+    backup_directory, archive_directory = get_synthetic_data(args.directory, args.messages, args.contacts,
+                                                             args.group_chat_ratio, args.seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        facebook_connector.initialize(archive_directory)
+
+    results_path = os.path.join(args.directory, RESULTS_FILENAME)
+    previous_records = read_results(results_path)
+    measurements = run_stages(args.stages, args.memory, args.repeat)
+    dataset = {'messages': args.messages, 'contacts': args.contacts, 'group_chat_ratio': args.group_chat_ratio,
+               'seed': args.seed}
+    records = record_results(results_path, measurements, dataset)
+    print('Recorded results in {0}'.format(results_path))
+
+    regressions = find_regressions(records, previous_records)
+    for stage_name, measure, previous_value, value in regressions:
+        print('Regression: {0} {1} went from {2:,.3f} to {3:,.3f}'.format(stage_name, measure, previous_value, value))
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
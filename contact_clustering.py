@@ -0,0 +1,240 @@
+"""
+
+This module clusters your contacts by the words they text you, and finds the contacts who text most like a given one.
+
+Each contact's row of the TFIDF matrix built by tfidf_engine.fit_contact_tfidf() is reduced to a short embedding with
+TruncatedSVD, the embeddings are clustered with KMeans, or MiniBatchKMeans when there are many contacts, and reduced
+once more to 2D for plotting.  The result is saved to disk by get_contact_clusters() and reused until the TFIDF matrix
+changes.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import hashlib
+import numpy as np
+import os
+import pandas as pd
+import pickle
+
+from scipy import sparse
+from sklearn.cluster import KMeans
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+
+import tfidf_engine
+
+DEFAULT_CLUSTERS_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.sms_analysis_cache', 'contact_clusters.pkl')
+NUMBER_OF_CLUSTERS = 7
+NUMBER_OF_COMPONENTS = 7
+# Above this many contacts MiniBatchKMeans is used rather than KMeans.
+MINI_BATCH_THRESHOLD = 2000
+
+
+# Fits a TruncatedSVD of at most n_components, fewer if the matrix is too small for that many.
+def __fit_svd(matrix, n_components, random_state):
+    n_components = max(1, min(n_components, matrix.shape[0] - 1, matrix.shape[1] - 1))
+    svd = TruncatedSVD(n_components=n_components, random_state=random_state)
+    return svd, svd.fit_transform(matrix)
+
+
+# Normalizes rows to unit length so their dot products are cosine similarities.
+def _normalize_rows(embedding):
+    norms = np.linalg.norm(embedding, axis=1, keepdims=True)
+    return embedding / np.where(norms == 0, 1, norms)
+
+
+# Sums the rows of matrix per cluster into a dense clusters x words array.
+def _sum_rows_by_cluster(matrix, assignments, number_of_clusters):
+    indicator = sparse.csr_matrix((np.ones(len(assignments)), (assignments, np.arange(len(assignments)))),
+                                  shape=(number_of_clusters, len(assignments)))
+    return np.asarray((indicator @ matrix).todense())
+
+
+class ContactClusters(object):
+    """
+    Contacts clustered by the words they text you.
+
+    Attributes:
+        names: the full name of each contact
+        embedding: the SVD embedding of each contact's TFIDF row
+        embedding_2d: embedding reduced to 2D, e.g. for a scatter plot
+        assignments: the cluster of each contact
+        cluster_sums: the sum of the TFIDF rows of each cluster, a dense clusters x words array
+        cluster_sizes: the number of contacts in each cluster
+        fingerprint: identifies the TFIDF matrix and settings the clusters were built from
+    """
+
+    def __init__(self, svd, svd_2d, kmeans, matrix, names, fingerprint=None):
+        self.svd = svd
+        self.svd_2d = svd_2d
+        self.kmeans = kmeans
+        self.names = pd.Index(names, name='full_name')
+        self.fingerprint = fingerprint
+        self.number_of_clusters = kmeans.n_clusters
+
+        self.embedding = svd.transform(matrix)
+        self.embedding_2d = self.__project_2d(self.embedding)
+        self.assignments = kmeans.predict(self.embedding)
+        self.cluster_sums = _sum_rows_by_cluster(matrix, self.assignments, self.number_of_clusters)
+        self.cluster_sizes = np.bincount(self.assignments, minlength=self.number_of_clusters)
+        self._normalized_embedding = _normalize_rows(self.embedding)
+        self._row_by_name = {name: row for row, name in enumerate(self.names)}
+
+    def top_word_indices(self, cluster_id, top_n=15):
+        """
+        Returns the columns of the TFIDF matrix for the top words of a cluster, i.e. those whose mean TFIDF within
+        the cluster most exceeds their mean TFIDF across the other contacts.  It only reads the precomputed cluster
+        sums, so it's cheap to call for every cluster.
+        """
+        cluster_size = self.cluster_sizes[cluster_id]
+        other_size = self.cluster_sizes.sum() - cluster_size
+        cluster_sum = self.cluster_sums[cluster_id]
+        other_sum = self.cluster_sums.sum(axis=0) - cluster_sum
+        difference = cluster_sum / max(cluster_size, 1) - (other_sum / other_size if other_size else 0)
+        return tfidf_engine.top_indices(difference, top_n)
+
+    def top_words(self, cluster_id, word_list, top_n=15):
+        """
+        Returns a series of the top words of a cluster, see top_word_indices().
+
+        Args:
+            cluster_id: the cluster to find the top words of
+            word_list: the words of the TFIDF matrix's columns, see tfidf_engine.get_word_list()
+            top_n: the number of words to return
+        """
+        return word_list.iloc[self.top_word_indices(cluster_id, top_n)].reset_index(drop=True)
+
+    def most_similar(self, contact, top_n=10):
+        """
+        Finds the contacts who text most like a contact, by the cosine similarity of their embeddings.
+
+        Args:
+            contact: the full name of the contact
+            top_n: the number of similar contacts to return
+
+        Returns:
+            a dataframe of the most similar contacts' "full_name" and "similarity", the most similar first, or None
+            if the contact isn't found
+        """
+        row = self._row_by_name.get(contact)
+        if row is None:
+            return None
+        similarities = self._normalized_embedding.dot(self._normalized_embedding[row])
+        # Leave the contact out of their own neighbors.
+        similarities[row] = -np.inf
+        top_rows = tfidf_engine.top_indices(similarities, min(top_n, len(similarities) - 1))
+        return pd.DataFrame({'full_name': self.names[top_rows], 'similarity': similarities[top_rows]})
+
+    def add_contacts(self, matrix, names):
+        """
+        Assigns contacts to the existing clusters without refitting them, e.g. contacts who've since texted you
+        enough to be clustered.  Contacts that are already clustered are left as they are.
+
+        Args:
+            matrix: the TFIDF rows of the contacts, built with the same vectorizer as the clustered contacts
+            names: the full name of each row of matrix
+        """
+        names = list(names)
+        new = np.array([name not in self._row_by_name for name in names], dtype=bool)
+        if not new.any():
+            return
+        matrix = sparse.csr_matrix(matrix)[np.flatnonzero(new)]
+        embedding = self.svd.transform(matrix)
+        assignments = self.kmeans.predict(embedding)
+
+        new_names = pd.Index([name for name, is_new in zip(names, new) if is_new])
+        self.names = self.names.append(new_names).rename('full_name')
+        self.embedding = np.vstack([self.embedding, embedding])
+        self.embedding_2d = np.vstack([self.embedding_2d, self.__project_2d(embedding)])
+        self.assignments = np.concatenate([self.assignments, assignments])
+        self.cluster_sums += _sum_rows_by_cluster(matrix, assignments, self.number_of_clusters)
+        self.cluster_sizes = np.bincount(self.assignments, minlength=self.number_of_clusters)
+        self._normalized_embedding = np.vstack([self._normalized_embedding, _normalize_rows(embedding)])
+        self._row_by_name = {name: row for row, name in enumerate(self.names)}
+
+    def __project_2d(self, embedding):
+        embedding_2d = self.svd_2d.transform(embedding) if self.svd_2d is not None else embedding
+        if embedding_2d.shape[1] < 2:
+            embedding_2d = np.hstack([embedding_2d, np.zeros((embedding_2d.shape[0], 2 - embedding_2d.shape[1]))])
+        return embedding_2d
+
+
+def fit_contact_clusters(matrix, names, number_of_clusters=NUMBER_OF_CLUSTERS,
+                         number_of_components=NUMBER_OF_COMPONENTS, mini_batch=None, random_state=0, fingerprint=None):
+    """
+    Clusters contacts by their TFIDF rows.
+
+    Args:
+        matrix: a sparse TFIDF matrix with a row per contact
+        names: the full name of each row of matrix
+        number_of_clusters: the number of clusters, fewer if there are fewer contacts
+        number_of_components: the length of the SVD embedding the contacts are clustered by
+        mini_batch: if true MiniBatchKMeans is used, which scales to many more contacts, defaults to true when there
+            are more than MINI_BATCH_THRESHOLD contacts
+        random_state: seeds the SVD and KMeans so the clusters are reproducible
+        fingerprint: stored on the result to identify what it was built from
+
+    Returns:
+        a ContactClusters
+    """
+    matrix = sparse.csr_matrix(matrix)
+    svd, embedding = __fit_svd(matrix, number_of_components, random_state)
+    # We further reduce the dimensionality of the data, so that we can graph it.
+    svd_2d = __fit_svd(embedding, 2, random_state)[0] if embedding.shape[1] > 2 else None
+
+    number_of_clusters = max(1, min(number_of_clusters, matrix.shape[0]))
+    if mini_batch is None:
+        mini_batch = matrix.shape[0] > MINI_BATCH_THRESHOLD
+    if mini_batch:
+        kmeans = MiniBatchKMeans(n_clusters=number_of_clusters, n_init=3, random_state=random_state)
+    else:
+        kmeans = KMeans(n_clusters=number_of_clusters, n_init=10, random_state=random_state)
+    kmeans.fit(embedding)
+    return ContactClusters(svd, svd_2d, kmeans, matrix, names, fingerprint)
+
+
+def get_contact_clusters(contact_tfidf, min_texts_required=100, number_of_clusters=NUMBER_OF_CLUSTERS,
+                         number_of_components=NUMBER_OF_COMPONENTS, mini_batch=None, cache_path=None,
+                         force_refit=False):
+    """
+    Clusters the contacts who've sent you at least min_texts_required texts.  The result is saved to disk and loaded
+    back on later calls, as long as the TFIDF matrix and settings haven't changed.
+
+    Args:
+        contact_tfidf: a tfidf_engine.ContactTfidf
+        min_texts_required: contacts who've sent you fewer texts are left out
+        number_of_clusters: see fit_contact_clusters()
+        number_of_components: see fit_contact_clusters()
+        mini_batch: see fit_contact_clusters()
+        cache_path: the file to persist the result in, defaults to DEFAULT_CLUSTERS_CACHE_PATH
+        force_refit: if true, ignore any persisted result
+
+    Returns:
+        a ContactClusters, or None if no contact has sent you enough texts
+    """
+    cache_path = cache_path or DEFAULT_CLUSTERS_CACHE_PATH
+    settings = (contact_tfidf.fingerprint, min_texts_required, number_of_clusters, number_of_components, mini_batch)
+    fingerprint = hashlib.sha1(repr(settings).encode('utf-8')).hexdigest()
+
+    if not force_refit and os.path.isfile(cache_path):
+        with open(cache_path, 'rb') as cache_file:
+            contact_clusters = pickle.load(cache_file)
+        if contact_clusters.fingerprint == fingerprint:
+            print('Loaded contact clusters from {0}'.format(cache_path))
+            return contact_clusters
+
+    enough_texts = contact_tfidf.text_counts >= min_texts_required
+    if not enough_texts.any():
+        return None
+    contact_clusters = fit_contact_clusters(contact_tfidf.matrix[np.flatnonzero(enough_texts)],
+                                            contact_tfidf.names[enough_texts], number_of_clusters,
+                                            number_of_components, mini_batch, fingerprint=fingerprint)
+
+    cache_directory = os.path.dirname(cache_path)
+    if cache_directory and not os.path.isdir(cache_directory):
+        os.makedirs(cache_directory)
+    with open(cache_path, 'wb') as cache_file:
+        pickle.dump(contact_clusters, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    return contact_clusters
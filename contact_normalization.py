@@ -0,0 +1,141 @@
+"""
+
+This module normalizes the contact columns shared by the connectors: phone numbers, emails and full names.
+
+Rather than running Python per row via DataFrame.apply(), each function here does its work once per distinct value
+and maps the results back onto the column.  Handles and names repeat on nearly every message so this is far cheaper.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import pandas as pd
+import re
+
+_PHONE_PUNCTUATION_PATTERN = re.compile(r'[()\- ]+')
+_LEADING_ONE_PATTERN = re.compile(r'(\+?1)(\d{10})')
+
+
+def standardize_phone_or_email(phone_or_email):
+    """
+    Removes leading ones from phone numbers as well as any spaces or punctuation.  Emails are left untouched other
+    than the leading one removal, which only applies if they contain a run of 11 digits.
+
+    Args:
+        phone_or_email: a phone number or email as a string
+
+    Returns:
+        the standardized phone number or email
+    """
+    if '@' not in phone_or_email:
+        # Change unbreakable space characters into regular spaces.
+        phone_or_email = phone_or_email.replace(u'\xa0', u' ')
+        phone_or_email = _PHONE_PUNCTUATION_PATTERN.sub('', phone_or_email)
+    return _LEADING_ONE_PATTERN.sub(r'\2', phone_or_email)
+
+
+def standardize_phones_and_emails(phones_or_emails):
+    """
+    Same as standardize_phone_or_email() but for a whole column, only standardizing each distinct value once.
+
+    Args:
+        phones_or_emails: a series of phone numbers and emails
+
+    Returns:
+        a series of the standardized phone numbers and emails with the same index, missing values stay missing
+    """
+    codes, uniques = pd.factorize(phones_or_emails)
+    uniques = pd.Series(uniques, dtype=object)
+
+    is_phone = ~uniques.str.contains('@', regex=False)
+    phones = (uniques[is_phone]
+              .str.replace(u'\xa0', u' ', regex=False)
+              .str.replace(_PHONE_PUNCTUATION_PATTERN, '', regex=True))
+    uniques = uniques.where(~is_phone, phones)
+    uniques = uniques.str.replace(_LEADING_ONE_PATTERN, r'\2', regex=True)
+
+    # A code of -1 marks a missing value, append a missing value so those codes index to it.
+    standardized = pd.concat([uniques, pd.Series([None], dtype=object)], ignore_index=True).to_numpy()[codes]
+    return pd.Series(standardized, index=phones_or_emails.index, name=phones_or_emails.name)
+
+
+# The name given to messages whose phone/email isn't in the address book, the notebook relies on this exact value.
+UNKNOWN_FULL_NAME = 'nan nan nan'
+# The notebook shows UNKNOWN_FULL_NAME as this name, see to_display_names().
+UNKNOWN_DISPLAY_NAME = 'Unknown'
+
+
+def create_full_name(first, last, company):
+    """
+    Joins the non-empty name parts into a single name, e.g. "John Smith Acme Inc".
+
+    Note:
+        Missing parts (None or NaN) are skipped, which pandas produces depends on the dtype of the column so both
+        must be treated alike.  If every part is missing, e.g. the phone number wasn't in the address book,
+        UNKNOWN_FULL_NAME is returned.
+
+    Args:
+        first: the first name
+        last: the last name
+        company: the company
+
+    Returns:
+        the full name as a string
+    """
+    atoms = [atom for atom in [first, last, company] if atom is not None and not pd.isnull(atom)]
+    if not atoms:
+        return UNKNOWN_FULL_NAME
+    atoms = [atom for atom in atoms if atom]
+    atoms_as_str = [atom.encode('utf8') if type(atom).__name__ == 'unicode' else str(atom) for atom in atoms]
+    return ' '.join(atoms_as_str)
+
+
+def create_full_names(first, last, company):
+    """
+    Same as create_full_name() but for whole columns, only building each distinct name once.
+
+    Args:
+        first: a series of first names
+        last: a series of last names
+        company: a series of companies
+
+    Returns:
+        a series of full names with the same index as first
+    """
+    full_names = {}
+
+    def memoized_full_name(name_parts):
+        full_name = full_names.get(name_parts)
+        if full_name is None:
+            full_name = full_names[name_parts] = create_full_name(*name_parts)
+        return full_name
+
+    name_parts = zip(first.astype(object), last.astype(object), company.astype(object))
+    return pd.Series([memoized_full_name(parts) for parts in name_parts], index=first.index)
+
+
+def to_display_names(full_names):
+    """
+    Renames UNKNOWN_FULL_NAME to UNKNOWN_DISPLAY_NAME, as the notebook shows it.
+
+    Args:
+        full_names: a series of full names, e.g. the full_name column of the merged messages
+
+    Returns:
+        a series of the names to display, categorical if full_names is
+    """
+    if isinstance(full_names.dtype, pd.CategoricalDtype):
+        if UNKNOWN_FULL_NAME not in full_names.cat.categories:
+            return full_names
+        return full_names.cat.rename_categories({UNKNOWN_FULL_NAME: UNKNOWN_DISPLAY_NAME})
+    return full_names.replace(UNKNOWN_FULL_NAME, UNKNOWN_DISPLAY_NAME)
+
+
+def to_full_name(name):
+    """
+    Returns the full name the connectors store for a name, which may be as displayed by the notebook, see
+    to_display_names().  Modules that look contacts up by name, e.g. in the search index, pass names through this so
+    either works.
+    """
+    return UNKNOWN_FULL_NAME if name == UNKNOWN_DISPLAY_NAME else name
@@ -0,0 +1,70 @@
+"""
+
+This module shrinks the memory used by the message dataframes the connectors return, and reports on it.
+
+Columns such as full_name or phone_or_email repeat the same handful of strings on every row, so they're stored as
+categoricals, and 0/1 flags such as is_from_me are stored as int8 rather than int64.  Filtering and grouping on these
+columns works as before, though when grouping on a categorical pass observed=True so only contacts present in the
+(possibly filtered) dataframe are returned.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import pandas as pd
+
+# Columns holding strings that repeat across rows.
+CATEGORICAL_COLUMNS = ['full_name', 'phone_or_email', 'service', 'country']
+# Columns holding 0/1 flags.
+FLAG_COLUMNS = ['is_from_me', 'is_sent', 'is_read', 'is_emote', 'is_system_message', 'is_service_message',
+                'has_dd_results']
+
+
+def compact_dtypes(df, text_as_arrow=False):
+    """
+    Converts repeated string columns to categoricals and flag columns to int8, in place.  Columns that don't exist
+    or that already have a compact dtype are left alone.
+
+    Args:
+        df: a dataframe returned by one of the connectors
+        text_as_arrow: if true, the text column is stored as an Arrow backed string, which requires pyarrow
+
+    Returns:
+        the passed dataframe, for convenience
+    """
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    for column in FLAG_COLUMNS:
+        if column in df.columns and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = df[column].astype('int8')
+    if text_as_arrow and 'text' in df.columns:
+        df['text'] = df['text'].astype('string[pyarrow]')
+    return df
+
+
+def memory_report(df, text_as_arrow=False):
+    """
+    Reports the memory used by each column of a dataframe, before and after compact_dtypes().  The passed dataframe
+    is not modified.
+
+    Args:
+        df: the dataframe to report on
+        text_as_arrow: passed through to compact_dtypes()
+
+    Returns:
+        a dataframe indexed by column, with a final "Total" row, of the dtype and bytes used before and after
+        compaction along with the bytes saved
+    """
+    compacted_df = compact_dtypes(df.copy(), text_as_arrow=text_as_arrow)
+    report = pd.DataFrame({
+        'dtype_before': df.dtypes.astype(str),
+        'bytes_before': df.memory_usage(index=False, deep=True),
+        'dtype_after': compacted_df.dtypes.astype(str),
+        'bytes_after': compacted_df.memory_usage(index=False, deep=True),
+    }, columns=['dtype_before', 'bytes_before', 'dtype_after', 'bytes_after'])
+    report.loc['Total'] = ['', report['bytes_before'].sum(), '', report['bytes_after'].sum()]
+    report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+    report.index.name = 'column'
+    return report
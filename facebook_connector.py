@@ -11,19 +11,70 @@ from __future__ import print_function
 
 from bs4 import BeautifulSoup
 from fbchat_archive_parser import parser
+import array
+import collections
+import concurrent.futures
+import contextlib
+import html.entities
+from html.parser import HTMLParser
+import itertools
 import logging
+import numpy as np
 import os
 import io
 import pandas as pd
+import queue
 import re
 import requests
+import sqlite3
+import threading
+import time
 import warnings
+from xml.etree import ElementTree
+from xml.etree.ElementTree import XMLParser
+
+import dataframe_memory
+import instrumentation
 
 _messages_file = None
 
 _FB_ID_PATTERN = re.compile(r"(\d+)@facebook\.com")
 _mapped_fb_ids = {}
 
+# The page whose title holds the name of the user with a given Facebook ID
+FB_PROFILE_URL = "https://www.facebook.com/{}"
+DEFAULT_FB_ID_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".sms_analysis_cache", "fb_ids.sqlite")
+# How long names, and IDs facebook could not map, are kept in the cache
+FB_ID_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+FB_ID_NOT_FOUND_TTL_SECONDS = 7 * 24 * 60 * 60
+FB_ID_MAX_RETRIES = 3
+FB_ID_BACKOFF_SECONDS = 1
+_RETRIED_STATUS_CODES = {429, 500, 502, 503, 504}
+# Marks a lookup that failed with an error, as opposed to an unmapped ID
+_LOOKUP_FAILED = object()
+
+# Number of messages whose html is stripped per task of the process pool
+STRIP_HTML_CHUNK_SIZE = 20000
+# Markup the bare HTMLParser in strip_html() doesn't treat like BeautifulSoup:
+# tags whose strings BeautifulSoup keeps apart from the text or whose
+# whitespace it preserves, CDATA, and end tags of void elements such as </br>
+_HTML_STRIP_FALLBACK_PATTERN = re.compile(
+    r"<(?:script|style|pre|textarea|template|rt|rp|!\[)"
+    r"|</(?:area|base|basefont|bgsound|br|col|command|embed|frame|hr|image"
+    r"|img|input|isindex|keygen|link|menuitem|meta|nextid|param|source"
+    r"|spacer|track|wbr)\b", re.IGNORECASE)
+_HTML_ENTITY_PATTERN = re.compile(
+    r"&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);")
+_ASCII_SPACES = {ord(space): None for space in " \n\t\f\r"}
+
+# Number of parsed threads waiting to be processed when streaming
+_STREAMED_THREADS_QUEUE_SIZE = 4
+# Number of characters at the start of messages.htm searched for a thread,
+# which only the legacy format has
+_LEGACY_FORMAT_SNIFF_SIZE = 1024 * 1024
+_LEGACY_THREAD_MARKUP = '<div class="thread">'
+
 
 def initialize(dump_directory="."):
     """
@@ -60,80 +111,379 @@ def resolve_user_id(fb_provided_identifier):
     Returns:
         The name of the user if it is able to find it, otherwise the input
     """
-    fb_id_pattern_match = _FB_ID_PATTERN.match(fb_provided_identifier)
-    if not fb_id_pattern_match:
-        # fb_provided_identifier is not in the form
-        # We are expecting (_FB_ID_PATTERN),
-        # so it should not be mapped
-        return fb_provided_identifier
-    fb_numeric_id = fb_id_pattern_match.group(1)
-    if fb_numeric_id in _mapped_fb_ids:
-        # We have looked the id up before, so just return the result
-        return _mapped_fb_ids[fb_numeric_id]
+    return resolve_user_ids([fb_provided_identifier])[fb_provided_identifier]
+
+
+def resolve_user_ids(fb_provided_identifiers, max_workers=8,
+                     requests_per_second=5, cache_path=None):
+    """
+    Same as resolve_user_id() but for many identifiers at once. Each distinct
+    Facebook ID is only looked up once: first in memory, then in a sqlite
+    cache on disk, and only then on facebook.com. The remaining lookups run
+    on a pool of threads sharing one HTTP session, throttled to
+    requests_per_second and retried with exponential backoff when facebook
+    answers with an error status.
+
+    Note:
+        Both names and IDs facebook could not map are kept in the cache, for
+        FB_ID_CACHE_TTL_SECONDS and FB_ID_NOT_FOUND_TTL_SECONDS respectively.
+        Lookups that failed with an error are only remembered in memory, so
+        they are retried by the next run.
+
+    Args:
+        fb_provided_identifiers: iterable of identifier strings, see
+            resolve_user_id()
+        max_workers: number of lookups to run concurrently
+        requests_per_second: upper bound on the rate of requests sent to
+            facebook, across all workers
+        cache_path: path of the sqlite cache, defaults to
+            DEFAULT_FB_ID_CACHE_PATH
+
+    Returns:
+        a dict mapping each provided identifier to the user's name if it was
+        found, to the numeric ID if facebook could not map it, and to itself
+        if it isn't a Facebook ID
+    """
+    resolved = {}
+    unmapped_ids = set()
+    for identifier in set(fb_provided_identifiers):
+        fb_id_pattern_match = _FB_ID_PATTERN.match(identifier)
+        if not fb_id_pattern_match:
+            # The identifier is not in the form we are expecting
+            # (_FB_ID_PATTERN), so it should not be mapped
+            resolved[identifier] = identifier
+        elif fb_id_pattern_match.group(1) not in _mapped_fb_ids:
+            unmapped_ids.add(fb_id_pattern_match.group(1))
+
+    if unmapped_ids:
+        with _open_fb_id_cache(cache_path) as cache:
+            _mapped_fb_ids.update(_read_fb_id_cache(cache, unmapped_ids))
+            unmapped_ids.difference_update(_mapped_fb_ids)
+            if unmapped_ids:
+                logging.info("Looking up {0} Facebook IDs".format(
+                    len(unmapped_ids)))
+                looked_up = _look_up_fb_ids(
+                    unmapped_ids, max_workers, requests_per_second)
+                # Errors are remembered for this run only, see the Note above
+                _write_fb_id_cache(cache, {
+                    fb_numeric_id: name
+                    for fb_numeric_id, name in looked_up.items()
+                    if name is not _LOOKUP_FAILED})
+                for fb_numeric_id, name in looked_up.items():
+                    _mapped_fb_ids[fb_numeric_id] = (
+                        fb_numeric_id if name in (None, _LOOKUP_FAILED)
+                        else name)
+
+    for identifier in set(fb_provided_identifiers):
+        if identifier not in resolved:
+            resolved[identifier] = _mapped_fb_ids[
+                _FB_ID_PATTERN.match(identifier).group(1)]
+    return resolved
+
+
+# Opens the sqlite cache of Facebook IDs, creating it if needed.
+def _open_fb_id_cache(cache_path):
+    cache_path = cache_path or DEFAULT_FB_ID_CACHE_PATH
+    cache_directory = os.path.dirname(cache_path)
+    if cache_directory and not os.path.isdir(cache_directory):
+        os.makedirs(cache_directory)
+    cache = sqlite3.connect(cache_path)
+    # A NULL name records that facebook could not map the ID
+    cache.execute("""
+        CREATE TABLE IF NOT EXISTS fb_id (
+            fb_numeric_id TEXT PRIMARY KEY,
+            name TEXT,
+            resolved_at REAL NOT NULL
+        )""")
+    return contextlib.closing(cache)
+
+
+# Returns the names of the cached IDs that haven't expired, with the numeric
+# ID standing in for the name of those facebook could not map.
+def _read_fb_id_cache(cache, fb_numeric_ids):
+    now = time.time()
+    cached = {}
+    fb_numeric_ids = list(fb_numeric_ids)
+    # Stay well under sqlite's limit on the number of query parameters
+    for start in range(0, len(fb_numeric_ids), 500):
+        batch = fb_numeric_ids[start:start + 500]
+        rows = cache.execute(
+            "SELECT fb_numeric_id, name, resolved_at FROM fb_id "
+            "WHERE fb_numeric_id IN ({})".format(",".join("?" * len(batch))),
+            batch)
+        for fb_numeric_id, name, resolved_at in rows:
+            ttl = (FB_ID_CACHE_TTL_SECONDS if name is not None
+                   else FB_ID_NOT_FOUND_TTL_SECONDS)
+            if now - resolved_at < ttl:
+                cached[fb_numeric_id] = (name if name is not None
+                                         else fb_numeric_id)
+    return cached
+
+
+def _write_fb_id_cache(cache, names_by_fb_numeric_id):
+    now = time.time()
+    with cache:
+        cache.executemany(
+            "INSERT OR REPLACE INTO fb_id VALUES (?, ?, ?)",
+            [(fb_numeric_id, name, now)
+             for fb_numeric_id, name in names_by_fb_numeric_id.items()])
+
+
+# Looks the IDs up on facebook.com concurrently, returning a dict of the
+# user's name, None if facebook could not map the ID or _LOOKUP_FAILED.
+def _look_up_fb_ids(fb_numeric_ids, max_workers, requests_per_second):
+    fb_numeric_ids = list(fb_numeric_ids)
+    rate_limiter = _RateLimiter(requests_per_second)
+    with requests.Session() as session:
+        session.mount("https://", requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_workers))
+        session.mount("http://", requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_workers))
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            names = executor.map(
+                lambda fb_numeric_id: _look_up_fb_id(
+                    session, rate_limiter, fb_numeric_id),
+                fb_numeric_ids)
+            return dict(zip(fb_numeric_ids, names))
+
+
+def _look_up_fb_id(session, rate_limiter, fb_numeric_id):
     try:
-        # Try to find the user id
-        fb_user_page = requests.get(
-            "https://www.facebook.com/{}".format(fb_numeric_id))
-        fb_page_title = BeautifulSoup(fb_user_page.content).title.string
-        possible_username = fb_page_title.split("|")[0].strip()
-        if ((possible_username.startswith('Security Check Required')
+        for attempt in range(FB_ID_MAX_RETRIES + 1):
+            rate_limiter.wait()
+            fb_user_page = session.get(
+                FB_PROFILE_URL.format(fb_numeric_id), timeout=30)
+            if (fb_user_page.status_code not in _RETRIED_STATUS_CODES
+                    or attempt == FB_ID_MAX_RETRIES):
+                break
+            # Facebook is throttling us or having trouble, back off
+            retry_after = fb_user_page.headers.get("Retry-After", "")
+            time.sleep(float(retry_after) if retry_after.isdigit()
+                       else FB_ID_BACKOFF_SECONDS * 2 ** attempt)
+        # Facebook answers IDs it can't map with a "Page Not Found" page,
+        # whose status may be 404, so check the title before the status
+        fb_page_title = _get_page_title(fb_user_page)
+        possible_username = (fb_page_title or "").split("|")[0].strip()
+        if ((fb_user_page.status_code == 404
+             or possible_username.startswith('Security Check Required')
              or possible_username.startswith('Page Not Found'))):
             # Mapping not found for this user, this likely is not transient
             # since the HTTP request validly returned, therefore do not retry
-            _mapped_fb_ids[fb_numeric_id] = fb_numeric_id
             logging.info(
-                "Failed to lookup {0} via {1}, found result {2}".format(
-                    fb_provided_identifier, fb_numeric_id, fb_page_title))
-        else:
-            # Here we know that possible_username is the user's name
-            _mapped_fb_ids[fb_numeric_id] = possible_username
-            logging.debug("Mapped identifier {0} to {1}".format(
-                fb_provided_identifier, possible_username))
+                "Failed to lookup {0}, found result {1} {2}".format(
+                    fb_numeric_id, fb_user_page.status_code, fb_page_title))
+            return None
+        fb_user_page.raise_for_status()
+        if not possible_username:
+            raise ValueError("the profile page has no title")
+        # Here we know that possible_username is the user's name
+        logging.debug("Mapped identifier {0} to {1}".format(
+            fb_numeric_id, possible_username))
+        return possible_username
     except Exception as e:
         # Wasn't able to find the user - no harm done
-        _mapped_fb_ids[fb_numeric_id] = fb_numeric_id
         logging.warning("Ran into error {0} for {1}".format(e, fb_numeric_id))
-    return _mapped_fb_ids[fb_numeric_id]
+        return _LOOKUP_FAILED
 
 
-def get_cleaned_fully_merged_messages(strip_html_content=True,
-                                      resolve_fb_id=False):
+def _get_page_title(fb_user_page):
+    title = BeautifulSoup(fb_user_page.content, "html.parser").title
+    return title.string if title is not None else None
+
+
+class _RateLimiter(object):
     """
-    Parses the messages file to create dataframes that contain the messages and
-    their senders.
+    Spaces out calls to wait(), across threads, so at most
+    requests_per_second of them return per second.
+    """
+
+    def __init__(self, requests_per_second):
+        self._interval = 1.0 / requests_per_second
+        self._next_slot = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def strip_html(content):
+    """
+    Returns the text of a message without its html markup, the same as
+    BeautifulSoup(content, "html.parser").text but far cheaper: content
+    without markup is returned as is and simple markup goes through a bare
+    HTMLParser. Only content the two could disagree on, e.g. unknown
+    entities, <script> tags or unterminated tags, is handed to BeautifulSoup.
 
     Args:
-        strip_html_content: The messages.htm file might contain some html tags
-            in messages; this option will remove all html markup
-        resolve_fb_id: The messages.htm file doesn't always print Facebook
-            names, but sometimes ids instead; this will attempt
-            to resolve them, but requires a web request per id and is not
-            guaranteed to work. Note, that this method will not
-            necessarily succeed, since facebook blocks the number requests
-            above a certain volume threshold. Setting this to true can only
-            improve the results, since it can always fall back to the numeric
-            identifier, but it will increase the time it takes.
+        content: the content of a message
 
     Returns:
-        a dataframe that contains all messages with info about their senders
+        the text of the message
     """
-    if not _messages_file:
-        print("Please initialize the facebook_connector module.")
-        return
-    chats = None
-    with io.open(_messages_file, mode="rt", encoding="utf-8") as handle:
-        chats = parser.parse(handle=handle)
-    me = chats.user
-    addresses = set()
-    messages = []
+    if "<" not in content and "&" not in content:
+        return _collapse_whitespace(content)
+    if (_HTML_STRIP_FALLBACK_PATTERN.search(content) or
+            content.count("&") != sum(
+                1 for entity in _HTML_ENTITY_PATTERN.finditer(content)
+                if entity.group(1).startswith("#") or
+                entity.group(1) + ";" in html.entities.html5)):
+        return BeautifulSoup(content, "html.parser").text
+    extractor = _TextExtractor()
+    extractor.feed(content)
+    if extractor.rawdata:
+        # The content ends in an unterminated tag or comment
+        return BeautifulSoup(content, "html.parser").text
+    return extractor.get_text()
+
+
+# Like BeautifulSoup, collapses a string that only holds whitespace into a
+# single newline or space.
+def _collapse_whitespace(data):
+    if data and not data.translate(_ASCII_SPACES):
+        return "\n" if "\n" in data else " "
+    return data
+
+
+class _TextExtractor(HTMLParser):
+    """
+    Collects the text of the html fed to it. Like BeautifulSoup, a run of
+    text between two tags that only holds whitespace is collapsed into a
+    single newline or space.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self._strings = []
+        self._pending_data = []
+
+    def handle_data(self, data):
+        self._pending_data.append(data)
+
+    def end_data(self, *args):
+        if self._pending_data:
+            data = "".join(self._pending_data)
+            self._pending_data = []
+            self._strings.append(_collapse_whitespace(data))
+
+    handle_starttag = handle_endtag = handle_startendtag = end_data
+    handle_comment = handle_decl = handle_pi = unknown_decl = end_data
+
+    def get_text(self):
+        self.end_data()
+        return "".join(self._strings)
+
+
+# Strips the html of a batch of contents, runs in the worker processes.
+def _strip_html_batch(contents):
     # Suppressing warning that BS4 will display
     # when a message only contains a URL
     warnings.filterwarnings("ignore", category=UserWarning, module='bs4')
-    try:
-        threads = chats.threads.itervalues()
-    except AttributeError:
-        threads = chats.threads.values()
+    return [strip_html(content) for content in contents]
+
+
+# Strips the html of the messages of the threads yielded by _iter_threads(),
+# a chunk of threads at a time. Chunks are spread over a pool of processes,
+# unless there is only one, and yielded back in order.
+def _strip_threads(threads, processes):
+    chunks = _chunk_threads(threads, STRIP_HTML_CHUNK_SIZE)
+    first_chunks = list(itertools.islice(chunks, 2))
+    chunks = itertools.chain(first_chunks, chunks)
+    if processes == 1 or len(first_chunks) < 2:
+        # A single chunk isn't worth starting a pool of processes for
+        for chunk in chunks:
+            for thread in _apply_stripped_contents(
+                    chunk, _strip_html_batch(_chunk_contents(chunk))):
+                yield thread
+        return
+    # Only keep a few chunks in flight, so memory doesn't grow with the size
+    # of the archive
+    max_in_flight = 2 * (processes or os.cpu_count() or 1)
+    in_flight = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        for chunk in chunks:
+            in_flight.append((chunk, executor.submit(
+                _strip_html_batch, _chunk_contents(chunk))))
+            while len(in_flight) >= max_in_flight:
+                for thread in _apply_stripped_contents(
+                        *_pop_result(in_flight)):
+                    yield thread
+        while in_flight:
+            for thread in _apply_stripped_contents(*_pop_result(in_flight)):
+                yield thread
+
+
+def _pop_result(in_flight):
+    chunk, stripped_contents = in_flight.popleft()
+    return chunk, stripped_contents.result()
+
+
+# Groups threads into lists holding about chunk_size messages.
+def _chunk_threads(threads, chunk_size):
+    chunk = []
+    message_count = 0
     for thread in threads:
+        chunk.append(thread)
+        message_count += len(thread[1])
+        if message_count >= chunk_size:
+            yield chunk
+            chunk = []
+            message_count = 0
+    if chunk:
+        yield chunk
+
+
+def _chunk_contents(chunk):
+    return [content for _, messages in chunk for content, _, _, _ in messages]
+
+
+def _apply_stripped_contents(chunk, stripped_contents):
+    stripped_contents = iter(stripped_contents)
+    return [(participants, [(next(stripped_contents), date, from_me, sender)
+                            for _, date, from_me, sender in messages])
+            for participants, messages in chunk]
+
+
+# Parses the messages file and yields, per thread, the set of resolved
+# participants and a list of (text, date, is_from_me, sender) tuples for each
+# of its non-empty messages. See _iter_streamed_chats() for stream.
+def _iter_threads(strip_html_content, resolve_fb_id, processes=None,
+                  stream=False):
+    threads = _iter_unstripped_threads(resolve_fb_id, stream)
+    if strip_html_content:
+        threads = _strip_threads(threads, processes)
+    return threads
+
+
+def _iter_unstripped_threads(resolve_fb_id, stream):
+    # Suppressing warning that BS4 will display
+    # when a message only contains a URL
+    warnings.filterwarnings("ignore", category=UserWarning, module='bs4')
+    if stream:
+        chats = _iter_streamed_chats()
+    else:
+        with instrumentation.stage("parse"):
+            with io.open(_messages_file, mode="rt", encoding="utf-8") as handle:
+                history = parser.parse(handle=handle)
+        try:
+            threads = history.threads.itervalues()
+        except AttributeError:
+            threads = history.threads.values()
+        threads = list(threads)
+        if resolve_fb_id:
+            # Look up every distinct identifier at once, so the lookups can
+            # run concurrently, resolve_user_id() then finds them in memory
+            with instrumentation.stage("resolve_ids"):
+                resolve_user_ids(_get_identifiers(threads))
+        chats = ((history.user, thread) for thread in threads)
+    for me, thread in chats:
+        if stream and resolve_fb_id:
+            # At least look up the identifiers of the thread concurrently
+            resolve_user_ids(_get_identifiers([thread]))
         # This set holds the list of participants after their identifier
         # has been resolved to their name (see  resolve_user_id)
         resolved_participants = set()
@@ -142,36 +492,356 @@ def get_cleaned_fully_merged_messages(strip_html_content=True,
                 resolved_participant = resolve_user_id(
                     participant) if resolve_fb_id else participant
                 resolved_participants.add(resolved_participant)
-        addresses.update(resolved_participants)
+        messages = []
         for message in thread.messages:
             if not message.content or message.content.isspace():
                 continue
             sender = resolve_user_id(
                 message.sender) if resolve_fb_id else message.sender
             from_me = sender == me
-            if strip_html_content:
-                content = BeautifulSoup(message.content, "html.parser").text
-            else:
-                content = message.content
+            messages.append(
+                (message.content, message.timestamp, from_me, sender))
+        yield resolved_participants, messages
+
+
+# Returns the participants and senders of the threads that could be resolved.
+def _get_identifiers(threads):
+    return ([participant for thread in threads
+             for participant in thread.participants
+             if participant is not None and not participant.isspace()] +
+            [message.sender for thread in threads
+             for message in thread.messages if message.sender is not None])
+
+
+# Parses the messages file on a background thread and yields a tuple of the
+# user and each thread as soon as it has been parsed, so only a few threads
+# are held in memory at once. Unlike parser.parse(), threads with the same
+# participants are yielded separately rather than merged.
+def _iter_streamed_chats():
+    parsed = queue.Queue(maxsize=_STREAMED_THREADS_QUEUE_SIZE)
+    stopped = threading.Event()
+    finished = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                parsed.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise _StreamStopped()
+
+    def parse():
+        try:
+            with io.open(_messages_file, mode="rt",
+                         encoding="utf-8") as handle:
+                _parse_streamed(handle, put)
+            put(finished)
+        except _StreamStopped:
+            pass
+        except Exception as e:
+            try:
+                put(e)
+            except _StreamStopped:
+                pass
+
+    parsing_thread = threading.Thread(target=parse)
+    parsing_thread.daemon = True
+    parsing_thread.start()
+    try:
+        while True:
+            item = parsed.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Lets the parsing thread exit if the caller stopped early
+        stopped.set()
+        parsing_thread.join()
+
+
+class _StreamStopped(Exception):
+    pass
+
+
+# Same as parser.parse(), but calls on_chat with the user and each thread
+# instead of collecting them. Every archive format is tried in turn, as long
+# as no thread was passed on yet.
+def _parse_streamed(handle, on_chat):
+    chat_count = [0]
+
+    def on_thread(user, thread):
+        chat_count[0] += 1
+        on_chat((user, thread))
+
+    parser_classes = _STREAMED_PARSER_CLASSES
+    # The parsers of the newer formats would build the whole of a legacy
+    # archive in memory before giving up on it, so recognize it upfront
+    if _LEGACY_THREAD_MARKUP in handle.read(_LEGACY_FORMAT_SNIFF_SIZE):
+        parser_classes = [_StreamedLegacyMessageHtmlParser]
+    handle.seek(0)
+    for parser_class in parser_classes:
+        message_parser = parser_class(handle)
+        message_parser.on_thread = on_thread
+        try:
+            message_parser.parse_impl()
+            return
+        except parser.UnsuitableParserError:
+            if chat_count[0]:
+                raise
+            # Rewind for the next parser.
+            handle.seek(0)
+    raise parser.UnsuitableParserError("no suitable parser found")
+
+
+class _StreamedThreadsMixin(object):
+    """
+    Hands each parsed thread to self.on_thread rather than saving it.
+    """
+
+    def save_thread(self, thread):
+        if thread is not None:
+            self.on_thread(self.user, thread)
+
+
+class _StreamedLegacyMessageHtmlParser(_StreamedThreadsMixin,
+                                       parser.LegacyMessageHtmlParser):
+    """
+    The legacy archive format is a single file, which ElementTree would build
+    up in memory as it goes, so drop the elements of each parsed thread.
+    """
+
+    def parse_impl(self):
+        xml_parser = XMLParser(encoding=str('UTF-8'))
+        element_iter = ElementTree.iterparse(
+            self.handle, events=("start", "end"), parser=xml_parser)
+        for pos, element in element_iter:
+            tag = element.tag
+            class_attr = element.attrib.get('class', [])
+            if tag == "h1" and pos == "end":
+                if not self.user:
+                    self.user = element.text.strip()
+            elif tag == "div" and "thread" in class_attr and pos == "start":
+                participants = self.parse_participants(element)
+                thread = self.parse_thread(participants, element_iter, True)
+                self.save_thread(thread)
+                element.clear()
+
+
+class _StreamedSplitMessageHtmlParser(_StreamedThreadsMixin,
+                                      parser.SplitMessageHtmlParser):
+    pass
+
+
+class _StreamedSplitMessageHtmlWithImagesParser(
+        _StreamedThreadsMixin, parser.SplitMessageHtmlWithImagesParser):
+    pass
+
+
+# In the order parser.parse() tries them
+_STREAMED_PARSER_CLASSES = [_StreamedSplitMessageHtmlWithImagesParser,
+                            _StreamedSplitMessageHtmlParser,
+                            _StreamedLegacyMessageHtmlParser]
+
+
+class _MessageColumns(object):
+    """
+    Buffers messages in the shape of get_cleaned_fully_merged_messages() as
+    one list per column, which takes far less memory than a dict per row.
+    """
+
+    def __init__(self):
+        self._clear()
+
+    def _clear(self):
+        self.texts = []
+        self.dates = []
+        self.from_me = array.array("b")
+        self.full_names = []
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add_thread(self, resolved_participants, thread_messages):
+        for content, timestamp, from_me, sender in thread_messages:
             # In the following we add a single message to our dataframe
             if from_me:
                 # If the user is sending a message to a group,
                 # then we need to add one message
                 # per group participant to the dataframe
-                for participant in resolved_participants:
-                    messages.append({
-                        'text': content,
-                        'date': message.timestamp,
-                        'is_from_me': from_me,
-                        'full_name': participant
-                    })
+                recipients = resolved_participants
             else:
-                messages.append({
-                    'text': content,
-                    'date': message.timestamp,
-                    'is_from_me': from_me,
-                    'full_name': sender
-                })
-    address_book_df = pd.DataFrame(data=list(addresses), columns=["full_name"])
-    messages_df = pd.DataFrame.from_records(messages)
+                recipients = [sender]
+            for full_name in recipients:
+                self.texts.append(content)
+                self.dates.append(timestamp)
+                self.from_me.append(from_me)
+                self.full_names.append(full_name)
+
+    def flush(self, first_row_index=0):
+        """
+        Returns the buffered messages as a dataframe and empties the buffers.
+        """
+        messages_df = pd.DataFrame(
+            {'text': self.texts,
+             'date': self.dates,
+             'is_from_me': np.array(self.from_me, dtype=bool),
+             'full_name': self.full_names},
+            columns=['text', 'date', 'is_from_me', 'full_name'],
+            index=pd.RangeIndex(first_row_index, first_row_index + len(self)))
+        self._clear()
+        return dataframe_memory.compact_dtypes(messages_df)
+
+
+def get_cleaned_fully_merged_messages(strip_html_content=True,
+                                      resolve_fb_id=False, processes=None):
+    """
+    Parses the messages file to create dataframes that contain the messages and
+    their senders.
+
+    Args:
+        strip_html_content: The messages.htm file might contain some html tags
+            in messages; this option will remove all html markup
+        resolve_fb_id: The messages.htm file doesn't always print Facebook
+            names, but sometimes ids instead; this will attempt
+            to resolve them, but requires a web request per id and is not
+            guaranteed to work. Note, that this method will not
+            necessarily succeed, since facebook blocks the number requests
+            above a certain volume threshold. Setting this to true can only
+            improve the results, since it can always fall back to the numeric
+            identifier, but it will increase the time it takes. Results are
+            cached on disk, see resolve_user_ids().
+        processes: number of processes to strip html with, defaults to the
+            number of CPUs. Small archives are stripped in this process.
+
+    Returns:
+        a dataframe that contains all messages with info about their senders
+    """
+    if not _messages_file:
+        print("Please initialize the facebook_connector module.")
+        return
+    addresses = set()
+    message_columns = _MessageColumns()
+    # Html is stripped while later threads are still being read, so it's
+    # timed as part of reading the threads
+    with instrumentation.stage("read_threads") as current_stage:
+        for resolved_participants, thread_messages in _iter_threads(
+                strip_html_content, resolve_fb_id, processes):
+            addresses.update(resolved_participants)
+            message_columns.add_thread(resolved_participants, thread_messages)
+        current_stage.rows = len(message_columns)
+    with instrumentation.stage("build_dataframe") as current_stage:
+        messages_df = message_columns.flush()
+        address_book_df = pd.DataFrame(data=list(addresses),
+                                       columns=["full_name"])
+        current_stage.rows = messages_df.shape[0]
     return messages_df, address_book_df
+
+
+def iter_cleaned_fully_merged_messages(batch_size=50000,
+                                      strip_html_content=True,
+                                      resolve_fb_id=False, processes=None):
+    """
+    Same as get_cleaned_fully_merged_messages(), but the messages file is
+    parsed a thread at a time and the messages are yielded in batches, so
+    the memory used depends on the largest thread rather than on the size
+    of the archive.
+
+    Note:
+        Threads with the same participants are not merged, so the order of
+        the rows can differ from get_cleaned_fully_merged_messages(). Facebook
+        IDs are only looked up concurrently within a thread.
+
+    Args:
+        batch_size: the minimum number of rows per batch, a batch always ends
+            with a whole thread so it can hold more rows than this
+        strip_html_content: see get_cleaned_fully_merged_messages()
+        resolve_fb_id: see get_cleaned_fully_merged_messages()
+        processes: see get_cleaned_fully_merged_messages()
+
+    Returns:
+        a generator of dataframes of messages with info about their senders,
+        the rows are numbered continuously across batches
+    """
+    if not _messages_file:
+        print("Please initialize the facebook_connector module.")
+        return
+    rows_yielded = 0
+    message_columns = _MessageColumns()
+    for resolved_participants, thread_messages in _iter_threads(
+            strip_html_content, resolve_fb_id, processes, stream=True):
+        message_columns.add_thread(resolved_participants, thread_messages)
+        if len(message_columns) >= batch_size:
+            messages_df = message_columns.flush(rows_yielded)
+            rows_yielded += messages_df.shape[0]
+            yield messages_df
+    if len(message_columns):
+        yield message_columns.flush(rows_yielded)
+
+
+def write_cleaned_fully_merged_messages(output_path, batch_size=50000,
+                                        strip_html_content=True,
+                                        resolve_fb_id=False, processes=None):
+    """
+    Writes the messages of iter_cleaned_fully_merged_messages() to a CSV file
+    batch by batch.
+
+    Args:
+        output_path: path of the CSV file to write, it is overwritten
+        batch_size: see iter_cleaned_fully_merged_messages()
+        strip_html_content: see get_cleaned_fully_merged_messages()
+        resolve_fb_id: see get_cleaned_fully_merged_messages()
+        processes: see get_cleaned_fully_merged_messages()
+
+    Returns:
+        the number of messages written
+    """
+    messages_written = 0
+    for i, messages_df in enumerate(iter_cleaned_fully_merged_messages(
+            batch_size, strip_html_content, resolve_fb_id, processes)):
+        messages_df.to_csv(output_path, encoding="utf-8",
+                           mode="w" if i == 0 else "a", header=i == 0,
+                           index_label="row_index")
+        messages_written += messages_df.shape[0]
+    return messages_written
+
+
+def get_compact_messages(strip_html_content=True, resolve_fb_id=False,
+                         processes=None):
+    """
+    Same as get_cleaned_fully_merged_messages(), but messages sent by the user
+    to a group are not repeated once per participant. See the group_messages
+    module for details of the format, and group_messages.expand_group_messages()
+    with on='full_name' and keep_unmatched=False to get the expanded shape.
+
+    Args:
+        strip_html_content: see get_cleaned_fully_merged_messages()
+        resolve_fb_id: see get_cleaned_fully_merged_messages()
+        processes: see get_cleaned_fully_merged_messages()
+
+    Returns:
+        a tuple of the compact messages dataframe, where each thread is given
+        a chat_id and full_name holds the sender of messages the user
+        received, and the chat members dataframe
+    """
+    if not _messages_file:
+        print("Please initialize the facebook_connector module.")
+        return
+    messages = []
+    chat_members = []
+    for chat_id, (resolved_participants, thread_messages) in enumerate(
+            _iter_threads(strip_html_content, resolve_fb_id, processes)):
+        chat_members.extend(
+            (chat_id, participant) for participant in resolved_participants)
+        messages.extend(
+            (content, timestamp, from_me, chat_id, None if from_me else sender)
+            for content, timestamp, from_me, sender in thread_messages)
+    messages_df = pd.DataFrame.from_records(
+        messages,
+        columns=['text', 'date', 'is_from_me', 'chat_id', 'full_name'])
+    chat_members_df = pd.DataFrame.from_records(
+        chat_members, columns=['chat_id', 'full_name'])
+    return (dataframe_memory.compact_dtypes(messages_df),
+            dataframe_memory.compact_dtypes(chat_members_df))
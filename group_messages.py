@@ -0,0 +1,107 @@
+"""
+
+This module works with the compact representation of messages that both connectors can produce via their
+get_compact_messages() methods.
+
+In the fully merged dataframes a group message you sent is repeated once per participant of the chat, which for heavy
+group chat users multiplies the number of rows, and the memory taken by their text, several times over.  The compact
+representation instead has:
+
+1. A messages dataframe with one row per message and a chat_id column.  The participant column (e.g. phone_or_email)
+   holds the sender for messages you received and is empty for messages you sent.
+2. A chat members dataframe with one row per participant of each chat, holding the participant's details.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import pandas as pd
+
+import contact_normalization
+
+
+# Gives participants missing from chat_members_df the unknown full name, the column may be a categorical.
+def __fill_unknown_full_names(full_names):
+    unknown = contact_normalization.UNKNOWN_FULL_NAME
+    if isinstance(full_names.dtype, pd.CategoricalDtype) and unknown not in full_names.cat.categories:
+        full_names = full_names.cat.add_categories([unknown])
+    return full_names.fillna(unknown)
+
+
+def expand_group_messages(messages_df, chat_members_df, on='phone_or_email', keep_unmatched=True):
+    """
+    Expands compact messages into the shape of the fully merged dataframes, i.e. messages you sent are repeated once
+    per participant of their chat, and every row carries the details of its participant.
+
+    Args:
+        messages_df: compact messages, one row per message
+        chat_members_df: the participants of each chat, must contain chat_id and the on column
+        on: the column identifying a participant, present in both dataframes
+        keep_unmatched: if true, messages you sent to a chat with no known participants are kept as a single row with
+            no participant, otherwise they are dropped
+
+    Returns:
+        a dataframe with a row per message and participant, in the order of messages_df
+    """
+    is_from_me = messages_df['is_from_me'].astype(bool)
+    position_column = '__message_position'
+    messages_df = messages_df.assign(**{position_column: range(messages_df.shape[0])})
+
+    received = messages_df[~is_from_me].merge(chat_members_df, how='left', on=['chat_id', on])
+    sent = messages_df[is_from_me].drop(on, axis=1).merge(chat_members_df, how='left' if keep_unmatched else 'inner',
+                                                          on='chat_id')
+    columns = list(messages_df.columns) + [column for column in chat_members_df.columns
+                                           if column not in messages_df.columns]
+    expanded = pd.concat([received, sent], ignore_index=True)[columns]
+
+    # Restore the order of the passed messages, participants of the same message stay in chat_members_df order.
+    expanded.sort_values(by=position_column, inplace=True, kind='mergesort')
+    expanded.drop(position_column, axis=1, inplace=True)
+    if 'full_name' in expanded.columns:
+        expanded['full_name'] = __fill_unknown_full_names(expanded['full_name'])
+    expanded.reset_index(inplace=True, drop=True)
+    expanded.index.name = messages_df.index.name
+    return expanded
+
+
+def count_messages_by_contact(messages_df, chat_members_df, on='phone_or_email', keep_unmatched=True):
+    """
+    Counts the texts sent to, received from and exchanged with each contact without expanding the compact messages.
+    The counts match grouping the expanded messages by full_name.
+
+    Args:
+        messages_df: compact messages, one row per message
+        chat_members_df: the participants of each chat, must contain chat_id, full_name and the on column
+        on: the column identifying a participant, present in both dataframes
+        keep_unmatched: see expand_group_messages()
+
+    Returns:
+        a dataframe indexed by full_name with "Texts exchanged", "Texts received" and "Texts sent" columns, sorted by
+        the number of texts exchanged
+    """
+    is_from_me = messages_df['is_from_me'].astype(bool)
+    unknown = contact_normalization.UNKNOWN_FULL_NAME
+
+    # Each message you received counts once, towards its sender.
+    received = messages_df.loc[~is_from_me, ['chat_id', on]]
+    if on != 'full_name':
+        received = received.merge(chat_members_df[['chat_id', on, 'full_name']], how='left', on=['chat_id', on])
+    texts_received = received['full_name'].astype(object).fillna(unknown).value_counts()
+
+    # Each message you sent counts once towards every participant of its chat, so count per chat and then spread the
+    # counts over the (far fewer) chat members.
+    sent_per_chat = messages_df.loc[is_from_me].groupby('chat_id').size().rename('texts')
+    sent = chat_members_df[['chat_id', 'full_name']].merge(sent_per_chat, left_on='chat_id', right_index=True)
+    texts_sent = sent.groupby('full_name', observed=True)['texts'].sum()
+    if keep_unmatched:
+        unmatched = messages_df.loc[is_from_me, 'chat_id']
+        unmatched_count = (~unmatched.isin(chat_members_df['chat_id'])).sum()
+        if unmatched_count:
+            texts_sent = texts_sent.add(pd.Series({unknown: unmatched_count}), fill_value=0)
+
+    counts = pd.DataFrame({'Texts received': texts_received, 'Texts sent': texts_sent}).fillna(0).astype(int)
+    counts['Texts exchanged'] = counts['Texts received'] + counts['Texts sent']
+    counts.index.name = 'full_name'
+    return counts[['Texts exchanged', 'Texts received', 'Texts sent']].sort_values(by='Texts exchanged',
+                                                                                  ascending=False)
@@ -0,0 +1,182 @@
+"""
+
+This module records how long each stage of loading messages takes, how many rows it produces and its peak memory,
+so it's clear which stage is slow on a given backup or archive.
+
+The connectors mark their stages with stage(), which does nothing unless a profile is active:
+
+    with instrumentation.profile() as loader_profile:
+        iphone_connector.get_cleaned_fully_merged_messages()
+    print(loader_profile.report())
+
+Stages can be nested, e.g. the SQL read within loading the message table, and each is reported under the stage it
+ran in.  When no profile is active stage() returns a shared object that ignores everything, so marking stages costs
+next to nothing.  Peak memory is measured with tracemalloc, which slows Python down, so it can be turned off.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import cProfile
+import collections
+import contextlib
+import pandas as pd
+import time
+import tracemalloc
+
+# A stage of a profile.  peak_mb is the memory allocated during the stage above what was allocated when it started,
+# or None if memory isn't measured.  rows is None if the stage didn't report a row count.
+StageRecord = collections.namedtuple('StageRecord', ['stage', 'depth', 'seconds', 'rows', 'peak_mb'])
+
+# The profile stages are recorded in, None when not profiling.
+_active_profile = None
+
+
+class _NullStage(object):
+    """
+    Stands in for a stage when no profile is active, setting rows on it is ignored.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    """
+    A stage being recorded, set rows on it to report the number of rows it produced.
+    """
+
+    def __init__(self, profile, name):
+        self.rows = None
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self):
+        self._profile._enter(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._start
+        self._profile._exit(self, seconds)
+        return False
+
+
+class Profile(object):
+    """
+    The stages recorded while a profile is active, see profile().
+
+    Attributes:
+        records: a StageRecord per stage, in the order they started
+        measure_memory: whether the peak memory of each stage is measured
+    """
+
+    def __init__(self, measure_memory=True):
+        self.records = []
+        self.measure_memory = measure_memory
+        # The stages currently running, each with its index in records, its memory when it started and the highest
+        # peak seen so far within it.
+        self._running = []
+
+    def _enter(self, stage):
+        current_memory = None
+        if self.measure_memory:
+            current_memory, peak = tracemalloc.get_traced_memory()
+            if self._running:
+                self._running[-1][3] = max(self._running[-1][3], peak)
+            tracemalloc.reset_peak()
+        self._running.append([stage, len(self.records), current_memory, current_memory])
+        # Reserve the stage's place so stages are listed in the order they started.
+        self.records.append(None)
+
+    def _exit(self, stage, seconds):
+        running_stage, index, start_memory, highest_peak = self._running.pop()
+        assert running_stage is stage, 'Stages must exit in the reverse order they entered'
+        peak_mb = None
+        if self.measure_memory:
+            peak = max(highest_peak, tracemalloc.get_traced_memory()[1])
+            if self._running:
+                self._running[-1][3] = max(self._running[-1][3], peak)
+            tracemalloc.reset_peak()
+            peak_mb = (peak - start_memory) / 2 ** 20
+        self.records[index] = StageRecord(stage._name, len(self._running), seconds, stage.rows, peak_mb)
+
+    def to_dataframe(self):
+        """
+        Returns the records as a dataframe with a row per stage.
+        """
+        return pd.DataFrame([record for record in self.records if record is not None], columns=StageRecord._fields)
+
+    def report(self):
+        """
+        Returns the records formatted as a table, nested stages are indented under the stage they ran in.
+        """
+        lines = ['{0:<50} {1:>10} {2:>12} {3:>12}'.format('stage', 'seconds', 'rows', 'peak memory')]
+        for record in self.records:
+            if record is None:
+                continue
+            lines.append('{0:<50} {1:>10.3f} {2:>12} {3:>12}'.format(
+                '  ' * record.depth + record.stage, record.seconds,
+                '{0:,}'.format(record.rows) if record.rows is not None else '',
+                '{0:,.1f} MB'.format(record.peak_mb) if record.peak_mb is not None else ''))
+        return '\n'.join(lines)
+
+
+def stage(name):
+    """
+    Marks a stage of loading messages, use it as a context manager.  Set rows on the object it returns to report
+    the number of rows the stage produced.
+
+    Args:
+        name: the name the stage is reported under
+
+    Returns:
+        a context manager that records the stage in the active profile, or does nothing if there isn't one
+    """
+    if _active_profile is None:
+        return _NULL_STAGE
+    return _Stage(_active_profile, name)
+
+
+@contextlib.contextmanager
+def profile(measure_memory=True, cprofile_path=None):
+    """
+    Records the stages run within it.  Profiles can't be nested.
+
+    Args:
+        measure_memory: if true, the peak memory of each stage is measured with tracemalloc
+        cprofile_path: if passed, the code run within it is also profiled with cProfile and the stats dumped to this
+            path, read them with pstats or a viewer such as snakeviz
+
+    Yields:
+        a Profile the stages are recorded in
+    """
+    global _active_profile
+    assert _active_profile is None, 'A profile is already active'
+    current_profile = Profile(measure_memory)
+    started_tracemalloc = measure_memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if cprofile_path else None
+    _active_profile = current_profile
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield current_profile
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        _active_profile = None
+        if started_tracemalloc:
+            tracemalloc.stop()
@@ -14,18 +14,42 @@ from __future__ import print_function
 from __future__ import division
 
 import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import json
+import numpy as np
 import os
 import pandas as pd
-import re
 import sqlite3
 
 from IPython.display import display
 
+import contact_normalization
+import dataframe_memory
+import group_messages
+import instrumentation
+import message_cube
+import message_export
+import message_search
+
 MESSAGE_DB = '3d0d7e5fb2ce288813306e4d4636395e047a3d28'
 ADDRESS_DB = '31bb7ba8914766d4ba40d6dfb6113c8b614be442'
 
+# iOS stores dates relative to 2001-01-01, either in seconds or, since iOS 11, in nanoseconds.
+APPLE_EPOCH = pd.Timestamp('2001-01-01')
+# Any value at least this large must be nanoseconds, as seconds it would be over 3,000 years after 2001.
+_NANOSECONDS_THRESHOLD = 10 ** 11
+
+# Bump this whenever the shape of the merged dataframe changes so stale on-disk caches get rebuilt.
+CACHE_VERSION = 4
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.sms_analysis_cache')
+
 # Module variables
 _latest_sync_dir = None
+_message_path = None
+_address_path = None
 _message_con = None
 _address_con = None
 
@@ -33,6 +57,15 @@ _address_con = None
 # --------------
 
 
+# Returns the directory iTunes keeps a subdirectory per backup in.
+def __get_backup_base_dir():
+    if os.getenv('APPDATA'):  # Windows.
+        base_dir = os.path.join(os.getenv('APPDATA'), 'Apple Computer')
+    else:  # Mac.
+        base_dir = os.path.join(os.getenv('HOME'), 'Library', 'Application Support')
+    return os.path.join(base_dir, 'MobileSync', 'Backup')
+
+
 # Get's the most recently updated directory within the passed directory.
 def __get_latest_dir_in_dir(directory):
     newest_path, newest_date = ('', -1)
@@ -45,14 +78,64 @@ def __get_latest_dir_in_dir(directory):
     return newest_path
 
 
-# Removes leading ones from phone numbers as well as any spaces or punctuation.
-def __standardize_phone_numbers(row):
-    phone_or_email = row.phone_or_email
-    if '@' not in phone_or_email:
-        # Change unbreakable space characters into regular spaces.
-        phone_or_email = phone_or_email.replace(u'\xa0', u' ')
-        phone_or_email = re.sub(r'[()\- ]+', '', phone_or_email)
-    return re.sub(r'(\+?1)(\d{10})', r'\2', phone_or_email)
+# Converts iOS dates, given in either seconds or nanoseconds since 2001 (decided per value), into datetime64[ns]
+# without losing sub-second precision.  NULL, 0 and unparseable values become NaT, as do dates outside the range
+# datetime64[ns] can hold (1677 to 2262), e.g. the year 1604 iOS gives birthdays saved without a year.
+def __apple_timestamps_to_datetime(values):
+    values = pd.to_numeric(pd.Series(values), errors='coerce')
+    is_missing = values.isnull().to_numpy() | (values == 0).to_numpy()
+    values = values.fillna(0)
+    is_nanoseconds = (values.abs() >= _NANOSECONDS_THRESHOLD).to_numpy()
+    # Scaling such dates to nanoseconds would overflow int64 and wrap around, so find them in floating point first.
+    approximate_nanoseconds = (np.where(is_nanoseconds, 1, 1e9) * values.to_numpy(dtype=np.float64) +
+                               APPLE_EPOCH.value)
+    is_missing |= ((approximate_nanoseconds <= pd.Timestamp.min.value) |
+                   (approximate_nanoseconds >= pd.Timestamp.max.value))
+    values = values.mask(is_missing, 0)
+    if pd.api.types.is_integer_dtype(values):
+        # Stay in integer space, float64 can't represent nanosecond timestamps exactly.
+        nanoseconds = values.to_numpy(dtype=np.int64)
+        nanoseconds = np.where(is_nanoseconds, nanoseconds, nanoseconds * 10 ** 9)
+    else:
+        nanoseconds = values.to_numpy(dtype=np.float64)
+        nanoseconds = np.where(is_nanoseconds, nanoseconds, nanoseconds * 1e9).round().astype(np.int64)
+    nanoseconds = np.where(is_missing, 0, nanoseconds) + APPLE_EPOCH.value
+    dates = pd.Series(pd.to_datetime(nanoseconds, unit='ns'), index=values.index)
+    return dates.mask(is_missing)
+
+
+# Returns a SQL fragment (and its params) restricting message ROWIDs to those above min_message_id and at most
+# max_message_id, the fragment starts with the passed keyword (e.g. WHERE or AND) so it can be appended directly
+# to a query.
+def __get_message_id_filter(column, min_message_id, max_message_id=None, keyword='AND'):
+    conditions, params = [], []
+    if min_message_id is not None:
+        conditions.append('{0} > ?'.format(column))
+        params.append(int(min_message_id))
+    if max_message_id is not None:
+        conditions.append('{0} <= ?'.format(column))
+        params.append(int(max_message_id))
+    if not conditions:
+        return '', []
+    return ' {0} {1}'.format(keyword, ' AND '.join(conditions)), params
+
+
+# Returns a SQL fragment (and its params), starting with AND, restricting message.date to [since, until).  Since a
+# date may be stored in either seconds or nanoseconds we check both ranges, which still lets SQLite use an index.
+def __get_message_date_filter(since, until):
+    min_seconds, max_seconds = -_NANOSECONDS_THRESHOLD + 1, _NANOSECONDS_THRESHOLD
+    min_nanoseconds, max_nanoseconds = _NANOSECONDS_THRESHOLD, np.iinfo(np.int64).max
+    if since is not None:
+        since_nanoseconds = (pd.Timestamp(since) - APPLE_EPOCH).value
+        min_seconds = max(min_seconds, -(-since_nanoseconds // 10 ** 9))  # Round up to the next whole second.
+        min_nanoseconds = max(min_nanoseconds, since_nanoseconds)
+    if until is not None:
+        until_nanoseconds = (pd.Timestamp(until) - APPLE_EPOCH).value
+        max_seconds = min(max_seconds, -(-until_nanoseconds // 10 ** 9))
+        max_nanoseconds = min(max_nanoseconds, until_nanoseconds)
+    # A date of 0 means it's missing, which never falls within a date range.
+    return (' AND date != 0 AND ((date >= ? AND date < ?) OR (date >= ? AND date < ?))',
+            [min_seconds, max_seconds, min_nanoseconds, max_nanoseconds])
 
 
 # --------------
@@ -61,61 +144,73 @@ def __standardize_phone_numbers(row):
 
 # Joins messages with the phone numbers/emails that sent them.  This handles group messages as well where one
 # message could be sent to multiple people.
-def __get_message_id_joined_to_phone_or_email():
-    message_id_joined_to_phone_or_email = pd.read_sql_query('''
-    SELECT
-      handle.id AS phone_or_email, handle.service, handle.country,
-      chat_message_join.message_id, chat.ROWID AS chat_id
-    FROM handle, chat_handle_join, chat, chat_message_join, message
-    WHERE
-      handle.ROWID = chat_handle_join.handle_id
-      AND chat_handle_join.chat_id = chat.ROWID
-      AND chat.ROWID = chat_message_join.chat_id
-      AND message.ROWID = chat_message_join.message_id
-      AND ((chat_handle_join.handle_id = message.handle_id) OR message.is_from_me)''', _message_con)
+def __get_message_id_joined_to_phone_or_email(min_message_id=None):
+    message_id_filter, params = __get_message_id_filter('message.ROWID', min_message_id)
+    with instrumentation.stage('read_sql') as current_stage:
+        message_id_joined_to_phone_or_email = pd.read_sql_query('''
+        SELECT
+          handle.id AS phone_or_email, handle.service, handle.country,
+          chat_message_join.message_id, chat.ROWID AS chat_id
+        FROM handle, chat_handle_join, chat, chat_message_join, message
+        WHERE
+          handle.ROWID = chat_handle_join.handle_id
+          AND chat_handle_join.chat_id = chat.ROWID
+          AND chat.ROWID = chat_message_join.chat_id
+          AND message.ROWID = chat_message_join.message_id
+          AND ((chat_handle_join.handle_id = message.handle_id) OR message.is_from_me)''' + message_id_filter,
+            _message_con, params=params)
+        current_stage.rows = message_id_joined_to_phone_or_email.shape[0]
 
     # Clean it up a bit.
-    message_id_joined_to_phone_or_email['country'] = message_id_joined_to_phone_or_email['country'].str.lower()
-    message_id_joined_to_phone_or_email['phone_or_email'] = message_id_joined_to_phone_or_email.apply(
-        __standardize_phone_numbers, axis=1)
+    with instrumentation.stage('normalize_phones_and_emails'):
+        message_id_joined_to_phone_or_email['country'] = message_id_joined_to_phone_or_email['country'].str.lower()
+        message_id_joined_to_phone_or_email['phone_or_email'] = contact_normalization.standardize_phones_and_emails(
+            message_id_joined_to_phone_or_email['phone_or_email'])
     return message_id_joined_to_phone_or_email
 
 
 # Join the table that has message IDs and phones numbers/emails with the address book in order to get the full
 # name and additional info.
-def __get_address_joined_with_message_id(address_book):
-    address_joined_with_message_id = (
-        __get_message_id_joined_to_phone_or_email().merge(address_book, how='left', left_on='phone_or_email',
-                                                          right_index=True, indicator='merge_chat_with_address')
-    )
-    address_joined_with_message_id = address_joined_with_message_id.drop(['ROWID'], axis=1)
-
-    key_fields = ['message_id', 'chat_id', 'phone_or_email']
-    duplicates = address_joined_with_message_id.duplicated(subset=key_fields,
-                                                           keep=False)
-    if not sum(duplicates) == 0:
-        error_message = ('WARNING: tuple (message_id, chat_id, and phone_or_email) '
-                         'do not form a composite key. There are %i duplicates. '
-                         'Dropping the duplicates so later calculations are still valid.')
-        print(error_message % sum(duplicates))
-        address_joined_with_message_id.drop_duplicates(subset=key_fields, inplace=True)
+def __get_address_joined_with_message_id(address_book, min_message_id=None):
+    with instrumentation.stage('join_chats') as current_stage:
+        message_id_joined_to_phone_or_email = __get_message_id_joined_to_phone_or_email(min_message_id)
+        current_stage.rows = message_id_joined_to_phone_or_email.shape[0]
+
+    with instrumentation.stage('merge_address_book') as current_stage:
+        address_joined_with_message_id = message_id_joined_to_phone_or_email.merge(
+            address_book, how='left', left_on='phone_or_email', right_index=True, indicator='merge_chat_with_address')
+        address_joined_with_message_id = address_joined_with_message_id.drop(['ROWID'], axis=1)
+        current_stage.rows = address_joined_with_message_id.shape[0]
+
+    with instrumentation.stage('dedup') as current_stage:
+        key_fields = ['message_id', 'chat_id', 'phone_or_email']
+        duplicates = address_joined_with_message_id.duplicated(subset=key_fields,
+                                                               keep=False)
+        if not sum(duplicates) == 0:
+            error_message = ('WARNING: tuple (message_id, chat_id, and phone_or_email) '
+                             'do not form a composite key. There are %i duplicates. '
+                             'Dropping the duplicates so later calculations are still valid.')
+            print(error_message % sum(duplicates))
+            address_joined_with_message_id.drop_duplicates(subset=key_fields, inplace=True)
+        current_stage.rows = address_joined_with_message_id.shape[0]
 
     return address_joined_with_message_id
 
 
-def initialize():
+def initialize(backup_directory=None):
     """
         Initializes the connections to the address book and the messages sqlite databases.
-    """
-    global _latest_sync_dir, _message_con, _address_con
 
-    if os.getenv('APPDATA'):  # Windows.
-        base_dir = os.path.join(os.getenv('APPDATA'), 'Apple Computer')
-    else:  # Mac.
-        base_dir = os.path.join(os.getenv('HOME'), 'Library', 'Application Support')
-    base_dir = os.path.join(base_dir, 'MobileSync', 'Backup')
+    Args:
+        backup_directory: if passed, the backup to read, e.g. one written by synthetic_data.write_iphone_backup(),
+            rather than the latest backup in iTunes' backup directory
+    """
+    global _latest_sync_dir, _message_path, _address_path, _message_con, _address_con
 
-    _latest_sync_dir = __get_latest_dir_in_dir(base_dir)
+    if backup_directory is not None:
+        _latest_sync_dir = backup_directory
+    else:
+        _latest_sync_dir = __get_latest_dir_in_dir(__get_backup_base_dir())
     print('Latest iPhone backup directory: {0}'.format(_latest_sync_dir))
 
     # Newer iPhone OS's shard the backup into subdirectories starting with the first two chars
@@ -128,6 +223,7 @@ def initialize():
         message_path = os.path.join(_latest_sync_dir, MESSAGE_DB)
         address_path = os.path.join(_latest_sync_dir, ADDRESS_DB)
 
+    _message_path, _address_path = message_path, address_path
     _message_con = sqlite3.connect(message_path)
     _address_con = sqlite3.connect(address_path)
 
@@ -142,43 +238,42 @@ def initialize():
             .format(message_path)
         )
 
-def get_message_df():
+def get_message_df(min_message_id=None):
     """
     Loads the message database from disk.
 
+    Args:
+        min_message_id: if passed, only messages with a ROWID greater than this are loaded
+
     Returns:
         a pandas dataframe representing all text messages
     """
-    messages_df = pd.read_sql_query('''
-      SELECT
-        ROWID as message_id, text, handle_id, country, service, version,
-        CASE
-          WHEN LENGTH(date) = 18 THEN DATETIME(SUBSTR(date, 1, 9), 'unixepoch', '31 years')
-          ELSE DATETIME(date, 'unixepoch', '31 years')
-        END AS date,
-        CASE
-          WHEN LENGTH(date_read) = 18 THEN DATETIME(SUBSTR(date_read, 1, 9), 'unixepoch', '31 years')
-          ELSE DATETIME(date_read, 'unixepoch', '31 years')
-        END AS date_read,
-        CASE
-          WHEN LENGTH(date_delivered) = 18 THEN DATETIME(SUBSTR(date_delivered, 1, 9), 'unixepoch', '31 years')
-          ELSE DATETIME(date_delivered, 'unixepoch', '31 years')
-        END AS date_delivered,
-        is_emote, is_from_me, is_read, is_system_message, is_service_message, is_sent,
-        has_dd_results
-      FROM message''', _message_con)
-    
+    message_id_filter, params = __get_message_id_filter('ROWID', min_message_id, keyword='WHERE')
+    with instrumentation.stage('read_sql') as current_stage:
+        messages_df = pd.read_sql_query('''
+          SELECT
+            ROWID as message_id, text, handle_id, country, service, version,
+            COALESCE(date, 0) AS date, COALESCE(date_read, 0) AS date_read,
+            COALESCE(date_delivered, 0) AS date_delivered,
+            is_emote, is_from_me, is_read, is_system_message, is_service_message, is_sent,
+            has_dd_results
+          FROM message''' + message_id_filter, _message_con, params=params)
+        current_stage.rows = messages_df.shape[0]
+
     messages_df = messages_df.set_index('message_id')
 
     # Convert a few columns to dates.
-    messages_df['date'] = pd.to_datetime(messages_df['date'])
-    messages_df['date_read'] = pd.to_datetime(messages_df['date_read'])
-    messages_df['date_delivered'] = pd.to_datetime(messages_df['date_delivered'])
-
-    # Drop the rows that have no text, I think these are just iphone specific weird rows.
-    messages_df = messages_df.dropna(subset=['text'], how='all')
-    # There seem to be some true duplicates, <100 of them, so just drop them.
-    messages_df = messages_df.drop_duplicates()
+    with instrumentation.stage('convert_dates'):
+        messages_df['date'] = __apple_timestamps_to_datetime(messages_df['date'])
+        messages_df['date_read'] = __apple_timestamps_to_datetime(messages_df['date_read'])
+        messages_df['date_delivered'] = __apple_timestamps_to_datetime(messages_df['date_delivered'])
+
+    with instrumentation.stage('dedup') as current_stage:
+        # Drop the rows that have no text, I think these are just iphone specific weird rows.
+        messages_df = messages_df.dropna(subset=['text'], how='all')
+        # There seem to be some true duplicates, <100 of them, so just drop them.
+        messages_df = messages_df.drop_duplicates()
+        current_stage.rows = messages_df.shape[0]
     return messages_df
 
 
@@ -192,33 +287,39 @@ def get_address_book():
     Returns:
         a pandas dataframe representing all entries in the address book
     """
-    address_book = pd.read_sql_query('''
-    SELECT
-      ROWID, ABMultiValue.property, ABMultiValue.value AS phone_or_email,
-      First AS first, Last AS last, Organization AS company,
-      DATETIME(Birthday, 'unixepoch', '31 years') AS birthday,
-      DATETIME(CreationDate, 'unixepoch', '31 years') AS creation_date,
-      DATETIME(ModificationDate, 'unixepoch', '31 years') AS modification_date
-     FROM ABPerson, ABMultiValue
-     WHERE ABPerson.ROWID = ABMultiValue.record_id
-    ''', _address_con)
+    with instrumentation.stage('read_sql') as current_stage:
+        address_book = pd.read_sql_query('''
+        SELECT
+          ROWID, ABMultiValue.property, ABMultiValue.value AS phone_or_email,
+          First AS first, Last AS last, Organization AS company,
+          Birthday AS birthday, CreationDate AS creation_date, ModificationDate AS modification_date
+         FROM ABPerson, ABMultiValue
+         WHERE ABPerson.ROWID = ABMultiValue.record_id
+        ''', _address_con)
+        current_stage.rows = address_book.shape[0]
 
     # Clean it up a bit.
-    address_book = address_book[(address_book['property'] == 4) | (address_book['property'] == 3)]  # Of type phone or email
-    address_book['phone_or_email'] = address_book.apply(__standardize_phone_numbers, axis=1)
+    with instrumentation.stage('normalize_phones_and_emails') as current_stage:
+        # Of type phone or email.
+        address_book = address_book[(address_book['property'] == 4) | (address_book['property'] == 3)]
+        address_book['phone_or_email'] = contact_normalization.standardize_phones_and_emails(
+            address_book['phone_or_email'])
+        current_stage.rows = address_book.shape[0]
 
     # Convert a few columns to dates.
-    address_book['birthday'] = pd.to_datetime(address_book['birthday'], errors='coerce')
-    address_book['creation_date'] = pd.to_datetime(address_book['creation_date'])
-    address_book['modification_date'] = pd.to_datetime(address_book['modification_date'])
+    with instrumentation.stage('convert_dates'):
+        address_book['birthday'] = __apple_timestamps_to_datetime(address_book['birthday'])
+        address_book['creation_date'] = __apple_timestamps_to_datetime(address_book['creation_date'])
+        address_book['modification_date'] = __apple_timestamps_to_datetime(address_book['modification_date'])
 
-    address_book = address_book.set_index('phone_or_email')
-    address_book = address_book.sort_values(by=['first', 'last'])
+    with instrumentation.stage('sort'):
+        address_book = address_book.set_index('phone_or_email')
+        address_book = address_book.sort_values(by=['first', 'last'])
 
     return address_book
 
 
-def get_merged_message_df(messages_df, address_book, print_debug=False):
+def get_merged_message_df(messages_df, address_book, print_debug=False, min_message_id=None):
     """
         Merges a message dataframe with the address book dataframe to return a single dataframe that contains all
         messages with detailed information (e.g. name, company, birthday) about the sender.
@@ -227,11 +328,13 @@ def get_merged_message_df(messages_df, address_book, print_debug=False):
         messages_df: a dataframe containing all transmitted messages
         address_book: a dataframe containing the address book as loaded via this module
         print_debug: true if we should print out the first row of each intermediary table as it's created
+        min_message_id: if passed, only messages with a ROWID greater than this are joined, this should match the
+            value messages_df was loaded with
 
     Returns:
         a dataframe that contained all messages with info about their senders
     """
-    phones_with_message_id_df = __get_address_joined_with_message_id(address_book)
+    phones_with_message_id_df = __get_address_joined_with_message_id(address_book, min_message_id)
 
     if print_debug:
         print('Messages Dataframe')
@@ -243,11 +346,14 @@ def get_merged_message_df(messages_df, address_book, print_debug=False):
         print('Phones/emails merged with message IDs via chats Dataframe')
         display(phones_with_message_id_df.head(1))
 
-    return messages_df.merge(phones_with_message_id_df,
-                             how='left',
-                             suffixes=['_messages_df', '_other_join_tbl'],
-                             left_index=True, right_on='message_id',
-                             indicator='merge_chat_with_address_and_messages')
+    with instrumentation.stage('merge_messages') as current_stage:
+        merged_message_df = messages_df.merge(phones_with_message_id_df,
+                                              how='left',
+                                              suffixes=['_messages_df', '_other_join_tbl'],
+                                              left_index=True, right_on='message_id',
+                                              indicator='merge_chat_with_address_and_messages')
+        current_stage.rows = merged_message_df.shape[0]
+    return merged_message_df
 
 
 def _collapse_first_last_company_columns(df):
@@ -255,25 +361,26 @@ def _collapse_first_last_company_columns(df):
     assert 'last' in df.columns, 'Column "last" did not exist in dataframe'
     assert 'company' in df.columns, 'Column "company" did not exist in dataframe'
 
-    def create_full_name(row):
-        atoms = [atom for atom in [row['first'], row['last'], row['company']] if atom]
-        atoms_as_str = [atom.encode('utf8') if type(atom).__name__ == 'unicode' else str(atom) for atom in atoms]
-        return ' '.join(atoms_as_str)
-
-    df['full_name'] = df.apply(create_full_name, axis=1)
+    df['full_name'] = contact_normalization.create_full_names(df['first'], df['last'], df['company'])
     df.drop(['first', 'last', 'company'], inplace=True, axis=1)
 
 
-def get_cleaned_fully_merged_messages():
+def get_cleaned_fully_merged_messages(min_message_id=None):
     """
         Merges the message dataframe with the address book dataframe to return a single dataframe that contains all
         messages with detailed information (e.g. name, company, birthday) about the sender.
 
+    Args:
+        min_message_id: if passed, only messages with a ROWID greater than this are loaded, this is used to
+            incrementally update a cache, see get_cached_fully_merged_messages()
+
     Returns:
         a dataframe that contained all messages with info about their senders
     """
     # LOAD MESSAGE DATAFRAME
-    messages_df = get_message_df()
+    with instrumentation.stage('load_messages') as current_stage:
+        messages_df = get_message_df(min_message_id)
+        current_stage.rows = messages_df.shape[0]
     # Drop some columns that we don't use now, but may in the future.
     messages_df.drop(['version', 'is_emote', 'is_read', 'is_system_message',
                       'is_service_message', 'has_dd_results'],
@@ -281,13 +388,17 @@ def get_cleaned_fully_merged_messages():
     print('Loaded {0:,} messages.'.format(messages_df.shape[0]))
 
     # LOAD ADDRESS BOOK DATAFRAME
-    address_book_df = get_address_book()
+    with instrumentation.stage('load_address_book') as current_stage:
+        address_book_df = get_address_book()
+        current_stage.rows = address_book_df.shape[0]
     # Drop a column that we don't use now, but may in the future.
     address_book_df = address_book_df.drop('property', axis=1)
     print('Loaded {0:,} contacts.'.format(address_book_df.shape[0]))
 
     # JOIN THE MESSAGE AND ADDRESS BOOK DATAFRAMES
-    fully_merged_messages_df = get_merged_message_df(messages_df, address_book_df)
+    with instrumentation.stage('merge') as current_stage:
+        fully_merged_messages_df = get_merged_message_df(messages_df, address_book_df, min_message_id=min_message_id)
+        current_stage.rows = fully_merged_messages_df.shape[0]
     # Drop a few columns we don't care about for now
     fully_merged_messages_df = fully_merged_messages_df.drop(['handle_id',
                                                               'country_messages_df',
@@ -308,12 +419,16 @@ def get_cleaned_fully_merged_messages():
                                                                axis=1)
 
     # Merge the first name, last name and company column together to create a "full_name" column, runs in place.
-    _collapse_first_last_company_columns(fully_merged_messages_df)
-    _collapse_first_last_company_columns(address_book_df)
+    with instrumentation.stage('collapse_names'):
+        _collapse_first_last_company_columns(fully_merged_messages_df)
+        _collapse_first_last_company_columns(address_book_df)
 
-    fully_merged_messages_df.sort_values(by='date', inplace=True)
-    fully_merged_messages_df.reset_index(inplace=True, drop=True)
-    fully_merged_messages_df.index.name = 'row_index'  # Without this Excel will complain upon import.
+    with instrumentation.stage('sort'):
+        fully_merged_messages_df.sort_values(by='date', inplace=True)
+        fully_merged_messages_df.reset_index(inplace=True, drop=True)
+        fully_merged_messages_df.index.name = 'row_index'  # Without this Excel will complain upon import.
+    with instrumentation.stage('compact_dtypes'):
+        dataframe_memory.compact_dtypes(fully_merged_messages_df)
 
     print('\nPrinting columns of merged messages dataframe:')
     print(', '.join(fully_merged_messages_df.columns.to_numpy()))
@@ -321,6 +436,652 @@ def get_cleaned_fully_merged_messages():
     print(', '.join(address_book_df.columns.to_numpy()))
     return fully_merged_messages_df, address_book_df
 
+
+# START SQL JOIN ENGINE
+# --------------
+
+
+# Attaches the address book DB to the message DB connection so both can be queried at once.
+def __attach_address_book():
+    attached = [row[1] for row in _message_con.execute('PRAGMA database_list')]
+    if 'address_db' not in attached:
+        _message_con.execute('ATTACH DATABASE ? AS address_db', (_address_path,))
+
+
+# Builds indexed temp tables mapping handles and address book entries to their standardized phone/email.  The
+# standardization is done in Python since it relies on regexes, but it only runs over the (small) handle and
+# address book tables.  Temp tables live only for the lifetime of the connection, the backup is never modified.
+def __create_normalized_key_tables(address_book):
+    _message_con.executescript('''
+    DROP TABLE IF EXISTS temp.handle_key;
+    DROP TABLE IF EXISTS temp.address_key;
+    CREATE TEMP TABLE handle_key (handle_id INTEGER PRIMARY KEY, phone_or_email TEXT NOT NULL);
+    CREATE TEMP TABLE address_key (phone_or_email TEXT PRIMARY KEY, person_id INTEGER NOT NULL);
+    ''')
+    handles = pd.read_sql_query('SELECT ROWID AS handle_id, id FROM handle WHERE id IS NOT NULL', _message_con)
+    handles['id'] = contact_normalization.standardize_phones_and_emails(handles['id'])
+    _message_con.executemany('INSERT INTO temp.handle_key VALUES (?, ?)',
+                             zip(handles['handle_id'].astype(int).tolist(), handles['id'].tolist()))
+    _message_con.execute('CREATE INDEX temp.handle_key_phone_or_email ON handle_key (phone_or_email)')
+
+    # When a phone/email belongs to multiple contacts keep the first by name, as the pandas merge would.
+    address_book = address_book[~address_book.index.duplicated(keep='first')]
+    _message_con.executemany('INSERT INTO temp.address_key VALUES (?, ?)',
+                             [(phone_or_email, int(person_id))
+                              for phone_or_email, person_id in address_book['ROWID'].items()])
+
+
+# The columns of the merged message query, mapped to the SQL that selects them.  full_name is built in pandas from
+# the first, last and company columns.
+_MERGED_MESSAGE_COLUMNS = [
+    ('text', 'message.text'),
+    ('date', 'COALESCE(message.date, 0)'),
+    ('date_read', 'COALESCE(message.date_read, 0)'),
+    ('date_delivered', 'COALESCE(message.date_delivered, 0)'),
+    ('is_from_me', 'message.is_from_me'),
+    ('is_sent', 'message.is_sent'),
+    ('phone_or_email', 'chat_participant.phone_or_email'),
+    ('message_id', 'message.ROWID'),
+    ('chat_id', 'chat_participant.chat_id'),
+    ('birthday', 'ABPerson.Birthday'),
+    ('creation_date', 'ABPerson.CreationDate'),
+    ('modification_date', 'ABPerson.ModificationDate'),
+    ('full_name', None),
+]
+_MERGED_MESSAGE_DATE_COLUMNS = ['date', 'date_read', 'date_delivered', 'birthday', 'creation_date',
+                                'modification_date']
+# SQL for a message's date in nanoseconds since 2001 regardless of whether it's stored in seconds or nanoseconds.
+_MESSAGE_DATE_NANOSECONDS_SQL = ('CASE WHEN ABS(message.date) >= {0} THEN message.date ELSE message.date * 1000000000 '
+                                 'END').format(_NANOSECONDS_THRESHOLD)
+
+
+# Returns the SQL selecting the ROWIDs (as message_id) of the messages to load.  This mirrors get_message_df() which
+# drops messages without text and true duplicates.  See __get_fully_merged_messages_sql() for the arguments.
+def __get_deduped_message_sql(message_filter, most_recent=None):
+    return '''
+      SELECT MIN(ROWID) AS message_id
+      FROM message
+      WHERE text IS NOT NULL{message_filter}
+      GROUP BY text, handle_id, country, service, version, COALESCE(date, 0), COALESCE(date_read, 0),
+        COALESCE(date_delivered, 0), is_emote, is_from_me, is_read, is_system_message, is_service_message, is_sent,
+        has_dd_results
+      {most_recent}
+    '''.format(message_filter=message_filter,
+               most_recent='' if most_recent is None else 'ORDER BY MAX({0}) DESC LIMIT {1:d}'.format(
+                   _MESSAGE_DATE_NANOSECONDS_SQL, int(most_recent)))
+
+
+# Returns the SQL that joins messages with the standardized phone/email of their chat participants and the address
+# book.  Group messages you sent are joined with every participant of the chat.  The result has the same rows as
+# the pandas merges in get_merged_message_df(), after the columns dropped by get_cleaned_fully_merged_messages().
+#
+# message_filter is appended to the WHERE clause of the messages to load, participant_filter to the WHERE clause of
+# the final rows.  If most_recent is passed only that many of the latest messages are loaded.
+def __get_fully_merged_messages_sql(message_filter, columns=None, participant_filter='', most_recent=None):
+    columns = columns or [column for column, _ in _MERGED_MESSAGE_COLUMNS]
+    select_list = []
+    for column, column_sql in _MERGED_MESSAGE_COLUMNS:
+        if column not in columns:
+            continue
+        if column == 'full_name':
+            select_list.append('ABPerson.First AS first, ABPerson.Last AS last, ABPerson.Organization AS company')
+        else:
+            select_list.append('{0} AS {1}'.format(column_sql, column))
+
+    return '''
+    WITH deduped_message AS ({deduped_message}), chat_participant AS (
+      SELECT DISTINCT chat_message_join.message_id, chat_message_join.chat_id, handle_key.phone_or_email
+      FROM deduped_message
+        JOIN message ON message.ROWID = deduped_message.message_id
+        JOIN chat_message_join ON chat_message_join.message_id = message.ROWID
+        JOIN chat ON chat.ROWID = chat_message_join.chat_id
+        JOIN chat_handle_join ON chat_handle_join.chat_id = chat.ROWID
+        JOIN temp.handle_key ON handle_key.handle_id = chat_handle_join.handle_id
+      WHERE (chat_handle_join.handle_id = message.handle_id) OR message.is_from_me
+    )
+    SELECT
+      {select_list}
+    FROM deduped_message
+      JOIN message ON message.ROWID = deduped_message.message_id
+      LEFT JOIN chat_participant ON chat_participant.message_id = message.ROWID
+      LEFT JOIN temp.address_key ON address_key.phone_or_email = chat_participant.phone_or_email
+      LEFT JOIN address_db.ABPerson ON ABPerson.ROWID = address_key.person_id
+    WHERE 1 = 1{participant_filter}
+    '''.format(deduped_message=__get_deduped_message_sql(message_filter, most_recent),
+               select_list=',\n      '.join(select_list),
+               participant_filter=participant_filter)
+
+
+# Runs the merged message query for the passed filters and cleans up the result, note this assumes
+# __create_normalized_key_tables() was already called.  See __get_fully_merged_messages_sql() for the arguments.
+def __read_merged_messages_from_sql(message_filter, params, columns=None, participant_filter='', most_recent=None):
+    with instrumentation.stage('read_sql') as current_stage:
+        merged_messages_df = pd.read_sql_query(
+            __get_fully_merged_messages_sql(message_filter, columns, participant_filter, most_recent), _message_con,
+            params=params)
+        current_stage.rows = merged_messages_df.shape[0]
+
+    with instrumentation.stage('convert_dates'):
+        for date_column in _MERGED_MESSAGE_DATE_COLUMNS:
+            if date_column in merged_messages_df.columns:
+                merged_messages_df[date_column] = __apple_timestamps_to_datetime(merged_messages_df[date_column])
+
+    if 'first' in merged_messages_df.columns:
+        with instrumentation.stage('collapse_names'):
+            _collapse_first_last_company_columns(merged_messages_df)
+    return merged_messages_df
+
+
+# Loads the address book, attaches it to the message DB connection and builds the temp tables the merged message
+# query relies on.  Returns the address book for later use.
+def __prepare_sql_join():
+    with instrumentation.stage('load_address_book') as current_stage:
+        address_book_df = get_address_book().drop('property', axis=1)
+        current_stage.rows = address_book_df.shape[0]
+    with instrumentation.stage('create_key_tables'):
+        __attach_address_book()
+        __create_normalized_key_tables(address_book_df)
+    return address_book_df
+
+
+def get_fully_merged_messages_from_sql(min_message_id=None):
+    """
+        Same as get_cleaned_fully_merged_messages() but performs the joins within SQLite rather than pandas.  The
+        address book DB is attached to the message DB connection so a single query returns the merged rows, this
+        keeps peak memory to a single result set rather than several intermediary dataframes.
+
+    Args:
+        min_message_id: if passed, only messages with a ROWID greater than this are loaded
+
+    Returns:
+        a tuple of the fully merged messages dataframe and the address book dataframe
+    """
+    address_book_df = __prepare_sql_join()
+    print('Loaded {0:,} contacts.'.format(address_book_df.shape[0]))
+    _collapse_first_last_company_columns(address_book_df)
+
+    with instrumentation.stage('load_merged_messages') as current_stage:
+        fully_merged_messages_df = __read_merged_messages_from_sql(*__get_message_id_filter('ROWID', min_message_id))
+        current_stage.rows = fully_merged_messages_df.shape[0]
+    print('Loaded {0:,} messages.'.format(fully_merged_messages_df.message_id.nunique()))
+
+    with instrumentation.stage('sort'):
+        fully_merged_messages_df.sort_values(by='date', inplace=True)
+        fully_merged_messages_df.reset_index(inplace=True, drop=True)
+        fully_merged_messages_df.index.name = 'row_index'  # Without this Excel will complain upon import.
+    with instrumentation.stage('compact_dtypes'):
+        dataframe_memory.compact_dtypes(fully_merged_messages_df)
+    return fully_merged_messages_df, address_book_df
+
+
+def iter_fully_merged_messages(chunk_size=50000):
+    """
+        Yields the fully merged messages in batches, ordered by message ROWID, so that large backups can be processed
+        with roughly constant memory.  Each batch has the same columns and compact dtypes as
+        get_fully_merged_messages_from_sql().
+
+    Note:
+        True duplicate messages are only dropped within a batch, not across batches.  Rows within a batch are
+        ordered by message ROWID rather than date, and are numbered continuously across batches.  The categories of
+        the categorical columns are those of each batch, so they differ between batches.
+
+    Args:
+        chunk_size: the number of messages (ROWIDs) to load per batch, group messages you sent yield multiple rows
+            per message so a batch may have more rows than this
+
+    Returns:
+        a generator of dataframes containing messages with info about their senders
+    """
+    __prepare_sql_join()
+    rows_yielded = 0
+    last_message_id = 0
+    while True:
+        # Find the ROWID that ends this batch, or the largest ROWID if fewer than chunk_size messages remain.
+        max_message_id = _message_con.execute(
+            'SELECT MAX(ROWID) FROM (SELECT ROWID FROM message WHERE ROWID > ? ORDER BY ROWID LIMIT ?)',
+            (last_message_id, chunk_size)).fetchone()[0]
+        if max_message_id is None:
+            return
+
+        merged_messages_df = __read_merged_messages_from_sql(
+            *__get_message_id_filter('ROWID', last_message_id, max_message_id))
+        merged_messages_df.sort_values(by='message_id', inplace=True, kind='mergesort')
+        merged_messages_df.index = pd.RangeIndex(rows_yielded, rows_yielded + merged_messages_df.shape[0],
+                                                 name='row_index')
+        rows_yielded += merged_messages_df.shape[0]
+        last_message_id = max_message_id
+        with instrumentation.stage('compact_dtypes'):
+            dataframe_memory.compact_dtypes(merged_messages_df)
+        yield merged_messages_df
+
+
+def query_messages(contacts=None, since=None, until=None, from_me=None, columns=None, most_recent=None):
+    """
+        Loads only the fully merged messages matching the passed filters.  The filters are applied within SQLite so
+        e.g. looking at a single contact only reads the chats that contact is in, rather than loading every message
+        and masking the dataframe.
+
+    Args:
+        contacts: a full name, or list of full names, as they appear in the full_name column to restrict to.
+            contact_normalization.UNKNOWN_FULL_NAME selects the messages of phone numbers and emails missing from the
+            address book, and of messages without a chat, these can't be narrowed down via the chats so all messages
+            are read
+        since: if passed, only messages sent at or after this date are returned, anything pd.Timestamp accepts works
+        until: if passed, only messages sent before this date are returned
+        from_me: if True only messages you sent are returned, if False only messages you received
+        columns: the columns to return, defaults to all the columns of get_fully_merged_messages_from_sql()
+        most_recent: if passed, only this many of the latest messages matching the other filters are returned, group
+            messages you sent still yield one row per participant
+
+    Returns:
+        a dataframe of the matching messages with info about their senders, sorted by date
+    """
+    unknown_columns = set(columns or []) - set(column for column, _ in _MERGED_MESSAGE_COLUMNS)
+    if unknown_columns:
+        raise ValueError('Unknown column(s): {0}'.format(', '.join(sorted(unknown_columns))))
+
+    __prepare_sql_join()
+    message_filter, params = '', []
+    participant_filter = ''
+
+    if contacts is not None:
+        is_single_contact = isinstance(contacts, str) or type(contacts).__name__ == 'unicode'
+        contacts = [contacts] if is_single_contact else list(contacts)
+        # Build the names exactly as the merged message query does so they match its full_name column.
+        contact_keys_df = pd.read_sql_query('''
+        SELECT address_key.phone_or_email, ABPerson.First AS first, ABPerson.Last AS last,
+          ABPerson.Organization AS company
+        FROM temp.address_key JOIN address_db.ABPerson ON ABPerson.ROWID = address_key.person_id''', _message_con)
+        contact_keys_df['full_name'] = contact_normalization.create_full_names(
+            contact_keys_df['first'], contact_keys_df['last'], contact_keys_df['company'])
+        contact_keys = contact_keys_df.loc[contact_keys_df['full_name'].isin(contacts), 'phone_or_email']
+        _message_con.executescript('''
+        DROP TABLE IF EXISTS temp.query_contact;
+        CREATE TEMP TABLE query_contact (phone_or_email TEXT PRIMARY KEY);
+        ''')
+        _message_con.executemany('INSERT INTO temp.query_contact VALUES (?)',
+                                 [(phone_or_email,) for phone_or_email in contact_keys])
+
+        # The merged message query names the rows it finds no person for UNKNOWN_FULL_NAME.
+        includes_unknown_contacts = contact_normalization.UNKNOWN_FULL_NAME in contacts
+        participant_filter = '''
+      AND (chat_participant.phone_or_email IN (SELECT phone_or_email FROM temp.query_contact){0})'''.format(
+            ' OR (ABPerson.First IS NULL AND ABPerson.Last IS NULL AND ABPerson.Organization IS NULL)'
+            if includes_unknown_contacts else '')
+        if not includes_unknown_contacts:
+            # Restrict to the chats the contacts are in via the chat membership indices, and to messages they sent.
+            # Messages of unknown contacts aren't found via the address book, so then every message is read.
+            contact_handles_sql = '''
+          SELECT handle_key.handle_id FROM temp.query_contact
+            JOIN temp.handle_key ON handle_key.phone_or_email = query_contact.phone_or_email'''
+            message_filter += '''
+        AND ROWID IN (
+          SELECT chat_message_join.message_id FROM chat_handle_join
+            JOIN chat_message_join ON chat_message_join.chat_id = chat_handle_join.chat_id
+          WHERE chat_handle_join.handle_id IN ({0}))
+        AND (is_from_me OR handle_id IN ({0}))'''.format(contact_handles_sql)
+
+    if since is not None or until is not None:
+        date_filter, date_params = __get_message_date_filter(since, until)
+        message_filter += date_filter
+        params += date_params
+
+    if from_me is not None:
+        message_filter += ' AND is_from_me = ?'
+        params.append(int(bool(from_me)))
+
+    messages_df = __read_merged_messages_from_sql(message_filter, params, columns, participant_filter, most_recent)
+    if 'date' in messages_df.columns:
+        messages_df.sort_values(by='date', inplace=True, kind='mergesort')
+    messages_df.reset_index(inplace=True, drop=True)
+    messages_df.index.name = 'row_index'
+    if columns:
+        messages_df = messages_df[list(columns)]
+    return dataframe_memory.compact_dtypes(messages_df)
+
+
+def get_compact_messages():
+    """
+        Loads messages without repeating group messages you sent once per participant, see the group_messages module
+        for details of the format.  Use expand_compact_messages() to get the same shape as
+        get_fully_merged_messages_from_sql(), or group_messages.count_messages_by_contact() to count texts per
+        contact without expanding.
+
+    Returns:
+        a tuple of the compact messages dataframe, with one row per message and chat, and the chat members dataframe
+    """
+    __prepare_sql_join()
+
+    messages_df = pd.read_sql_query('''
+    WITH deduped_message AS ({0})
+    SELECT
+      message.text, COALESCE(message.date, 0) AS date, COALESCE(message.date_read, 0) AS date_read,
+      COALESCE(message.date_delivered, 0) AS date_delivered, message.is_from_me, message.is_sent,
+      handle_key.phone_or_email, message.ROWID AS message_id, chat_message_join.chat_id
+    FROM deduped_message
+      JOIN message ON message.ROWID = deduped_message.message_id
+      LEFT JOIN chat_message_join ON chat_message_join.message_id = message.ROWID
+      -- The sender of a message you received, as long as they're a participant of the chat.
+      LEFT JOIN temp.handle_key ON handle_key.handle_id = message.handle_id AND NOT message.is_from_me
+        AND EXISTS (SELECT 1 FROM chat_handle_join
+                    WHERE chat_handle_join.chat_id = chat_message_join.chat_id
+                      AND chat_handle_join.handle_id = message.handle_id)
+    ORDER BY message.ROWID
+    '''.format(__get_deduped_message_sql('')), _message_con)
+    for date_column in ['date', 'date_read', 'date_delivered']:
+        messages_df[date_column] = __apple_timestamps_to_datetime(messages_df[date_column])
+    messages_df.sort_values(by='date', inplace=True, kind='mergesort')
+    messages_df.reset_index(inplace=True, drop=True)
+    messages_df.index.name = 'row_index'
+
+    chat_members_df = pd.read_sql_query('''
+    SELECT DISTINCT
+      chat_handle_join.chat_id, handle_key.phone_or_email,
+      ABPerson.Birthday AS birthday, ABPerson.CreationDate AS creation_date,
+      ABPerson.ModificationDate AS modification_date,
+      ABPerson.First AS first, ABPerson.Last AS last, ABPerson.Organization AS company
+    FROM chat_handle_join
+      JOIN temp.handle_key ON handle_key.handle_id = chat_handle_join.handle_id
+      LEFT JOIN temp.address_key ON address_key.phone_or_email = handle_key.phone_or_email
+      LEFT JOIN address_db.ABPerson ON ABPerson.ROWID = address_key.person_id
+    ORDER BY chat_handle_join.chat_id
+    ''', _message_con)
+    for date_column in ['birthday', 'creation_date', 'modification_date']:
+        chat_members_df[date_column] = __apple_timestamps_to_datetime(chat_members_df[date_column])
+    _collapse_first_last_company_columns(chat_members_df)
+
+    print('Loaded {0:,} messages across {1:,} chats.'.format(messages_df.shape[0],
+                                                             chat_members_df.chat_id.nunique()))
+    return dataframe_memory.compact_dtypes(messages_df), dataframe_memory.compact_dtypes(chat_members_df)
+
+
+def expand_compact_messages(messages_df, chat_members_df):
+    """
+        Expands the result of get_compact_messages() into the same shape as get_fully_merged_messages_from_sql(),
+        i.e. group messages you sent are repeated once per participant.
+
+    Args:
+        messages_df: the compact messages dataframe
+        chat_members_df: the chat members dataframe
+
+    Returns:
+        a dataframe that contains all messages with info about their senders
+    """
+    return group_messages.expand_group_messages(messages_df, chat_members_df, on='phone_or_email')
+
+
+# --------------
+# END SQL JOIN ENGINE
+
+
+# START ON-DISK CACHE
+# --------------
+
+
+# Returns a hash of the schemas of both databases, if either schema changes the cache must be fully rebuilt.
+def __get_schema_fingerprint():
+    fingerprint = hashlib.sha1(str(CACHE_VERSION).encode('utf-8'))
+    for con in [_message_con, _address_con]:
+        for (sql,) in con.execute("SELECT sql FROM SQLITE_MASTER WHERE sql IS NOT NULL ORDER BY name"):
+            fingerprint.update(sql.encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def __get_max_message_id():
+    return _message_con.execute('SELECT COALESCE(MAX(ROWID), 0) FROM message').fetchone()[0]
+
+
+def __get_cache_directory(cache_dir):
+    backup_key = hashlib.sha1(os.path.abspath(_latest_sync_dir).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, backup_key)
+
+
+def __read_cache_manifest(cache_directory):
+    manifest_path = os.path.join(cache_directory, 'manifest.json')
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)
+
+
+def __write_cache(cache_directory, manifest, fully_merged_messages_df, address_book_df, cube):
+    if not os.path.isdir(cache_directory):
+        os.makedirs(cache_directory)
+    fully_merged_messages_df.to_parquet(os.path.join(cache_directory, 'messages.parquet'))
+    address_book_df.to_parquet(os.path.join(cache_directory, 'addresses.parquet'))
+    message_cube.write_cube(cube, os.path.join(cache_directory, message_cube.CUBE_FILENAME))
+    # The manifest is written last so a partially written cache is never considered valid.
+    with open(os.path.join(cache_directory, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+
+def get_cached_fully_merged_messages(cache_dir=None, force_rebuild=False):
+    """
+        Same as get_cleaned_fully_merged_messages() but persists the result to disk as Parquet files, keyed on the
+        backup directory chosen by initialize().  Subsequent calls only load messages added since the last call.
+        A message cube and a full-text index are kept up to date alongside, see get_cached_message_cube() and
+        get_search_index_path().
+
+        A full rebuild happens when the address book changed, when the schema of either database changed, or when
+        force_rebuild is passed.  Note that edits to already cached messages (e.g. read receipts) are not picked up
+        without a full rebuild.
+
+    Args:
+        cache_dir: directory to store the cache in, defaults to DEFAULT_CACHE_DIR
+        force_rebuild: if true, ignore any existing cache and rebuild it from scratch
+
+    Returns:
+        a tuple of the fully merged messages dataframe and the address book dataframe
+    """
+    cache_directory = __get_cache_directory(cache_dir)
+    manifest = __read_cache_manifest(cache_directory)
+    current_manifest = {
+        'backup_dir': os.path.abspath(_latest_sync_dir),
+        'message_db_mtime': os.path.getmtime(_message_path),
+        'address_db_mtime': os.path.getmtime(_address_path),
+        'schema_fingerprint': __get_schema_fingerprint(),
+        'max_message_id': __get_max_message_id(),
+    }
+
+    needs_rebuild = (force_rebuild or manifest is None or
+                     manifest['address_db_mtime'] != current_manifest['address_db_mtime'] or
+                     manifest['schema_fingerprint'] != current_manifest['schema_fingerprint'])
+    if needs_rebuild:
+        print('Building message cache in {0}'.format(cache_directory))
+        fully_merged_messages_df, address_book_df = get_cleaned_fully_merged_messages()
+        with instrumentation.stage('build_cube'):
+            cube = message_cube.build_cube(fully_merged_messages_df)
+        with instrumentation.stage('write_cache'):
+            __write_cache(cache_directory, current_manifest, fully_merged_messages_df, address_book_df, cube)
+        with instrumentation.stage('update_search_index'):
+            message_search.update_search_index(__get_search_index_path(cache_directory), fully_merged_messages_df,
+                                               rebuild=True)
+        return fully_merged_messages_df, address_book_df
+
+    with instrumentation.stage('read_cache') as current_stage:
+        fully_merged_messages_df = pd.read_parquet(os.path.join(cache_directory, 'messages.parquet'))
+        address_book_df = pd.read_parquet(os.path.join(cache_directory, 'addresses.parquet'))
+        current_stage.rows = fully_merged_messages_df.shape[0]
+    if (manifest['message_db_mtime'] == current_manifest['message_db_mtime'] or
+            manifest['max_message_id'] >= current_manifest['max_message_id']):
+        print('Loaded {0:,} messages from cache in {1}'.format(fully_merged_messages_df.shape[0], cache_directory))
+        # Only does work if the search index is missing or behind the cache.
+        with instrumentation.stage('update_search_index'):
+            message_search.update_search_index(__get_search_index_path(cache_directory), fully_merged_messages_df)
+        return fully_merged_messages_df, address_book_df
+
+    print('Loading messages added since the cache was built (ROWID > {0:,})'.format(manifest['max_message_id']))
+    new_messages_df, _ = get_cleaned_fully_merged_messages(min_message_id=manifest['max_message_id'])
+    with instrumentation.stage('append_to_cache') as current_stage:
+        fully_merged_messages_df = pd.concat([fully_merged_messages_df, new_messages_df], ignore_index=True)
+        fully_merged_messages_df.sort_values(by='date', inplace=True, kind='mergesort')
+        fully_merged_messages_df.reset_index(inplace=True, drop=True)
+        fully_merged_messages_df.index.name = 'row_index'
+        # Concatenating categoricals with different categories falls back to strings, so compact the result again.
+        dataframe_memory.compact_dtypes(fully_merged_messages_df)
+        current_stage.rows = fully_merged_messages_df.shape[0]
+    with instrumentation.stage('build_cube'):
+        cube = message_cube.merge_cubes(
+            message_cube.read_cube(os.path.join(cache_directory, message_cube.CUBE_FILENAME)),
+            message_cube.build_cube(new_messages_df))
+
+    with instrumentation.stage('write_cache'):
+        __write_cache(cache_directory, current_manifest, fully_merged_messages_df, address_book_df, cube)
+    with instrumentation.stage('update_search_index'):
+        message_search.update_search_index(__get_search_index_path(cache_directory), new_messages_df)
+    return fully_merged_messages_df, address_book_df
+
+
+def __get_search_index_path(cache_directory):
+    return os.path.join(cache_directory, message_search.SEARCH_INDEX_FILENAME)
+
+
+def get_search_index_path(cache_dir=None):
+    """
+        Returns the path of the full-text index kept next to the cache of get_cached_fully_merged_messages(), for use
+        with the message_search module.  The index is up to date after a call to get_cached_fully_merged_messages().
+
+    Args:
+        cache_dir: see get_cached_fully_merged_messages()
+
+    Returns:
+        the path of the index as a string
+    """
+    return __get_search_index_path(__get_cache_directory(cache_dir))
+
+
+def get_cached_message_cube(cache_dir=None):
+    """
+        Reads the message cube kept next to the cache of get_cached_fully_merged_messages(), for use with the
+        message_cube module.  The cube is up to date after a call to get_cached_fully_merged_messages().
+
+    Args:
+        cache_dir: see get_cached_fully_merged_messages()
+
+    Returns:
+        the cube, see message_cube.build_cube()
+    """
+    return message_cube.read_cube(os.path.join(__get_cache_directory(cache_dir), message_cube.CUBE_FILENAME))
+
+
+# --------------
+# END ON-DISK CACHE
+
+
+# START MULTIPLE BACKUPS
+# --------------
+
+
+def find_backup_directories(base_dir=None):
+    """
+        Finds every backup that holds a message database, e.g. older backups of this iPhone or backups of other
+        devices.
+
+    Args:
+        base_dir: the directory to look for backups in, defaults to iTunes' backup directory
+
+    Returns:
+        a list of the backup directories, the most recently modified first
+    """
+    base_dir = base_dir or __get_backup_base_dir()
+    backup_directories = []
+    for relative_path in os.listdir(base_dir):
+        full_path = os.path.join(base_dir, relative_path)
+        if (os.path.isfile(os.path.join(full_path, MESSAGE_DB[:2], MESSAGE_DB)) or
+                os.path.isfile(os.path.join(full_path, MESSAGE_DB))):
+            backup_directories.append(full_path)
+    return sorted(backup_directories, key=os.path.getmtime, reverse=True)
+
+
+# Loads the merged messages of a single backup, along with the guid of each message and chat.  This runs in a worker
+# process so initializing the module here doesn't affect the caller's connections, and output is suppressed as the
+# workers would interleave it.
+def __load_backup(backup_directory):
+    with contextlib.redirect_stdout(io.StringIO()):
+        initialize(backup_directory)
+        fully_merged_messages_df, address_book_df = get_cleaned_fully_merged_messages()
+    guids = pd.read_sql_query('SELECT ROWID AS message_id, guid FROM message', _message_con, index_col='message_id')
+    fully_merged_messages_df['guid'] = fully_merged_messages_df['message_id'].map(guids['guid'])
+    chat_guids = pd.read_sql_query('SELECT ROWID AS chat_id, guid FROM chat', _message_con, index_col='chat_id')
+    fully_merged_messages_df['chat_guid'] = fully_merged_messages_df['chat_id'].map(chat_guids['guid'])
+    _message_con.close()
+    _address_con.close()
+    return fully_merged_messages_df, address_book_df
+
+
+# Returns a 64 bit hash per row of the passed columns, two rows with the same values always have the same hash.
+def __hash_rows(df, columns):
+    return pd.util.hash_pandas_object(df[columns].astype(object), index=False).to_numpy()
+
+
+def get_cleaned_fully_merged_messages_from_backups(backup_directories=None, processes=None):
+    """
+        Same as get_cleaned_fully_merged_messages() but loads several backups, e.g. older backups whose messages were
+        since deleted from the iPhone, or backups of other devices, and merges their messages.  The backups are loaded
+        in parallel, each in its own process.
+
+        A message in several backups is kept once, from the most recently modified backup holding it.  Messages are
+        matched by their guid, which iOS assigns when a message is sent and is the same on every device, whereas
+        ROWIDs differ between devices.  Rather than comparing whole rows, each row's guid and phone/email, since a
+        group message you sent has a row per participant, is hashed into a single 64 bit key to deduplicate on.
+
+    Args:
+        backup_directories: the backups to load, defaults to every backup found by find_backup_directories()
+        processes: the number of backups to load at once, defaults to the number of CPUs
+
+    Returns:
+        a tuple of the fully merged messages dataframe, with an additional guid column, and the address book
+        dataframe of every backup.  Since ROWIDs differ between backups message_id and chat_id are renumbered, a
+        message_id per message guid in order of date and a chat_id per chat guid
+    """
+    backup_directories = list(backup_directories or find_backup_directories())
+    if not backup_directories:
+        raise ValueError('No backups to load')
+    # The most recently modified backup first, so its copy of a message is the one kept.
+    backup_directories.sort(key=os.path.getmtime, reverse=True)
+
+    with instrumentation.stage('load_backups') as current_stage:
+        max_workers = min(processes or os.cpu_count() or 1, len(backup_directories))
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            loaded_backups = list(executor.map(__load_backup, backup_directories))
+        for backup_directory, (fully_merged_messages_df, _) in zip(backup_directories, loaded_backups):
+            print('Loaded {0:,} messages from {1}'.format(fully_merged_messages_df.shape[0], backup_directory))
+        current_stage.rows = sum(messages_df.shape[0] for messages_df, _ in loaded_backups)
+
+    with instrumentation.stage('concat'):
+        fully_merged_messages_df = pd.concat([messages_df for messages_df, _ in loaded_backups], ignore_index=True)
+
+    with instrumentation.stage('dedup') as current_stage:
+        is_duplicate = pd.Series(__hash_rows(fully_merged_messages_df, ['guid', 'phone_or_email'])).duplicated()
+        fully_merged_messages_df = fully_merged_messages_df[~is_duplicate.to_numpy()]
+        current_stage.rows = fully_merged_messages_df.shape[0]
+    print('Messages loaded: {0:,} after dropping {1:,} found in more than one backup'.format(
+        fully_merged_messages_df.shape[0], int(is_duplicate.sum())))
+
+    with instrumentation.stage('sort'):
+        fully_merged_messages_df = fully_merged_messages_df.sort_values(by='date', kind='mergesort')
+        fully_merged_messages_df['message_id'] = pd.factorize(fully_merged_messages_df['guid'])[0] + 1
+        chat_ids = pd.factorize(fully_merged_messages_df['chat_guid'])[0] + 1
+        # Messages without a chat stay without one.
+        fully_merged_messages_df['chat_id'] = pd.Series(chat_ids, index=fully_merged_messages_df.index).where(
+            chat_ids > 0)
+        fully_merged_messages_df = fully_merged_messages_df.drop('chat_guid', axis=1)
+        fully_merged_messages_df.reset_index(inplace=True, drop=True)
+        fully_merged_messages_df.index.name = 'row_index'  # Without this Excel will complain upon import.
+    with instrumentation.stage('compact_dtypes'):
+        # Concatenating categoricals with different categories falls back to strings, so compact the result again.
+        dataframe_memory.compact_dtypes(fully_merged_messages_df)
+
+    address_book_df = pd.concat([addresses_df for _, addresses_df in loaded_backups])
+    is_duplicate_address = address_book_df.reset_index().duplicated(subset=['phone_or_email', 'full_name'])
+    address_book_df = address_book_df[~is_duplicate_address.to_numpy()]
+    return fully_merged_messages_df, address_book_df
+
+
+# --------------
+# END MULTIPLE BACKUPS
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Print out the text messages and contacts from '
                                                  'your iPhone\'s backup.')
@@ -328,23 +1089,104 @@ if __name__ == "__main__":
                         help='If passed, message output includes more than just the text, date and '
                              'full_name columns, and the address book output includes more than '
                              'just the name and phone columns.')
+    parser.add_argument('-c', '--cache', action='store_true', dest='cache',
+                        help='If passed, the merged messages are cached on disk and only messages added since '
+                             'the previous run are loaded from the backup.')
+    parser.add_argument('-s', '--sql', action='store_true', dest='sql',
+                        help='If passed, messages are joined with the address book within SQLite rather than '
+                             'pandas, which uses less memory.')
+    parser.add_argument('--stream', action='store_true', dest='stream',
+                        help='If passed, messages are loaded and written to messages.csv in batches to keep memory '
+                             'usage roughly constant, requires an output directory.')
+    parser.add_argument('--format', choices=['csv'] + message_export.EXPORT_FORMATS, default='csv', dest='format',
+                        help='The format the messages and address book are written to the output directory in.  '
+                             'Parquet and Feather files are compressed and the messages are partitioned by year, '
+                             'read them back with message_export.read_messages().  Default csv.')
+    parser.add_argument('--chunk-size', type=int, default=50000, dest='chunk_size',
+                        help='The number of messages per batch when --stream is passed.  Default 50000.')
+    parser.add_argument('-b', '--backup', action='append', dest='backups', metavar='BACKUP_DIRECTORY',
+                        help='If passed, this backup is loaded rather than the latest one.  Pass it several times to '
+                             'load several backups, their messages are merged and deduplicated.')
+    parser.add_argument('--all-backups', action='store_true', dest='all_backups',
+                        help='If passed, every backup is loaded, e.g. older backups and backups of other devices, '
+                             'and their messages are merged and deduplicated.')
+    parser.add_argument('--processes', type=int, dest='processes',
+                        help='The number of backups loaded at once when several are.  Defaults to the number of '
+                             'CPUs.')
+    parser.add_argument('--profile', action='store_true', dest='profile',
+                        help='If passed, the time, rows and peak memory of each stage of loading the messages are '
+                             'printed once they\'re loaded.')
+    parser.add_argument('--cprofile', dest='cprofile_path', metavar='PATH',
+                        help='If passed, loading the messages is profiled with cProfile and the stats are written '
+                             'to this path, read them with pstats or snakeviz.')
     parser.add_argument('output_directory', nargs='?',
                         help='If passed, the messages and address book will be written to this '
                              'directory each as a CSV.  This directory must already exist.')
     args = parser.parse_args()
+    if args.stream and not args.output_directory:
+        parser.error('--stream requires an output directory')
+    multiple_backups = args.all_backups or len(args.backups or []) > 1
+    if multiple_backups and (args.stream or args.cache or args.sql):
+        parser.error('--stream, --cache and --sql load a single backup')
 
     # Set width to none so it auto-fills to the terminal window.
     pd.set_option('display.width', None)
-    initialize()
+    if not multiple_backups:
+        initialize(args.backups[0] if args.backups else None)
+
+    if args.profile or args.cprofile_path:
+        loader_profile_context = instrumentation.profile(measure_memory=args.profile,
+                                                         cprofile_path=args.cprofile_path)
+    else:
+        loader_profile_context = contextlib.nullcontext()
+    with loader_profile_context as loader_profile:
+        if args.stream:
+            addresses_df = __prepare_sql_join()
+            _collapse_first_last_company_columns(addresses_df)
+            addresses_to_write = addresses_df if args.full else addresses_df[['full_name']]
+            if args.format == 'csv':
+                addresses_to_write.to_csv(os.path.join(args.output_directory, 'addresses.csv'), encoding='utf-8')
+                messages_path = os.path.join(args.output_directory, 'messages.csv')
+            else:
+                message_export.write_addresses(addresses_to_write, args.output_directory, args.format)
+                messages_path = os.path.join(args.output_directory, message_export.MESSAGES_DIRECTORY)
+
+            messages_written = 0
+            for i, message_df in enumerate(iter_fully_merged_messages(args.chunk_size)):
+                messages_to_write = message_df if args.full else message_df[['full_name', 'date', 'text']]
+                if args.format == 'csv':
+                    messages_to_write.to_csv(messages_path, encoding='utf-8', mode='w' if i == 0 else 'a',
+                                             header=i == 0)
+                else:
+                    message_export.write_messages(messages_to_write, args.output_directory, args.format, part=i)
+                messages_written += messages_to_write.shape[0]
+                print('Wrote {0:,} messages to {1}'.format(messages_written, messages_path))
+        elif multiple_backups:
+            message_df, addresses_df = get_cleaned_fully_merged_messages_from_backups(args.backups, args.processes)
+        elif args.cache:
+            message_df, addresses_df = get_cached_fully_merged_messages()
+        elif args.sql:
+            message_df, addresses_df = get_fully_merged_messages_from_sql()
+        else:
+            message_df, addresses_df = get_cleaned_fully_merged_messages()
+    if args.profile:
+        print('\nPROFILE OF LOADING THE MESSAGES:')
+        print(loader_profile.report())
+    if args.cprofile_path:
+        print('Wrote cProfile stats to {0}'.format(args.cprofile_path))
+    if args.stream:
+        parser.exit()
 
-    message_df, addresses_df = get_cleaned_fully_merged_messages()
     # Note we don't explicitly print phone_or_email since it's the index.
     addresses_to_print = addresses_df if args.full else addresses_df[['full_name']]
     messages_to_print = message_df if args.full else message_df[['full_name', 'date', 'text']]
 
-    if args.output_directory:
+    if args.output_directory and args.format == 'csv':
         addresses_to_print.to_csv(os.path.join(args.output_directory, 'addresses.csv'), encoding='utf-8')
         messages_to_print.to_csv(os.path.join(args.output_directory, 'messages.csv'), encoding='utf-8')
+    elif args.output_directory:
+        message_export.write_addresses(addresses_to_print, args.output_directory, args.format)
+        message_export.write_messages(messages_to_print, args.output_directory, args.format)
     else:
         print('\nADDRESS BOOK (output to CSV for full data):')
         print(addresses_to_print)
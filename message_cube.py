@@ -0,0 +1,162 @@
+"""
+
+This module pre-aggregates the merged messages into a "cube" of counts per contact, direction and day, which the
+heatmap, steamgraph and top contacts table can then slice rather than each aggregating every message again.
+
+The cube is a dataframe indexed by full_name, is_from_me and day with the columns in CUBE_COLUMNS.  Like the merged
+messages, a group message you sent counts once per participant.  Only days with messages have a row, rollup() and
+dense_series() fill in the rest.
+
+iphone_connector.get_cached_fully_merged_messages() keeps a cube next to its cache and updates it incrementally, see
+iphone_connector.get_cached_message_cube().
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import pandas as pd
+
+# The file name of the cube kept next to the cache of iphone_connector.get_cached_fully_merged_messages().
+CUBE_FILENAME = 'cube.parquet'
+CUBE_INDEX = ['full_name', 'is_from_me', 'day']
+CUBE_COLUMNS = ['messages', 'words', 'characters']
+
+
+def build_cube(messages_df):
+    """
+    Aggregates messages into a cube.  Messages without a date are left out.
+
+    Args:
+        messages_df: merged messages, must contain full_name, is_from_me, date and text columns
+
+    Returns:
+        the cube, see the module docstring
+    """
+    texts = messages_df['text']
+    cube = pd.DataFrame({
+        'full_name': messages_df['full_name'],
+        'is_from_me': messages_df['is_from_me'].astype(bool),
+        'day': messages_df['date'].dt.floor('D'),
+        'messages': 1,
+        # Same as len(text.split()) per text, missing texts count as nothing.
+        'words': texts.str.split().str.len().fillna(0).astype('int64'),
+        'characters': texts.str.len().fillna(0).astype('int64'),
+    }, columns=CUBE_INDEX + CUBE_COLUMNS)
+    return cube.groupby(CUBE_INDEX, observed=True)[CUBE_COLUMNS].sum()
+
+
+def merge_cubes(cube, other_cube):
+    """
+    Adds up two cubes, e.g. the cached cube and the cube of messages loaded since it was built.
+
+    Args:
+        cube: a cube
+        other_cube: another cube
+
+    Returns:
+        a cube with the counts of both
+    """
+    merged = pd.concat([cube, other_cube])
+    return merged.groupby(level=CUBE_INDEX, observed=True).sum()
+
+
+def write_cube(cube, path):
+    """
+    Writes a cube to a Parquet file, read it back with read_cube().
+    """
+    cube.reset_index().to_parquet(path)
+
+
+def read_cube(path):
+    """
+    Reads a cube written by write_cube().
+    """
+    return pd.read_parquet(path).set_index(CUBE_INDEX)
+
+
+def rollup(cube, freq='M', by=('full_name', 'is_from_me')):
+    """
+    Sums the cube up per period, e.g. per month.
+
+    Args:
+        cube: a cube
+        freq: the length of a period as a pandas period alias, e.g. 'M' for months or 'Y' for years
+        by: the levels of the cube to keep, any of full_name and is_from_me
+
+    Returns:
+        a dataframe with the CUBE_COLUMNS indexed by the levels in by and the period, only periods with messages have
+        a row
+    """
+    days = cube.index.get_level_values('day')
+    if days.tz is not None:
+        # Periods don't carry a timezone, so take the local day the cube was built with.
+        days = days.tz_localize(None)
+    keys = [cube.index.get_level_values(level) for level in by] + [days.to_period(freq).rename('period')]
+    return cube.groupby(keys, observed=True).sum()
+
+
+def year_month_table(cube, value='messages'):
+    """
+    Lays the cube out as a table of years by months, as drawn by a heatmap.
+
+    Args:
+        cube: a cube, e.g. restricted to a contact with cube.xs('Mom', level='full_name', drop_level=False)
+        value: the column of the cube to sum
+
+    Returns:
+        a dataframe indexed by year with a column per month, months without messages are NaN
+    """
+    days = cube.index.get_level_values('day')
+    by_month = cube[value].groupby([days.year.rename('year'), days.month.rename('month')]).sum()
+    return by_month.unstack('month')
+
+
+def top_contacts(cube, n=None):
+    """
+    Counts the texts exchanged with each contact, the same as grouping the merged messages by full_name.
+
+    Args:
+        cube: a cube
+        n: if passed, only the n contacts with the most texts exchanged are returned
+
+    Returns:
+        a dataframe indexed by full_name with "Texts exchanged", "Texts received" and "Texts sent" columns, sorted by
+        the number of texts exchanged
+    """
+    by_direction = cube['messages'].groupby(level=['full_name', 'is_from_me'], observed=True).sum()
+    by_direction = by_direction.unstack('is_from_me', fill_value=0).reindex(columns=[False, True], fill_value=0)
+    counts = pd.DataFrame({'Texts exchanged': by_direction[False] + by_direction[True],
+                           'Texts received': by_direction[False],
+                           'Texts sent': by_direction[True]},
+                          columns=['Texts exchanged', 'Texts received', 'Texts sent'])
+    counts.index = counts.index.astype(object)
+    counts.index.name = 'full_name'
+    counts = counts.sort_values(by='Texts exchanged', ascending=False)
+    return counts if n is None else counts.head(n)
+
+
+def dense_series(cube, contacts=None, freq='M', value='messages'):
+    """
+    Sums the cube up per contact and period, with a zero for every period between the first and last message in
+    which a contact didn't text, e.g. for a steamgraph.
+
+    Args:
+        cube: a cube
+        contacts: if passed, only these full names are kept, in this order
+        freq: see rollup()
+        value: the column of the cube to sum
+
+    Returns:
+        a dataframe indexed by period with a column per contact
+    """
+    if contacts is not None:
+        cube = cube[cube.index.get_level_values('full_name').isin(contacts)]
+    by_period = rollup(cube, freq, by=('full_name',))[value].unstack('full_name', fill_value=0)
+    by_period.columns = by_period.columns.astype(object)
+    if contacts is not None:
+        by_period = by_period.reindex(columns=[contact for contact in contacts if contact in by_period.columns])
+    if by_period.empty:
+        return by_period
+    periods = pd.period_range(by_period.index.min(), by_period.index.max(), freq=freq, name='period')
+    return by_period.reindex(periods, fill_value=0)
@@ -0,0 +1,200 @@
+"""
+
+This module exports merged messages and the address book as compressed columnar files, Parquet or Feather, and reads
+them back, so later analyses needn't load the messages from the backup again.
+
+Messages are written as a dataset partitioned by year, a directory per year named after Hive's convention:
+
+    <output directory>/messages/year=2015/part-0-0.parquet
+    <output directory>/messages/year=2016/part-0-0.parquet
+    <output directory>/addresses.parquet
+
+read_messages() only reads the years and columns asked for, the files of other years aren't opened and, for Parquet,
+the other columns aren't read.  iter_messages() reads them in batches so the messages needn't fit in memory at once.
+Messages without a date are kept in the partition PyArrow names __HIVE_DEFAULT_PARTITION__.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import glob
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as parquet
+import shutil
+
+EXPORT_FORMATS = ['parquet', 'feather']
+MESSAGES_DIRECTORY = 'messages'
+ADDRESSES_FILENAME = 'addresses'
+PARTITION_COLUMN = 'year'
+COMPRESSION = 'zstd'
+# PyArrow calls the Feather format ipc within datasets.
+_DATASET_FORMATS = {'parquet': 'parquet', 'feather': 'ipc'}
+_PARTITIONING = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.int32())]), flavor='hive')
+
+
+def __get_messages_directory(output_directory):
+    return os.path.join(output_directory, MESSAGES_DIRECTORY)
+
+
+# Works out the format of an export from the extension of its files.
+def __detect_export_format(output_directory):
+    for export_format in EXPORT_FORMATS:
+        if glob.glob(os.path.join(__get_messages_directory(output_directory), '*', '*.' + export_format)):
+            return export_format
+    raise ValueError('No exported messages found in {0}'.format(output_directory))
+
+
+def __get_file_options(export_format):
+    dataset_format = ds.ParquetFileFormat() if export_format == 'parquet' else ds.IpcFileFormat()
+    return dataset_format.make_write_options(compression=COMPRESSION)
+
+
+def write_messages(messages_df, output_directory, export_format='parquet', part=0):
+    """
+    Writes messages as a dataset partitioned by the year of their date.
+
+    Args:
+        messages_df: merged messages, must contain a date column
+        output_directory: the directory to write the messages directory in, it's created if needed
+        export_format: parquet or feather
+        part: distinguishes batches of messages written by separate calls, e.g. with
+            iphone_connector.iter_fully_merged_messages().  Writing part 0 replaces any messages exported to the
+            directory before, later parts are added alongside the earlier ones
+
+    Returns:
+        the number of messages written
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format {0}, expected one of {1}'.format(export_format, EXPORT_FORMATS))
+    table = pa.Table.from_pandas(messages_df, preserve_index=True)
+    years = pa.array(messages_df['date'].dt.year.astype('Int32'), type=pa.int32(), from_pandas=True)
+    table = table.append_column(PARTITION_COLUMN, years)
+
+    messages_directory = __get_messages_directory(output_directory)
+    if part == 0 and os.path.isdir(messages_directory):
+        # Otherwise the years this export has no messages for would keep those of the previous export.
+        shutil.rmtree(messages_directory)
+    ds.write_dataset(table, messages_directory, format=_DATASET_FORMATS[export_format], partitioning=_PARTITIONING,
+                     basename_template='part-{0:d}-{{i}}.{1}'.format(part, export_format),
+                     file_options=__get_file_options(export_format), existing_data_behavior='overwrite_or_ignore')
+    return messages_df.shape[0]
+
+
+def write_addresses(addresses_df, output_directory, export_format='parquet'):
+    """
+    Writes the address book to a single file.
+
+    Args:
+        addresses_df: the address book
+        output_directory: the directory to write it in, it's created if needed
+        export_format: parquet or feather
+
+    Returns:
+        the path of the file written
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format {0}, expected one of {1}'.format(export_format, EXPORT_FORMATS))
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    path = os.path.join(output_directory, '{0}.{1}'.format(ADDRESSES_FILENAME, export_format))
+    table = pa.Table.from_pandas(addresses_df, preserve_index=True)
+    if export_format == 'parquet':
+        parquet.write_table(table, path, compression=COMPRESSION)
+    else:
+        feather.write_feather(table, path, compression=COMPRESSION)
+    return path
+
+
+def get_messages_dataset(output_directory, export_format=None):
+    """
+    Opens exported messages as a PyArrow dataset without reading them, e.g. to filter them with PyArrow expressions.
+
+    Args:
+        output_directory: the directory the messages were exported to
+        export_format: parquet or feather, detected from the files if not passed
+
+    Returns:
+        a pyarrow.dataset.Dataset, partitioned by year
+    """
+    export_format = export_format or __detect_export_format(output_directory)
+    return ds.dataset(__get_messages_directory(output_directory), format=_DATASET_FORMATS[export_format],
+                      partitioning=_PARTITIONING)
+
+
+# Returns the arguments that restrict a scan of the dataset to the passed columns and years.  The index is always
+# read so the rows keep their row_index.
+def __get_scan_arguments(dataset, columns, years):
+    if columns is not None:
+        index_columns = [name for name in dataset.schema.names
+                         if name.startswith('__index_level_') or name == 'row_index']
+        columns = index_columns + [column for column in columns if column not in index_columns]
+    year_filter = ds.field(PARTITION_COLUMN).isin([int(year) for year in years]) if years is not None else None
+    return {'columns': columns, 'filter': year_filter}
+
+
+# Converts a table read from the dataset to a dataframe, dropping the partition column unless it was asked for.
+def __to_dataframe(table, columns):
+    if PARTITION_COLUMN in table.column_names and (columns is None or PARTITION_COLUMN not in columns):
+        table = table.drop_columns([PARTITION_COLUMN])
+    return table.to_pandas()
+
+
+def read_messages(output_directory, columns=None, years=None, export_format=None):
+    """
+    Reads exported messages, only reading the files of the years asked for.
+
+    Args:
+        output_directory: the directory the messages were exported to
+        columns: if passed, only these columns are read, the year partition column can be asked for too
+        years: if passed, only messages from these years are read
+        export_format: parquet or feather, detected from the files if not passed
+
+    Returns:
+        a dataframe of the messages, in the order they were written within each year
+    """
+    dataset = get_messages_dataset(output_directory, export_format)
+    return __to_dataframe(dataset.to_table(**__get_scan_arguments(dataset, columns, years)), columns)
+
+
+def iter_messages(output_directory, columns=None, years=None, export_format=None, batch_size=50000):
+    """
+    Same as read_messages() but yields the messages in batches, so they needn't all fit in memory at once.
+
+    Args:
+        output_directory: see read_messages()
+        columns: see read_messages()
+        years: see read_messages()
+        export_format: see read_messages()
+        batch_size: the maximum number of messages per batch
+
+    Returns:
+        a generator of dataframes of messages
+    """
+    dataset = get_messages_dataset(output_directory, export_format)
+    scanner = dataset.scanner(batch_size=batch_size, **__get_scan_arguments(dataset, columns, years))
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield __to_dataframe(pa.Table.from_batches([batch]), columns)
+
+
+def read_addresses(output_directory, export_format=None):
+    """
+    Reads the exported address book.
+
+    Args:
+        output_directory: the directory the address book was exported to
+        export_format: parquet or feather, detected from the files if not passed
+
+    Returns:
+        a dataframe of the address book
+    """
+    export_format = export_format or __detect_export_format(output_directory)
+    path = os.path.join(output_directory, '{0}.{1}'.format(ADDRESSES_FILENAME, export_format))
+    if export_format == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_feather(path)
@@ -0,0 +1,156 @@
+"""
+
+This module maintains a full-text index over the text of the merged messages, so searching for a term doesn't scan
+every message with DataFrame.str.contains().
+
+The index is a SQLite database holding:
+
+1. An FTS5 table with the text of each message, keyed by message_id.  It uses the trigram tokenizer so, like
+   str.contains(term, case=False), a term matches anywhere within a text rather than only whole words.
+2. A table with the full_name and date of each row of the merged messages, so searches can be restricted to contacts
+   and dates.  Group messages you sent have a row per participant.
+
+iphone_connector.get_cached_fully_merged_messages() keeps an index next to its cache, see
+iphone_connector.get_search_index_path().
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import contextlib
+import numpy as np
+import pandas as pd
+import sqlite3
+
+import contact_normalization
+
+# The file name of the index kept next to the cache of iphone_connector.get_cached_fully_merged_messages().
+SEARCH_INDEX_FILENAME = 'search_index.sqlite'
+# The trigram tokenizer only indexes terms of at least this many characters, shorter terms fall back to LIKE.
+_MIN_INDEXED_TERM_LENGTH = 3
+
+
+# Opens the index, creating its tables if needed.
+def __open_index(index_path):
+    con = sqlite3.connect(index_path)
+    con.executescript('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS message_text USING fts5(text, tokenize = 'trigram');
+    CREATE TABLE IF NOT EXISTS message_row (
+        message_id INTEGER NOT NULL,
+        full_name TEXT,
+        date INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS message_row_message_id ON message_row (message_id);
+    CREATE INDEX IF NOT EXISTS message_row_full_name_date ON message_row (full_name, date);
+    ''')
+    return contextlib.closing(con)
+
+
+def update_search_index(index_path, messages_df, rebuild=False):
+    """
+    Adds the messages that aren't indexed yet to the index, creating it if needed.  Messages are added in order of
+    message_id so only those with a message_id above the largest one indexed are added.
+
+    Args:
+        index_path: path of the SQLite file holding the index
+        messages_df: merged messages, must contain message_id, text, full_name and date columns
+        rebuild: if true, everything already in the index is dropped first, e.g. because contact names changed
+
+    Returns:
+        the number of messages added
+    """
+    with __open_index(index_path) as con:
+        with con:
+            if rebuild:
+                con.execute('DELETE FROM message_text')
+                con.execute('DELETE FROM message_row')
+            max_message_id = con.execute('SELECT COALESCE(MAX(message_id), -1) FROM message_row').fetchone()[0]
+            new_messages_df = messages_df[messages_df['message_id'] > max_message_id]
+
+            dates = new_messages_df['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+            dates = np.where(new_messages_df['date'].isnull().to_numpy(), None, dates)
+            con.executemany('INSERT INTO message_row VALUES (?, ?, ?)', zip(
+                new_messages_df['message_id'].astype(int).tolist(),
+                new_messages_df['full_name'].astype(object).where(new_messages_df['full_name'].notnull()).tolist(),
+                dates.tolist()))
+
+            texts = new_messages_df.loc[new_messages_df['text'].notnull(), ['message_id', 'text']]
+            texts = texts.drop_duplicates('message_id')
+            con.executemany('INSERT INTO message_text (rowid, text) VALUES (?, ?)', zip(
+                texts['message_id'].astype(int).tolist(), texts['text'].astype(str).tolist()))
+    return texts.shape[0]
+
+
+def search_messages(index_path, term, contacts=None, since=None, until=None):
+    """
+    Finds the messages whose text contains a term, ignoring case.
+
+    Note:
+        Terms shorter than three characters can't use the index and fall back to a LIKE scan, which only ignores the
+        case of ASCII letters.
+
+    Args:
+        index_path: path of the SQLite file holding the index
+        term: the text to search for, it is matched literally
+        contacts: a full name, or list of full names, to restrict to messages exchanged with.  Names as displayed by
+            the notebook, see contact_normalization.to_display_names(), work too
+        since: if passed, only messages sent at or after this date are returned, anything pd.Timestamp accepts works
+        until: if passed, only messages sent before this date are returned
+
+    Returns:
+        a sorted numpy array of the matching message ids, e.g. for use with df[df.message_id.isin(message_ids)]
+    """
+    if len(term) >= _MIN_INDEXED_TERM_LENGTH:
+        sql = ['SELECT DISTINCT message_row.message_id FROM message_text',
+               'JOIN message_row ON message_row.message_id = message_text.rowid',
+               'WHERE message_text MATCH ?']
+        # Quoting the term makes FTS5 match it as a literal string rather than parse it as a query.
+        params = ['"{0}"'.format(term.replace('"', '""'))]
+    else:
+        sql = ['SELECT DISTINCT message_row.message_id FROM message_text',
+               'JOIN message_row ON message_row.message_id = message_text.rowid',
+               "WHERE message_text.text LIKE ? ESCAPE '\\'"]
+        params = ['%{0}%'.format(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))]
+
+    if contacts is not None:
+        if isinstance(contacts, str):
+            contacts = [contacts]
+        contacts = [contact_normalization.to_full_name(contact) for contact in contacts]
+        sql.append('AND message_row.full_name IN ({0})'.format(', '.join('?' * len(contacts))))
+        params.extend(contacts)
+    if since is not None:
+        sql.append('AND message_row.date >= ?')
+        params.append(pd.Timestamp(since).value)
+    if until is not None:
+        sql.append('AND message_row.date < ?')
+        params.append(pd.Timestamp(until).value)
+    sql.append('ORDER BY message_row.message_id')
+
+    with __open_index(index_path) as con:
+        rows = con.execute('\n'.join(sql), params).fetchall()
+    return np.array([message_id for (message_id,) in rows], dtype=np.int64)
+
+
+def get_texts(index_path, message_ids):
+    """
+    Reads the text of messages from the index, which is cheaper than loading the merged messages for a few of them.
+
+    Args:
+        index_path: path of the SQLite file holding the index
+        message_ids: the ids of the messages, e.g. as returned by search_messages()
+
+    Returns:
+        a series of the texts indexed by message_id, in order of message_id
+    """
+    message_ids = [int(message_id) for message_id in message_ids]
+    texts = {}
+    with __open_index(index_path) as con:
+        # Stay well under SQLite's limit on the number of query parameters.
+        for start in range(0, len(message_ids), 500):
+            batch = message_ids[start:start + 500]
+            texts.update(con.execute('SELECT rowid, text FROM message_text WHERE rowid IN ({0})'.format(
+                ', '.join('?' * len(batch))), batch))
+    texts = pd.Series(texts, dtype=object).sort_index()
+    texts.index.name = 'message_id'
+    return texts.rename('text')
@@ -137,16 +137,13 @@ function steamgraph(data, opt_color) {
                     var xValueAsTimeStamp = new Date(xScale.invert(xCoord)).getTime();
                     var valuesForLayer = d.values;
 
-                    var smallestDiff = Number.MAX_SAFE_INTEGER;
-                    var smallestDiffIdx = -1;
-                    // Finds the closest x value to the hovered point.
-                    // TODO convert to binary search
-                    for (var xIdx = 0; xIdx < valuesForLayer.length; xIdx++) {
-                        var diff = Math.abs(valuesForLayer[xIdx].date.getTime() - xValueAsTimeStamp);
-                        if (diff < smallestDiff) {
-                            smallestDiff = diff;
-                            smallestDiffIdx = xIdx;
-                        }
+                    // Finds the closest x value to the hovered point, values are sorted by date.
+                    var smallestDiffIdx = steamgraph.bisectDate(valuesForLayer, new Date(xValueAsTimeStamp));
+                    if (smallestDiffIdx >= valuesForLayer.length ||
+                        (smallestDiffIdx > 0 &&
+                         xValueAsTimeStamp - valuesForLayer[smallestDiffIdx - 1].date.getTime() <
+                         valuesForLayer[smallestDiffIdx].date.getTime() - xValueAsTimeStamp)) {
+                        smallestDiffIdx -= 1;
                     }
 
                     d3.select(this)
@@ -182,11 +179,41 @@ function steamgraph(data, opt_color) {
     };
 }
 
+// Flattens the data passed to createSteamgraph() into one {key, date, value} record per series and date.
+function parseSteamgraphData(steamgraphData) {
+    if (typeof steamgraphData == "string") {
+        // The CSV format createSteamgraph() used to take.
+        return d3.csv.parse(steamgraphData, function(data) {
+            return {
+                key: data.key,
+                date: d3.time.format("%Y/%m").parse(data.date),
+                value: parseInt(data.value)
+            }
+        });
+    }
+    var parseDate = d3.time.format("%Y-%m-%d").parse;
+    var dates = steamgraphData.dates.map(parseDate);
+    var data = [];
+    steamgraphData.series.forEach(function(series) {
+        for (var i = 0; i < dates.length; i++) {
+            data.push({
+                key: series.key,
+                date: dates[i],
+                value: series.values[i]
+            });
+        }
+    });
+    return data;
+}
+
 /**
- * Draws a steamgraph with data in the passed CSV.  The CSV must have the format of:
- * date,key,value
- * YYYY/MM,John Doe,# texts exchanged in this month
- * YYYY/MM,Jane Doe,# texts exchanged in this month
+ * Draws a steamgraph of the passed data, as built by steamgraph.get_steamgraph_data() in Python:
+ * {
+ *   "dates": ["YYYY-MM-DD", ...],  // The date each bucket starts at.
+ *   "series": [{"key": "John Doe", "values": [# texts exchanged in each bucket, ...]}, ...],
+ *   "dateFormat": "%b '%y"  // Optional, how to show the date of a bucket.
+ * }
+ * A CSV string of date,key,value rows with YYYY/MM dates is also accepted.
  * 
  * The streamgraph is drawn with the color palette from colorbrewer.js named by opt_color, or
  * defaults to the 'Spectral' color palette.
@@ -195,15 +222,12 @@ function steamgraph(data, opt_color) {
  * draw the steamgraph.
  */
 
-function createSteamgraph(csvAsString, opt_color) {
-    var data = d3.csv.parse(csvAsString, function(data) {
-        return {
-            key: data.key,
-            date: d3.time.format("%Y/%m").parse(data.date),
-            value: parseInt(data.value)
-        }
-    });
-    steamgraph.READABLE_DATE_FORMAT = d3.time.format("%b '%y");
+function createSteamgraph(steamgraphData, opt_color) {
+    var data = parseSteamgraphData(steamgraphData);
+    steamgraph.READABLE_DATE_FORMAT = d3.time.format(steamgraphData.dateFormat || "%b '%y");
+    steamgraph.bisectDate = d3.bisector(function(d) {
+        return d.date;
+    }).left;
     steamgraph.COMMA_FORMAT = d3.format("0,000");
     steamgraph.stacker = d3.layout.stack()
         .offset("wiggle")
@@ -0,0 +1,88 @@
+"""
+
+This module prepares the data drawn by createSteamgraph() in steamgraph.js from a message cube, see message_cube.py.
+
+The data is sent to the browser as compact JSON: the date of each bucket once, then an array of values per contact.
+Contacts past the top N are summed into a single "Other" series, and if there are more buckets than the chart can
+show, consecutive buckets are summed so the browser only lays out about max_points of them.  When the periods don't
+divide evenly, the last bucket holds fewer of them and is scaled up to a whole bucket so the chart doesn't dip at its
+right edge.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import json
+import numpy as np
+import pandas as pd
+
+import message_cube
+
+OTHER_SERIES_KEY = 'Other'
+# How createSteamgraph() formats the date of a bucket in its tooltip, per pandas period alias.
+_READABLE_DATE_FORMATS = {'D': "%b %d '%y", 'W': "%b %d '%y", 'M': "%b '%y", 'Q': "%b '%y", 'Y': '%Y'}
+
+
+# Picks the tooltip date format for a bucket length.
+def __get_readable_date_format(freq):
+    return _READABLE_DATE_FORMATS.get(pd.Period('2000-01-01', freq=freq).freqstr[0], "%b '%y")
+
+
+def get_steamgraph_data(cube, top_n=10, contacts=None, freq='M', max_points=None, value='messages',
+                        include_other=True):
+    """
+    Builds the data for a steamgraph of the texts exchanged with your top contacts over time.
+
+    Args:
+        cube: a message cube
+        top_n: the number of contacts to draw a series for, those with the highest total value
+        contacts: if passed, the full names to draw a series for, in this order, rather than the top_n contacts
+        freq: the length of a bucket as a pandas period alias, e.g. 'M' for months or 'D' for days
+        max_points: if passed and there are more buckets than this, consecutive buckets are summed so there are at
+            most this many.  A last bucket of fewer periods is scaled up to as many periods as the others, rounded
+        value: the column of the cube to draw, see message_cube.CUBE_COLUMNS
+        include_other: if true, the contacts without a series of their own are summed into an "Other" series
+
+    Returns:
+        a dict with the "dates" each bucket starts at as YYYY-MM-DD strings, the "series" as a list of dicts with the
+        "key" and "values" of each, and the "dateFormat" to show a bucket's date with
+    """
+    if contacts is None:
+        totals = cube[value].groupby(level='full_name', observed=True).sum()
+        totals.index = totals.index.astype(object)
+        contacts = totals.sort_values(ascending=False, kind='mergesort').head(top_n).index
+    contacts = list(contacts)
+
+    totals_by_period = message_cube.rollup(cube, freq, by=())[value]
+    if totals_by_period.empty:
+        return {'dates': [], 'series': [], 'dateFormat': __get_readable_date_format(freq)}
+    periods = pd.period_range(totals_by_period.index.min(), totals_by_period.index.max(), freq=freq, name='period')
+
+    by_period = message_cube.dense_series(cube, contacts, freq, value).reindex(periods, fill_value=0)
+    if include_other:
+        other = totals_by_period.reindex(periods, fill_value=0) - by_period.sum(axis=1)
+        if other.any():
+            by_period[OTHER_SERIES_KEY] = other
+
+    if max_points and len(periods) > max_points:
+        bucket_size = -(-len(periods) // max_points)
+        buckets = np.arange(len(periods)) // bucket_size
+        by_period = by_period.groupby(buckets).sum()
+        periods_in_last_bucket = len(periods) - buckets[-1] * bucket_size
+        if periods_in_last_bucket < bucket_size:
+            by_period.iloc[-1] = np.rint(by_period.iloc[-1] * bucket_size / periods_in_last_bucket).astype('int64')
+        periods = periods[::bucket_size]
+
+    return {
+        'dates': periods.start_time.strftime('%Y-%m-%d').tolist(),
+        'series': [{'key': str(key), 'values': by_period[key].astype('int64').tolist()} for key in by_period.columns],
+        'dateFormat': __get_readable_date_format(freq),
+    }
+
+
+def get_steamgraph_json(cube, **kwargs):
+    """
+    Returns the data built by get_steamgraph_data() as JSON, the keyword arguments are passed through to it.
+    """
+    return json.dumps(get_steamgraph_data(cube, **kwargs), separators=(',', ':'))
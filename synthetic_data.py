@@ -0,0 +1,396 @@
+"""
+
+This module writes synthetic iPhone backups and Facebook archives, so loading and analysing messages can be measured,
+see benchmark.py, without a real backup or archive.
+
+Both scale from a few thousand to tens of millions of messages and are written in chunks, so memory stays flat
+however many messages are generated.  The same arguments and seed always write the same messages.
+
+The iPhone backup holds the message database (message, handle, chat, chat_handle_join and chat_message_join tables)
+and the address book database (ABPerson and ABMultiValue tables), sharded into subdirectories as newer iPhones do.
+Some handles aren't in the address book, and the same phone number is formatted differently in the two databases as
+on a real phone.  The Facebook archive is a single html/messages.htm in the format facebook_connector reads.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import datetime
+import io
+import numpy as np
+import os
+import shutil
+import sqlite3
+import time
+
+from xml.sax.saxutils import escape
+
+import iphone_connector
+
+# Chunk of messages generated and written at once.
+_CHUNK_SIZE = 100000
+_FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn', 'Mom',
+                'Dad', 'Chris', 'Pat', 'Drew', 'Robin', 'Lee', 'Kim', 'Dana', 'Jesse']
+_LAST_NAMES = ['Smith', 'Lee', 'Garcia', 'Chen', 'Patel', 'Kim', 'Nguyen', 'Brown', 'Lopez', 'Cohen', 'Singh',
+               'Rossi', 'Muller', 'Silva', 'Haddad', 'Novak', 'Sato', 'Okafor', 'Larsen', 'Dubois']
+_COMPANIES = ['Acme', 'Initech', 'Globex', 'Umbrella', 'Hooli']
+_COMMON_WORDS = ('i you the to a and it is that me my so be in for of on no just are we can what do have at was '
+                 'but lol ok haha yeah not with this like get love good what time how going will im if now home be '
+                 'there here see call tonight tomorrow dinner work later want know think feel sure thanks sorry '
+                 'miss well when too yes out up one back day need come go were really you\'re i\'ll don\'t can\'t '
+                 'it\'s that\'s omg wow awesome great nice happy birthday weekend movie coffee lunch morning night '
+                 'text phone car train late soon school class game party beer wine food pizza mom dad friend').split()
+# iOS stores dates as nanoseconds since this.
+_APPLE_EPOCH = datetime.datetime(2001, 1, 1)
+_FIRST_MESSAGE_DATE = datetime.datetime(2012, 1, 1)
+_LAST_MESSAGE_DATE = datetime.datetime(2020, 1, 1)
+
+
+# Returns a vocabulary of made up words after the common ones, and the probability of picking each.  Word
+# frequencies follow Zipf's law as in real text.
+def __get_vocabulary(random_state, size=5000):
+    syllables = ['ba', 'ko', 'ri', 'tu', 'me', 'sa', 'lo', 'ni', 'ver', 'dan', 'gel', 'pho', 'str', 'ing', 'ed']
+    made_up = set()
+    while len(made_up) < size - len(_COMMON_WORDS):
+        made_up.add(''.join(random_state.choice(syllables, random_state.randint(2, 5))))
+    vocabulary = np.array(_COMMON_WORDS + sorted(made_up), dtype=object)
+    weights = 1 / np.arange(1, len(vocabulary) + 1)
+    return vocabulary, weights / weights.sum()
+
+
+# Returns the number of messages per chunk to write number_of_messages.
+def __get_chunk_sizes(number_of_messages):
+    return [min(_CHUNK_SIZE, number_of_messages - start) for start in range(0, number_of_messages, _CHUNK_SIZE)]
+
+
+# Generates the text of messages, roughly 2% have no text as with attachments.
+def __generate_texts(random_state, vocabulary, probabilities, count):
+    lengths = np.minimum(random_state.geometric(1 / 8, count), 60)
+    words = random_state.choice(vocabulary, lengths.sum(), p=probabilities)
+    ends = np.cumsum(lengths)
+    texts = [' '.join(words[end - length:end]) for end, length in zip(ends, lengths)]
+    for i in np.flatnonzero(random_state.random_sample(count) < .02):
+        texts[i] = None
+    return texts
+
+
+# Returns the dates of messages in order, spread evenly between the first and last message date with some jitter.
+def __generate_dates(random_state, start, count, number_of_messages):
+    span = (_LAST_MESSAGE_DATE - _FIRST_MESSAGE_DATE).total_seconds()
+    seconds = (np.arange(start, start + count) + random_state.random_sample(count)) * (span / number_of_messages)
+    return [_FIRST_MESSAGE_DATE + datetime.timedelta(seconds=float(offset)) for offset in seconds]
+
+
+# Returns the participants of each chat as lists of contact indices, first a chat per contact then the group chats.
+def __generate_chats(random_state, number_of_contacts, group_chat_ratio):
+    chats = [[contact] for contact in range(number_of_contacts)]
+    if group_chat_ratio > 0 and number_of_contacts >= 3:
+        for _ in range(max(1, number_of_contacts // 10)):
+            size = random_state.randint(3, min(8, number_of_contacts + 1))
+            chats.append(sorted(random_state.choice(number_of_contacts, size, replace=False).tolist()))
+    return chats
+
+
+# Picks the chat of each message, a group chat for about group_chat_ratio of them.
+def __pick_chats(random_state, chats, number_of_contacts, group_chat_ratio, count):
+    number_of_group_chats = len(chats) - number_of_contacts
+    # Some contacts text far more than others.
+    contact_weights = 1 / np.arange(1, number_of_contacts + 1) ** .8
+    picked = random_state.choice(number_of_contacts, count, p=contact_weights / contact_weights.sum())
+    if number_of_group_chats:
+        in_group_chat = random_state.random_sample(count) < group_chat_ratio
+        picked[in_group_chat] = number_of_contacts + random_state.randint(0, number_of_group_chats,
+                                                                          in_group_chat.sum())
+    return picked
+
+
+def __get_names(random_state, number_of_contacts):
+    names = []
+    for i in range(number_of_contacts):
+        first = _FIRST_NAMES[i % len(_FIRST_NAMES)]
+        last = _LAST_NAMES[(i // len(_FIRST_NAMES)) % len(_LAST_NAMES)]
+        # Keep names unique past the first few hundred contacts.
+        suffix = i // (len(_FIRST_NAMES) * len(_LAST_NAMES))
+        names.append((first, last + (str(suffix) if suffix else ''),
+                      _COMPANIES[i % len(_COMPANIES)] if random_state.random_sample() < .1 else None))
+    return names
+
+
+def write_iphone_backup(backup_directory, number_of_messages=10000, number_of_contacts=200, group_chat_ratio=.2,
+                        seed=0):
+    """
+    Writes a synthetic iPhone backup, read it with iphone_connector.initialize(backup_directory).
+
+    Args:
+        backup_directory: the directory to write the backup to, it's created if needed and any databases already in
+            it are replaced
+        number_of_messages: the number of rows of the message table
+        number_of_contacts: the number of handles, about 10% of them aren't in the address book
+        group_chat_ratio: the fraction of messages sent in group chats
+        seed: seeds the random generator
+
+    Returns:
+        a tuple of the paths of the message and address book databases
+    """
+    random_state = np.random.RandomState(seed)
+    vocabulary, probabilities = __get_vocabulary(random_state)
+    message_path = os.path.join(backup_directory, iphone_connector.MESSAGE_DB[:2], iphone_connector.MESSAGE_DB)
+    address_path = os.path.join(backup_directory, iphone_connector.ADDRESS_DB[:2], iphone_connector.ADDRESS_DB)
+    for path in (message_path, address_path):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if os.path.exists(path):
+            os.remove(path)
+
+    names = __get_names(random_state, number_of_contacts)
+    numbers = ['617555{0:04d}'.format(i) if i < 10000 else '6{0:09d}'.format(i) for i in range(number_of_contacts)]
+    is_email = random_state.random_sample(number_of_contacts) < .1
+    # How the phone or email is stored in the message database, and in the address book.
+    handle_ids, address_book_values = [], []
+    for i, number in enumerate(numbers):
+        if is_email[i]:
+            email = '{0}.{1}{2}@example.com'.format(names[i][0], names[i][1], i).lower()
+            handle_ids.append(email)
+            address_book_values.append(email.upper() if i % 2 else email)
+        else:
+            handle_ids.append('+1' + number)
+            address_book_values.append('({0}) {1}-{2}'.format(number[:3], number[3:6], number[6:]) if i % 3
+                                       else '1 {0} {1} {2}'.format(number[:3], number[3:6], number[6:]))
+    in_address_book = random_state.random_sample(number_of_contacts) >= .1
+
+    address_con = sqlite3.connect(address_path)
+    address_con.executescript('''
+    CREATE TABLE ABPerson (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, First TEXT, Last TEXT, Organization TEXT,
+      Birthday TEXT, CreationDate INTEGER, ModificationDate INTEGER);
+    CREATE TABLE ABMultiValue (UID INTEGER PRIMARY KEY, record_id INTEGER, property INTEGER, identifier INTEGER,
+      label INTEGER, value TEXT);
+    ''')
+    person_id = 0
+    for i in np.flatnonzero(in_address_book):
+        person_id += 1
+        first, last, company = names[i]
+        has_birthday = random_state.random_sample() < .3
+        birthday = str(float(random_state.randint(-10 ** 9, 5 * 10 ** 8))) if has_birthday else None
+        address_con.execute('INSERT INTO ABPerson VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (person_id, first, last, company, birthday, 3 * 10 ** 8 + i, 5 * 10 ** 8 + i))
+        address_con.execute('INSERT INTO ABMultiValue (record_id, property, identifier, label, value) '
+                            'VALUES (?, ?, 0, 1, ?)', (person_id, 4 if is_email[i] else 3, address_book_values[i]))
+        # Entries that aren't phones or emails, e.g. a home page, are ignored.
+        if random_state.random_sample() < .2:
+            address_con.execute('INSERT INTO ABMultiValue (record_id, property, identifier, label, value) '
+                                'VALUES (?, 22, 0, 1, ?)', (person_id, 'http://example.com/{0}'.format(i)))
+    address_con.commit()
+    address_con.close()
+
+    message_con = sqlite3.connect(message_path)
+    message_con.executescript('''
+    PRAGMA journal_mode = OFF;
+    PRAGMA synchronous = OFF;
+    CREATE TABLE message (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT UNIQUE NOT NULL, text TEXT,
+      handle_id INTEGER DEFAULT 0, country TEXT, service TEXT, version INTEGER DEFAULT 0, date INTEGER,
+      date_read INTEGER, date_delivered INTEGER, is_emote INTEGER DEFAULT 0, is_from_me INTEGER DEFAULT 0,
+      is_read INTEGER DEFAULT 0, is_system_message INTEGER DEFAULT 0, is_service_message INTEGER DEFAULT 0,
+      is_sent INTEGER DEFAULT 0, has_dd_results INTEGER DEFAULT 0);
+    CREATE TABLE handle (ROWID INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, id TEXT NOT NULL, country TEXT,
+      service TEXT NOT NULL, uncanonicalized_id TEXT, UNIQUE (id, service));
+    CREATE TABLE chat (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT UNIQUE NOT NULL, style INTEGER,
+      chat_identifier TEXT, service_name TEXT, display_name TEXT);
+    CREATE TABLE chat_handle_join (chat_id INTEGER REFERENCES chat (ROWID) ON DELETE CASCADE,
+      handle_id INTEGER REFERENCES handle (ROWID) ON DELETE CASCADE, UNIQUE (chat_id, handle_id));
+    CREATE TABLE chat_message_join (chat_id INTEGER REFERENCES chat (ROWID) ON DELETE CASCADE,
+      message_id INTEGER REFERENCES message (ROWID) ON DELETE CASCADE, PRIMARY KEY (chat_id, message_id));
+    ''')
+    services = ['SMS' if not is_email[i] and random_state.random_sample() < .3 else 'iMessage'
+                for i in range(number_of_contacts)]
+    message_con.executemany('INSERT INTO handle VALUES (?, ?, ?, ?, ?)',
+                            [(i + 1, handle_id, 'us', services[i], handle_id)
+                             for i, handle_id in enumerate(handle_ids)])
+
+    chats = __generate_chats(random_state, number_of_contacts, group_chat_ratio)
+    message_con.executemany('INSERT INTO chat VALUES (?, ?, ?, ?, ?, ?)', [
+        (chat + 1, 'iMessage;{0};chat{1}'.format('+' if len(members) > 1 else '-', chat),
+         43 if len(members) > 1 else 45, 'chat{0}'.format(chat) if len(members) > 1 else handle_ids[members[0]],
+         'iMessage', None) for chat, members in enumerate(chats)])
+    message_con.executemany('INSERT INTO chat_handle_join VALUES (?, ?)',
+                            [(chat + 1, member + 1) for chat, members in enumerate(chats) for member in members])
+
+    message_id = 0
+    for count in __get_chunk_sizes(number_of_messages):
+        picked_chats = __pick_chats(random_state, chats, number_of_contacts, group_chat_ratio, count)
+        from_me = random_state.random_sample(count) < .45
+        texts = __generate_texts(random_state, vocabulary, probabilities, count)
+        dates = __generate_dates(random_state, message_id, count, number_of_messages)
+        delays = random_state.exponential(120, count)
+        rows, chat_rows = [], []
+        for i in range(count):
+            message_id += 1
+            members = chats[picked_chats[i]]
+            if from_me[i]:
+                # Messages you sent to a group have no handle.
+                handle = members[0] + 1 if len(members) == 1 else 0
+            else:
+                handle = members[random_state.randint(len(members))] + 1
+            date = int((dates[i] - _APPLE_EPOCH).total_seconds() * 10 ** 9)
+            other_date = date + int(delays[i] * 10 ** 9)
+            rows.append((message_id, 'SYNTHETIC-{0}'.format(message_id), texts[i], handle, 'us', 'iMessage', 10,
+                         date, 0 if from_me[i] else other_date, other_date if from_me[i] else 0, 0, int(from_me[i]),
+                         1, 0, 0, int(from_me[i]), 0))
+            chat_rows.append((int(picked_chats[i]) + 1, message_id))
+        message_con.executemany('INSERT INTO message VALUES ({0})'.format(', '.join('?' * 17)), rows)
+        message_con.executemany('INSERT INTO chat_message_join VALUES (?, ?)', chat_rows)
+        message_con.commit()
+    message_con.close()
+    return message_path, address_path
+
+
+def write_iphone_backups(base_directory, number_of_backups=3, number_of_messages=10000, number_of_contacts=200,
+                         group_chat_ratio=.2, seed=0, overlap=.5):
+    """
+    Writes several synthetic iPhone backups whose messages overlap, as with backups of one iPhone taken over time or
+    of several devices, read them with iphone_connector.get_cleaned_fully_merged_messages_from_backups().
+
+    The messages of write_iphone_backup() are split into overlapping windows of consecutive messages, one per backup,
+    so together the backups hold every message.  Every backup after the first numbers its messages' ROWIDs
+    differently, as another device would, while their guids stay the same.  Later windows are given later
+    modification times, so the backup with the latest messages is the newest.
+
+    Args:
+        base_directory: the directory to write the backups to, each in a subdirectory
+        number_of_backups: the number of backups to write
+        number_of_messages: the number of messages across all the backups
+        number_of_contacts: see write_iphone_backup()
+        group_chat_ratio: see write_iphone_backup()
+        seed: see write_iphone_backup()
+        overlap: the fraction of the messages of a backup that are also in the next backup
+
+    Returns:
+        a list of the backup directories, in order of their windows
+    """
+    backup_directories = [os.path.join(base_directory, 'backup{0}'.format(i)) for i in range(number_of_backups)]
+    message_path, address_path = write_iphone_backup(backup_directories[0], number_of_messages, number_of_contacts,
+                                                     group_chat_ratio, seed)
+    for backup_directory in backup_directories[1:]:
+        for path in (message_path, address_path):
+            copied_path = os.path.join(backup_directory, os.path.relpath(path, backup_directories[0]))
+            if not os.path.isdir(os.path.dirname(copied_path)):
+                os.makedirs(os.path.dirname(copied_path))
+            shutil.copyfile(path, copied_path)
+
+    window_size = number_of_messages / (number_of_backups - (number_of_backups - 1) * overlap)
+    modified_time = time.time() - number_of_backups
+    for i, backup_directory in enumerate(backup_directories):
+        first_message_id = int(round(i * window_size * (1 - overlap))) + 1
+        last_message_id = int(round(i * window_size * (1 - overlap) + window_size))
+        message_con = sqlite3.connect(os.path.join(backup_directory, iphone_connector.MESSAGE_DB[:2],
+                                                   iphone_connector.MESSAGE_DB))
+        message_con.execute('DELETE FROM message WHERE ROWID < ? OR ROWID > ?', (first_message_id, last_message_id))
+        message_con.execute('DELETE FROM chat_message_join WHERE message_id < ? OR message_id > ?',
+                            (first_message_id, last_message_id))
+        if i:
+            # Shifting by more than the largest ROWID never collides with a ROWID yet to be shifted.
+            offset = i * number_of_messages
+            message_con.execute('UPDATE message SET ROWID = ROWID + ?', (offset,))
+            message_con.execute('UPDATE chat_message_join SET message_id = message_id + ?', (offset,))
+        message_con.commit()
+        message_con.close()
+        os.utime(backup_directory, (modified_time + i, modified_time + i))
+    return backup_directories
+
+
+# Formats a date like Facebook's archive, e.g. "Thursday, January 1, 2015 at 10:00AM UTC".
+def __format_facebook_date(date):
+    return '{0}, {1} {2}, {3} at {4}:{5:02d}{6} UTC'.format(date.strftime('%A'), date.strftime('%B'), date.day,
+                                                          date.year, (date.hour - 1) % 12 + 1, date.minute,
+                                                          'AM' if date.hour < 12 else 'PM')
+
+
+def write_facebook_archive(dump_directory, number_of_messages=10000, number_of_contacts=200, group_chat_ratio=.2,
+                           seed=0, owner='Me Myself'):
+    """
+    Writes a synthetic Facebook archive, read it with facebook_connector.initialize(dump_directory).
+
+    Args:
+        dump_directory: the directory to write html/messages.htm to, it's created if needed
+        number_of_messages: the number of messages across all threads
+        number_of_contacts: the number of people you exchanged messages with, about 5% of them only show up by
+            their numeric Facebook ID
+        group_chat_ratio: the fraction of messages sent in group threads
+        seed: seeds the random generator
+        owner: the name of the archive's owner
+
+    Returns:
+        the path of messages.htm
+    """
+    random_state = np.random.RandomState(seed)
+    vocabulary, probabilities = __get_vocabulary(random_state)
+    messages_path = os.path.join(dump_directory, 'html', 'messages.htm')
+    if not os.path.isdir(os.path.dirname(messages_path)):
+        os.makedirs(os.path.dirname(messages_path))
+
+    people = []
+    for i, (first, last, _) in enumerate(__get_names(random_state, number_of_contacts)):
+        people.append('{0}@facebook.com'.format(100000000000000 + i) if random_state.random_sample() < .05
+                      else '{0} {1}'.format(first, last))
+    chats = __generate_chats(random_state, number_of_contacts, group_chat_ratio)
+
+    # Messages are written thread by thread, so first pick every message's thread and keep only the counts.
+    messages_per_thread = np.zeros(len(chats), dtype=np.int64)
+    for count in __get_chunk_sizes(number_of_messages):
+        picked_chats = __pick_chats(random_state, chats, number_of_contacts, group_chat_ratio, count)
+        messages_per_thread += np.bincount(picked_chats, minlength=len(chats))
+
+    with io.open(messages_path, 'wt', encoding='utf-8') as messages_file:
+        messages_file.write('<html><head><title>{0} - Messages</title></head><body><div class="contents">'
+                            '<h1>{0}</h1>\n'.format(escape(owner)))
+        for members, thread_size in zip(chats, messages_per_thread):
+            if not thread_size:
+                continue
+            participants = [people[member] for member in members]
+            messages_file.write('<div class="thread">{0}\n'.format(escape(', '.join(participants + [owner]))))
+            for count in __get_chunk_sizes(int(thread_size)):
+                texts = __generate_texts(random_state, vocabulary, probabilities, count)
+                # A thread's messages are spread over the whole span, in no particular order, as in real archives.
+                dates = __generate_dates(random_state, 0, count, count)
+                random_state.shuffle(dates)
+                from_me = random_state.random_sample(count) < .45
+                senders = random_state.randint(0, len(participants), count)
+                lines = []
+                for i in range(count):
+                    sender = owner if from_me[i] else participants[senders[i]]
+                    lines.append('<div class="message"><div class="message_header"><span class="user">{0}</span>'
+                                 '<span class="meta">{1}</span></div></div><p>{2}</p>\n'.format(
+                                     escape(sender), __format_facebook_date(dates[i]), escape(texts[i] or '')))
+                messages_file.write(''.join(lines))
+            messages_file.write('</div>\n')
+        messages_file.write('</div></body></html>\n')
+    return messages_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic iPhone backup or Facebook archive.')
+    parser.add_argument('kind', choices=['iphone', 'facebook'], help='The kind of data to write.')
+    parser.add_argument('output_directory', help='The directory to write the backup or archive to.')
+    parser.add_argument('-n', '--messages', type=int, default=10000, dest='messages',
+                        help='The number of messages to write.  Default 10000.')
+    parser.add_argument('--contacts', type=int, default=200, dest='contacts',
+                        help='The number of contacts messages are exchanged with.  Default 200.')
+    parser.add_argument('--group-chat-ratio', type=float, default=.2, dest='group_chat_ratio',
+                        help='The fraction of messages sent in group chats.  Default 0.2.')
+    parser.add_argument('--seed', type=int, default=0, dest='seed', help='Seeds the random generator.  Default 0.')
+    parser.add_argument('--backups', type=int, default=1, dest='backups',
+                        help='The number of overlapping iPhone backups to split the messages across, each written to '
+                             'a subdirectory.  Default 1.')
+    args = parser.parse_args()
+
+    if args.kind == 'iphone' and args.backups > 1:
+        paths = write_iphone_backups(args.output_directory, args.backups, args.messages, args.contacts,
+                                     args.group_chat_ratio, args.seed)
+    elif args.kind == 'iphone':
+        paths = write_iphone_backup(args.output_directory, args.messages, args.contacts, args.group_chat_ratio,
+                                    args.seed)
+    else:
+        paths = [write_facebook_archive(args.output_directory, args.messages, args.contacts, args.group_chat_ratio,
+                                        args.seed)]
+    print('Wrote {0:,} messages to {1}'.format(args.messages, ', '.join(paths)))
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import iphone_connector
+
+apple_timestamps_to_datetime = iphone_connector.__dict__['__apple_timestamps_to_datetime']
+
+# A birthday saved without a year, iOS stores it in the year 1604.
+YEARLESS_BIRTHDAY = -12484310400
+
+
+@pytest.mark.parametrize('dtype', ['int64', 'float64', object])
+def test_seconds_and_nanoseconds(dtype):
+    values = pd.Series([500000000, 500000000 * 10 ** 9, -86400], dtype=dtype)
+
+    dates = apple_timestamps_to_datetime(values)
+
+    assert dates.dtype == 'datetime64[ns]'
+    assert dates.tolist() == [pd.Timestamp('2016-11-05 00:53:20'), pd.Timestamp('2016-11-05 00:53:20'),
+                              pd.Timestamp('2000-12-31')]
+
+
+def test_nanoseconds_keep_their_precision():
+    dates = apple_timestamps_to_datetime(pd.Series([500000000123456789]))
+
+    assert dates[0] == pd.Timestamp('2016-11-05 00:53:20.123456789')
+
+
+def test_sub_second_seconds():
+    assert apple_timestamps_to_datetime(pd.Series([1.5]))[0] == pd.Timestamp('2001-01-01 00:00:01.5')
+
+
+@pytest.mark.parametrize('dtype', ['int64', 'float64', object])
+def test_missing_and_out_of_range_values_are_nat(dtype):
+    values = pd.Series([0, YEARLESS_BIRTHDAY, 10 ** 11 - 1, -(10 ** 11) + 1, np.iinfo(np.int64).max, 1],
+                       dtype=dtype, index=list('abcdef'))
+
+    dates = apple_timestamps_to_datetime(values)
+
+    assert dates.index.tolist() == list('abcdef')
+    assert dates.iloc[:5].isnull().all()
+    assert dates['f'] == pd.Timestamp('2001-01-01 00:00:01')
+
+
+def test_null_and_unparseable_values_are_nat():
+    dates = apple_timestamps_to_datetime(pd.Series([None, np.nan, 'not a date', 60], dtype=object))
+
+    assert dates.iloc[:3].isnull().all()
+    assert dates.iloc[3] == pd.Timestamp('2001-01-01 00:01:00')
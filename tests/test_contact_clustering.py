@@ -0,0 +1,169 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import contact_clustering
+import tfidf_engine
+
+# Each group of contacts texts about its own topics.
+TOPICS = [
+    ['soccer', 'match', 'goal', 'training', 'coach', 'league'],
+    ['deadline', 'meeting', 'project', 'report', 'client', 'slides'],
+    ['puppy', 'walk', 'vet', 'treats', 'leash', 'park'],
+]
+COMMON_WORDS = ['tonight', 'weekend', 'tomorrow', 'later', 'really', 'great']
+CONTACTS_PER_TOPIC = 4
+TEXTS_PER_CONTACT = 30
+# Sends the same texts as the first contact.
+TWIN_CONTACT = 'Twin Contact'
+# Barely texts, so isn't clustered until added with add_contacts().
+LATE_CONTACT = 'Late Contact'
+MIN_TEXTS_REQUIRED = 10
+
+
+def _contact_name(topic, i):
+    return 'Contact {0}-{1}'.format(topic, i)
+
+
+def _received_messages(extra_text=None):
+    random_state = np.random.RandomState(0)
+    rows = []
+    for topic, topic_words in enumerate(TOPICS):
+        for i in range(CONTACTS_PER_TOPIC):
+            for _ in range(TEXTS_PER_CONTACT):
+                words = random_state.choice(topic_words + COMMON_WORDS, size=random_state.randint(3, 8))
+                rows.append((_contact_name(topic, i), ' '.join(words)))
+    rows.extend((TWIN_CONTACT, text) for name, text in list(rows) if name == _contact_name(0, 0))
+    rows.extend((LATE_CONTACT, 'coach goal league training') for _ in range(3))
+    if extra_text is not None:
+        rows.append((_contact_name(1, 0), extra_text))
+    return pd.DataFrame(rows, columns=['full_name', 'text']).assign(is_from_me=0)
+
+
+def _fit_tfidf(tmp_path, messages_df):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return tfidf_engine.fit_contact_tfidf(messages_df, cache_path=str(tmp_path / 'contact_tfidf.pkl'))
+
+
+def _get_clusters(contact_tfidf, cache_path, **kwargs):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        contact_clusters = contact_clustering.get_contact_clusters(
+            contact_tfidf, min_texts_required=MIN_TEXTS_REQUIRED, number_of_clusters=len(TOPICS),
+            cache_path=cache_path, **kwargs)
+    return contact_clusters, output.getvalue()
+
+
+@pytest.fixture(scope='module')
+def contact_tfidf(tmp_path_factory):
+    return _fit_tfidf(tmp_path_factory.mktemp('tfidf'), _received_messages())
+
+
+@pytest.fixture
+def contact_clusters(contact_tfidf, tmp_path):
+    return _get_clusters(contact_tfidf, str(tmp_path / 'contact_clusters.pkl'))[0]
+
+
+def test_clusters_contacts_by_topic(contact_clusters):
+    assert LATE_CONTACT not in contact_clusters.names
+    assignments = pd.Series(contact_clusters.assignments, index=contact_clusters.names)
+    for topic in range(len(TOPICS)):
+        topic_assignments = {assignments[_contact_name(topic, i)] for i in range(CONTACTS_PER_TOPIC)}
+        assert len(topic_assignments) == 1
+    assert assignments[TWIN_CONTACT] == assignments[_contact_name(0, 0)]
+    assert assignments.nunique() == len(TOPICS)
+    assert contact_clusters.cluster_sizes.tolist() == np.bincount(contact_clusters.assignments).tolist()
+
+
+def test_get_contact_clusters_reuses_the_cache(contact_tfidf, tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'contact_clusters.pkl')
+    contact_clusters, output = _get_clusters(contact_tfidf, cache_path)
+    assert 'Loaded contact clusters' not in output
+
+    def fail_to_fit(*args, **kwargs):
+        raise AssertionError('The clusters were fitted again')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(contact_clustering, 'fit_contact_clusters', fail_to_fit)
+        cached_contact_clusters, output = _get_clusters(contact_tfidf, cache_path)
+    assert 'Loaded contact clusters from {0}'.format(cache_path) in output
+    assert cached_contact_clusters.fingerprint == contact_clusters.fingerprint
+    assert cached_contact_clusters.names.tolist() == contact_clusters.names.tolist()
+    np.testing.assert_array_equal(cached_contact_clusters.assignments, contact_clusters.assignments)
+    np.testing.assert_allclose(cached_contact_clusters.embedding, contact_clusters.embedding)
+
+
+def test_get_contact_clusters_refits_when_the_tfidf_changes(contact_tfidf, tmp_path):
+    cache_path = str(tmp_path / 'contact_clusters.pkl')
+    contact_clusters, _ = _get_clusters(contact_tfidf, cache_path)
+
+    changed_contact_tfidf = _fit_tfidf(tmp_path, _received_messages(extra_text='slides for the client tonight'))
+    assert changed_contact_tfidf.fingerprint != contact_tfidf.fingerprint
+    refitted_contact_clusters, output = _get_clusters(changed_contact_tfidf, cache_path)
+    assert 'Loaded contact clusters' not in output
+    assert refitted_contact_clusters.fingerprint != contact_clusters.fingerprint
+
+    # The refitted clusters replaced the old ones on disk.
+    reloaded_contact_clusters, output = _get_clusters(changed_contact_tfidf, cache_path)
+    assert 'Loaded contact clusters' in output
+    assert reloaded_contact_clusters.fingerprint == refitted_contact_clusters.fingerprint
+    _, output = _get_clusters(contact_tfidf, cache_path)
+    assert 'Loaded contact clusters' not in output
+
+
+def test_get_contact_clusters_refits_when_settings_change(contact_tfidf, tmp_path):
+    cache_path = str(tmp_path / 'contact_clusters.pkl')
+    contact_clusters, _ = _get_clusters(contact_tfidf, cache_path)
+
+    for kwargs in [{'number_of_components': 3}, {'mini_batch': True}, {'force_refit': True}]:
+        refitted_contact_clusters, output = _get_clusters(contact_tfidf, cache_path, **kwargs)
+        assert 'Loaded contact clusters' not in output, kwargs
+    assert refitted_contact_clusters.fingerprint == contact_clusters.fingerprint
+
+
+def test_most_similar_excludes_the_contact(contact_clusters):
+    number_of_contacts = len(contact_clusters.names)
+    for contact in contact_clusters.names:
+        similar = contact_clusters.most_similar(contact, top_n=number_of_contacts)
+        assert contact not in similar['full_name'].tolist()
+        assert similar.shape[0] == number_of_contacts - 1
+        assert similar['similarity'].is_monotonic_decreasing
+
+    similar = contact_clusters.most_similar(_contact_name(0, 0), top_n=CONTACTS_PER_TOPIC)
+    # The twin sends the same texts, so is the most similar, then the contacts texting about the same topic.
+    assert similar['full_name'].iloc[0] == TWIN_CONTACT
+    np.testing.assert_allclose(similar['similarity'].iloc[0], 1)
+    assert set(similar['full_name'].iloc[1:]) == {_contact_name(0, i) for i in range(1, CONTACTS_PER_TOPIC)}
+    assert contact_clusters.most_similar(LATE_CONTACT) is None
+
+
+def test_add_contacts(contact_tfidf, contact_clusters):
+    names = contact_clusters.names.tolist()
+    sizes = contact_clusters.cluster_sizes.copy()
+    sums = contact_clusters.cluster_sums.copy()
+
+    # Contacts that are already clustered are left as they are.
+    contact_clusters.add_contacts(contact_tfidf.matrix[:2], contact_tfidf.names[:2])
+    assert contact_clusters.names.tolist() == names
+
+    contact_clusters.add_contacts(contact_tfidf.matrix, contact_tfidf.names)
+
+    assert contact_clusters.names.tolist() == names + [LATE_CONTACT]
+    assert contact_clusters.names.name == 'full_name'
+    late_record = contact_tfidf.get_record(LATE_CONTACT)
+    late_cluster = contact_clusters.assignments[-1]
+    assert late_cluster == contact_clusters.assignments[names.index(_contact_name(0, 0))]
+    assert contact_clusters.cluster_sizes[late_cluster] == sizes[late_cluster] + 1
+    assert contact_clusters.cluster_sizes.sum() == sizes.sum() + 1
+    expected_sums = sums.copy()
+    expected_sums[late_cluster] += np.asarray(late_record.todense()).ravel()
+    np.testing.assert_allclose(contact_clusters.cluster_sums, expected_sums)
+    assert contact_clusters.embedding.shape[0] == contact_clusters.embedding_2d.shape[0] == len(names) + 1
+
+    similar = contact_clusters.most_similar(LATE_CONTACT, top_n=CONTACTS_PER_TOPIC)
+    assert LATE_CONTACT not in similar['full_name'].tolist()
+    assert set(similar['full_name']) <= {TWIN_CONTACT} | {_contact_name(0, i) for i in range(CONTACTS_PER_TOPIC)}
+    assert LATE_CONTACT in contact_clusters.most_similar(_contact_name(0, 0), top_n=len(names))['full_name'].tolist()
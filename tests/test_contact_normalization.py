@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import contact_normalization
+
+NAME_PARTS = ['John', 'Smith', 'Acme Inc', u'Zo\xeb', '', None, np.nan]
+
+
+def _random_phone(random_state):
+    digits = ''.join(str(digit) for digit in random_state.randint(0, 10, size=10))
+    area, exchange, line = digits[:3], digits[3:6], digits[6:]
+    formats = ['{0}{1}{2}', '1{0}{1}{2}', '+1{0}{1}{2}', '+1 ({0}) {1}-{2}', '({0}) {1}-{2}', '1-{0}-{1}-{2}',
+               u'{0}\xa0{1}\xa0{2}', '+44 {0} {1} {2}', '{1}-{2}']
+    return formats[random_state.randint(len(formats))].format(area, exchange, line)
+
+
+def _random_email(random_state):
+    local_parts = ['jane', 'john.smith', '16175551234', '+16175551234', 'a (b)-c']
+    return '{0}@example.com'.format(local_parts[random_state.randint(len(local_parts))])
+
+
+@pytest.fixture
+def random_state():
+    return np.random.RandomState(0)
+
+
+@pytest.mark.parametrize('dtype', [object, 'str'])
+def test_standardize_phones_and_emails_matches_row_wise(random_state, dtype):
+    phones_or_emails = [_random_phone(random_state) if random_state.rand() < .7 else _random_email(random_state)
+                        for _ in range(2000)]
+    # Handles repeat on nearly every message, make sure repeated values are covered.
+    phones_or_emails += phones_or_emails[:500]
+    series = pd.Series(phones_or_emails, dtype=dtype, index=np.arange(len(phones_or_emails)) * 3, name='handle')
+
+    standardized = contact_normalization.standardize_phones_and_emails(series)
+
+    expected = pd.Series([contact_normalization.standardize_phone_or_email(value) for value in phones_or_emails],
+                         dtype=object, index=series.index, name='handle')
+    pd.testing.assert_series_equal(standardized.astype(object), expected)
+
+
+def test_standardize_phones_and_emails_keeps_missing_values():
+    series = pd.Series(['+1 (617) 555-1234', None, np.nan, '16175551234'], dtype=object)
+
+    standardized = contact_normalization.standardize_phones_and_emails(series)
+
+    assert standardized.tolist()[::3] == ['6175551234', '6175551234']
+    assert standardized.iloc[1:3].isna().all()
+
+
+@pytest.mark.parametrize('dtype', [object, 'str'])
+def test_create_full_names_matches_row_wise(random_state, dtype):
+    firsts, lasts, companies = [[NAME_PARTS[i] for i in random_state.randint(len(NAME_PARTS), size=3000)]
+                                for _ in range(3)]
+    index = pd.Index(np.arange(3000)[::-1])
+
+    full_names = contact_normalization.create_full_names(pd.Series(firsts, dtype=dtype, index=index),
+                                                         pd.Series(lasts, dtype=dtype, index=index),
+                                                         pd.Series(companies, dtype=dtype, index=index))
+
+    expected = [contact_normalization.create_full_name(first, last, company)
+                for first, last, company in zip(firsts, lasts, companies)]
+    assert full_names.index.equals(index)
+    assert full_names.tolist() == expected
+    assert contact_normalization.UNKNOWN_FULL_NAME in expected
+
+
+@pytest.mark.parametrize('dtype', [object, 'category'])
+def test_display_names(dtype):
+    full_names = pd.Series(['Mom', contact_normalization.UNKNOWN_FULL_NAME, 'Dad'], dtype=dtype)
+
+    display_names = contact_normalization.to_display_names(full_names)
+
+    assert display_names.tolist() == ['Mom', contact_normalization.UNKNOWN_DISPLAY_NAME, 'Dad']
+    assert isinstance(display_names.dtype, pd.CategoricalDtype) == (dtype == 'category')
+    assert ([contact_normalization.to_full_name(name) for name in display_names] ==
+            ['Mom', contact_normalization.UNKNOWN_FULL_NAME, 'Dad'])
+
+
+def test_display_names_without_unknown_contacts():
+    full_names = pd.Series(['Mom', 'Dad'], dtype='category')
+
+    pd.testing.assert_series_equal(contact_normalization.to_display_names(full_names), full_names)
@@ -0,0 +1,90 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataframe_memory
+import iphone_connector
+import synthetic_data
+
+NUMBER_OF_MESSAGES = 2000
+
+
+# The merged messages with the dtypes they had before compact_dtypes(), plain strings and int64 flags.
+@pytest.fixture(scope='module')
+def messages_df(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    synthetic_data.write_iphone_backup(backup_directory, NUMBER_OF_MESSAGES, number_of_contacts=50)
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        messages_df, _ = iphone_connector.get_fully_merged_messages_from_sql()
+    messages_df = messages_df.astype({'full_name': object, 'phone_or_email': object, 'text': object,
+                                      'is_from_me': 'int64', 'is_sent': 'int64'})
+    # Some rows are missing a participant.
+    messages_df.loc[messages_df.index[::50], 'phone_or_email'] = np.nan
+    return messages_df
+
+
+def _assert_same_values(compacted_df, messages_df):
+    assert compacted_df.columns.tolist() == messages_df.columns.tolist()
+    pd.testing.assert_index_equal(compacted_df.index, messages_df.index)
+    for column in messages_df.columns:
+        pd.testing.assert_series_equal(compacted_df[column].astype(object), messages_df[column].astype(object),
+                                       check_dtype=False)
+
+
+@pytest.mark.parametrize('text_as_arrow', [False, True])
+def test_compact_dtypes_keeps_values_and_saves_memory(messages_df, text_as_arrow):
+    compacted_df = messages_df.copy()
+
+    assert dataframe_memory.compact_dtypes(compacted_df, text_as_arrow=text_as_arrow) is compacted_df
+
+    _assert_same_values(compacted_df, messages_df)
+    for column in ['full_name', 'phone_or_email']:
+        assert isinstance(compacted_df[column].dtype, pd.CategoricalDtype)
+    for column in ['is_from_me', 'is_sent']:
+        assert compacted_df[column].dtype == 'int8'
+    if text_as_arrow:
+        assert compacted_df['text'].dtype == 'string[pyarrow]'
+    before = messages_df.memory_usage(deep=True)
+    after = compacted_df.memory_usage(deep=True)
+    for column in ['full_name', 'phone_or_email', 'is_from_me', 'is_sent']:
+        assert after[column] < before[column], column
+    assert after.sum() < before.sum()
+
+
+def test_compact_dtypes_filters_and_groups_as_before(messages_df):
+    compacted_df = dataframe_memory.compact_dtypes(messages_df.copy())
+
+    contact = messages_df['full_name'].value_counts().index[0]
+    _assert_same_values(compacted_df[compacted_df['full_name'] == contact],
+                        messages_df[messages_df['full_name'] == contact])
+    pd.testing.assert_series_equal(
+        compacted_df.groupby('full_name', observed=True)['is_from_me'].sum().rename(index=str).sort_index(),
+        messages_df.groupby('full_name')['is_from_me'].sum().sort_index(), check_dtype=False, check_index_type=False)
+
+
+def test_compact_dtypes_leaves_compact_and_missing_columns_alone(messages_df):
+    compacted_df = dataframe_memory.compact_dtypes(messages_df.copy())
+    dtypes = compacted_df.dtypes.copy()
+
+    dataframe_memory.compact_dtypes(compacted_df)
+
+    pd.testing.assert_series_equal(compacted_df.dtypes, dtypes)
+    text_only_df = dataframe_memory.compact_dtypes(messages_df[['text', 'date']].copy())
+    pd.testing.assert_frame_equal(text_only_df, messages_df[['text', 'date']])
+
+
+def test_memory_report(messages_df):
+    report = dataframe_memory.memory_report(messages_df)
+
+    assert report.index.tolist() == messages_df.columns.tolist() + ['Total']
+    assert report.loc['full_name', 'dtype_after'] == 'category'
+    assert report.loc['Total', 'bytes_before'] == messages_df.memory_usage(index=False, deep=True).sum()
+    compacted_df = dataframe_memory.compact_dtypes(messages_df.copy())
+    assert report.loc['Total', 'bytes_after'] == compacted_df.memory_usage(index=False, deep=True).sum()
+    assert report.loc['Total', 'bytes_saved'] > 0
+    # The passed dataframe isn't modified.
+    assert messages_df['full_name'].dtype == object
@@ -0,0 +1,85 @@
+import io
+import os
+import warnings
+
+from bs4 import BeautifulSoup
+from fbchat_archive_parser import parser
+import pandas as pd
+import pytest
+
+import facebook_connector
+import synthetic_data
+
+NUMBER_OF_MESSAGES = 2000
+BATCH_SIZE = 300
+COLUMNS = ['text', 'date', 'is_from_me', 'full_name']
+
+
+@pytest.fixture(scope='module')
+def messages_file(tmp_path_factory):
+    dump_directory = str(tmp_path_factory.mktemp('facebook'))
+    messages_file = synthetic_data.write_facebook_archive(dump_directory, NUMBER_OF_MESSAGES, number_of_contacts=50)
+    facebook_connector.initialize(dump_directory)
+    return messages_file
+
+
+def _parse_with_fbchat(messages_file, strip_html_content):
+    # The messages and addresses as fbchat_archive_parser reads them, one row per
+    # participant for the messages sent by the owner of the archive.
+    with io.open(messages_file, mode='rt', encoding='utf-8') as handle:
+        chats = parser.parse(handle=handle)
+    addresses = set()
+    messages = []
+    for thread in chats.threads.values():
+        participants = {participant for participant in thread.participants
+                        if participant is not None and not participant.isspace()}
+        addresses.update(participants)
+        for message in thread.messages:
+            if not message.content or message.content.isspace():
+                continue
+            from_me = message.sender == chats.user
+            content = message.content
+            if strip_html_content:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    content = BeautifulSoup(content, 'html.parser').text
+            for full_name in (participants if from_me else [message.sender]):
+                messages.append({'text': content, 'date': message.timestamp, 'is_from_me': from_me,
+                                 'full_name': full_name})
+    return pd.DataFrame.from_records(messages, columns=COLUMNS), addresses
+
+
+def _sorted_rows(messages_df):
+    # Threads aren't read in the same order by every path, so the rows are compared in a fixed order
+    messages_df = messages_df[COLUMNS].astype({'text': object, 'full_name': object, 'is_from_me': bool})
+    messages_df['date'] = pd.to_datetime(messages_df.date, utc=True).astype('datetime64[us, UTC]')
+    return messages_df.sort_values(COLUMNS, kind='mergesort').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('strip_html_content', [True, False])
+def test_streamed_equals_fbchat(messages_file, strip_html_content):
+    expected_df, expected_addresses = _parse_with_fbchat(messages_file, strip_html_content)
+    batches = list(facebook_connector.iter_cleaned_fully_merged_messages(
+        batch_size=BATCH_SIZE, strip_html_content=strip_html_content, processes=1))
+    assert len(batches) > 1
+    streamed_df = pd.concat(batches)
+    assert list(streamed_df.index) == list(range(streamed_df.shape[0]))
+    pd.testing.assert_frame_equal(_sorted_rows(streamed_df), _sorted_rows(expected_df))
+    assert set(streamed_df.full_name) <= expected_addresses
+
+
+@pytest.mark.parametrize('strip_html_content', [True, False])
+def test_merged_equals_fbchat(messages_file, strip_html_content):
+    expected_df, expected_addresses = _parse_with_fbchat(messages_file, strip_html_content)
+    messages_df, address_book_df = facebook_connector.get_cleaned_fully_merged_messages(
+        strip_html_content=strip_html_content, processes=1)
+    pd.testing.assert_frame_equal(_sorted_rows(messages_df), _sorted_rows(expected_df))
+    assert set(address_book_df.full_name) == expected_addresses
+
+
+def test_written_equals_fbchat(messages_file, tmp_path):
+    expected_df, _ = _parse_with_fbchat(messages_file, strip_html_content=True)
+    output_path = os.path.join(str(tmp_path), 'messages.csv')
+    facebook_connector.write_cleaned_fully_merged_messages(output_path, batch_size=BATCH_SIZE, processes=1)
+    written_df = pd.read_csv(output_path, index_col=0, keep_default_na=False, dtype={'text': object})
+    pd.testing.assert_frame_equal(_sorted_rows(written_df), _sorted_rows(expected_df))
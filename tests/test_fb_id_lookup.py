@@ -0,0 +1,93 @@
+import contextlib
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import facebook_connector
+
+# Status and body the stand-in for facebook.com answers each profile with.
+PROFILE_PAGES = {
+    '10': (200, '<html><head><title>Jane Doe | Facebook</title></head></html>'),
+    '11': (404, '<html><head><title>Page Not Found | Facebook</title></head></html>'),
+    '12': (404, ''),
+    '13': (200, '<html><head><title>Security Check Required</title></head></html>'),
+    '14': (500, '<html><head><title>Error</title></head></html>'),
+}
+
+
+class _ProfileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        fb_numeric_id = self.path.strip('/')
+        self.server.requested.append(fb_numeric_id)
+        status, body = PROFILE_PAGES[fb_numeric_id]
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_facebook(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ProfileHandler)
+    server.requested = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(facebook_connector, 'FB_PROFILE_URL', 'http://127.0.0.1:{0}/{{}}'.format(server.server_port))
+    monkeypatch.setattr(facebook_connector, 'FB_ID_MAX_RETRIES', 1)
+    monkeypatch.setattr(facebook_connector, 'FB_ID_BACKOFF_SECONDS', 0)
+    monkeypatch.setattr(facebook_connector, '_mapped_fb_ids', {})
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _resolve(fb_numeric_ids, cache_path):
+    return facebook_connector.resolve_user_ids(['{0}@facebook.com'.format(fb_numeric_id)
+                                                for fb_numeric_id in fb_numeric_ids],
+                                               requests_per_second=1000, cache_path=cache_path)
+
+
+def _read_cache(cache_path):
+    with contextlib.closing(sqlite3.connect(cache_path)) as cache:
+        return dict(cache.execute('SELECT fb_numeric_id, name FROM fb_id'))
+
+
+def test_resolves_names_and_unmapped_ids(fake_facebook, tmp_path):
+    resolved = _resolve(sorted(PROFILE_PAGES), str(tmp_path / 'fb_ids.sqlite'))
+
+    assert resolved == {
+        '10@facebook.com': 'Jane Doe',
+        '11@facebook.com': '11',
+        '12@facebook.com': '12',
+        '13@facebook.com': '13',
+        '14@facebook.com': '14',
+    }
+
+
+def test_caches_ids_facebook_could_not_map(fake_facebook, monkeypatch, tmp_path):
+    cache_path = str(tmp_path / 'fb_ids.sqlite')
+    _resolve(sorted(PROFILE_PAGES), cache_path)
+
+    # 404s are answers, not errors, so they're cached with a NULL name like other unmapped IDs.
+    assert _read_cache(cache_path) == {'10': 'Jane Doe', '11': None, '12': None, '13': None}
+    # The server error was retried once, then given up on for this run.
+    assert fake_facebook.requested.count('14') == 2
+
+    # A later run starts with an empty memory, so only the cache stops the requests.
+    monkeypatch.setattr(facebook_connector, '_mapped_fb_ids', {})
+    del fake_facebook.requested[:]
+    resolved = _resolve(sorted(PROFILE_PAGES), cache_path)
+
+    assert '11' not in fake_facebook.requested
+    assert sorted(set(fake_facebook.requested)) == ['14']
+    assert resolved['10@facebook.com'] == 'Jane Doe'
+    assert resolved['11@facebook.com'] == '11'
@@ -0,0 +1,122 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import contact_normalization
+import facebook_connector
+import group_messages
+import iphone_connector
+import synthetic_data
+
+NUMBER_OF_MESSAGES = 2000
+
+
+@pytest.fixture(scope='module')
+def iphone_messages(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    synthetic_data.write_iphone_backup(backup_directory, NUMBER_OF_MESSAGES, number_of_contacts=50)
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        fully_merged_messages_df, _ = iphone_connector.get_fully_merged_messages_from_sql()
+        compact_messages_df, chat_members_df = iphone_connector.get_compact_messages()
+    return fully_merged_messages_df, compact_messages_df, chat_members_df
+
+
+# Messages sharing a date may be in either order, so compare them in a fixed one.
+def _in_stable_order(messages_df, by):
+    return (messages_df.astype({column: object for column in by if column != 'date'})
+            .sort_values(by, kind='mergesort')
+            .reset_index(drop=True))
+
+
+# Folds expanded messages back into the compact form: one row per message, with no participant for those you sent.
+def _compact(expanded_df, columns, on):
+    compact_df = expanded_df.drop_duplicates('message_id')[columns].astype({on: object})
+    compact_df.loc[compact_df['is_from_me'].astype(bool), on] = np.nan
+    return compact_df.reset_index(drop=True)
+
+
+def test_iphone_round_trip(iphone_messages):
+    fully_merged_messages_df, compact_messages_df, chat_members_df = iphone_messages
+    # The synthetic backup has group chats, so the compact form is smaller.
+    assert compact_messages_df.shape[0] < fully_merged_messages_df.shape[0]
+    assert compact_messages_df['message_id'].is_unique
+
+    expanded_df = iphone_connector.expand_compact_messages(compact_messages_df, chat_members_df)
+
+    assert expanded_df.index.name == 'row_index'
+    assert expanded_df['date'].is_monotonic_increasing
+    assert expanded_df.dtypes.to_dict() == fully_merged_messages_df.dtypes.to_dict()
+    by = ['date', 'message_id', 'phone_or_email']
+    pd.testing.assert_frame_equal(_in_stable_order(expanded_df[fully_merged_messages_df.columns], by),
+                                  _in_stable_order(fully_merged_messages_df, by))
+
+    columns = list(compact_messages_df.columns)
+    pd.testing.assert_frame_equal(
+        _in_stable_order(_compact(expanded_df, columns, 'phone_or_email'), ['message_id']),
+        _in_stable_order(compact_messages_df, ['message_id']).astype({'phone_or_email': object}))
+
+
+def test_iphone_counts_match_expanded_messages(iphone_messages):
+    fully_merged_messages_df, compact_messages_df, chat_members_df = iphone_messages
+
+    counts = group_messages.count_messages_by_contact(compact_messages_df, chat_members_df)
+
+    by_direction = (fully_merged_messages_df.astype({'full_name': object})
+                    .groupby(['full_name', 'is_from_me']).size().unstack(fill_value=0))
+    expected = pd.DataFrame({'Texts exchanged': by_direction[0] + by_direction[1],
+                             'Texts received': by_direction[0], 'Texts sent': by_direction[1]})
+    assert counts['Texts exchanged'].is_monotonic_decreasing
+    pd.testing.assert_frame_equal(counts.sort_index(), expected.sort_index(), check_names=False,
+                                  check_index_type=False)
+
+
+def test_facebook_round_trip(tmp_path):
+    synthetic_data.write_facebook_archive(str(tmp_path), number_of_messages=500, number_of_contacts=20)
+    facebook_connector.initialize(str(tmp_path))
+    fully_merged_messages_df, _ = facebook_connector.get_cleaned_fully_merged_messages(processes=1)
+    compact_messages_df, chat_members_df = facebook_connector.get_compact_messages(processes=1)
+    assert compact_messages_df.shape[0] < fully_merged_messages_df.shape[0]
+
+    expanded_df = group_messages.expand_group_messages(compact_messages_df, chat_members_df, on='full_name',
+                                                       keep_unmatched=False)
+
+    by = ['date', 'full_name', 'text', 'is_from_me']
+    pd.testing.assert_frame_equal(_in_stable_order(expanded_df[fully_merged_messages_df.columns], by),
+                                  _in_stable_order(fully_merged_messages_df, by))
+
+
+def test_expand_small_chats():
+    messages_df = pd.DataFrame({
+        'message_id': [1, 2, 3, 4, 5],
+        'text': ['hi all', 'hey', 'hello you', 'who is this', 'anyone?'],
+        'is_from_me': [1, 0, 1, 0, 1],
+        'chat_id': [10, 10, 20, 20, 30],
+        'phone_or_email': [None, 'a@x.com', None, 'stranger@x.com', None],
+    })
+    chat_members_df = pd.DataFrame({
+        'chat_id': [10, 10, 20],
+        'phone_or_email': ['a@x.com', 'b@x.com', 'c@x.com'],
+        'full_name': pd.Categorical(['Ann', 'Bob', 'Cat']),
+    })
+    unknown = contact_normalization.UNKNOWN_FULL_NAME
+
+    expanded_df = group_messages.expand_group_messages(messages_df, chat_members_df)
+
+    assert expanded_df['message_id'].tolist() == [1, 1, 2, 3, 4, 5]
+    assert expanded_df['phone_or_email'].tolist()[:5] == ['a@x.com', 'b@x.com', 'a@x.com', 'c@x.com',
+                                                          'stranger@x.com']
+    assert pd.isnull(expanded_df['phone_or_email'].iloc[5])
+    assert expanded_df['full_name'].tolist() == ['Ann', 'Bob', 'Ann', 'Cat', unknown, unknown]
+    pd.testing.assert_frame_equal(_compact(expanded_df, list(messages_df.columns), 'phone_or_email'),
+                                  messages_df.astype({'phone_or_email': object}).fillna({'phone_or_email': np.nan}))
+
+    expanded_df = group_messages.expand_group_messages(messages_df, chat_members_df, keep_unmatched=False)
+    assert expanded_df['message_id'].tolist() == [1, 1, 2, 3, 4]
+
+    counts = group_messages.count_messages_by_contact(messages_df, chat_members_df)
+    assert counts.loc[['Ann', 'Bob', 'Cat', unknown]].values.tolist() == [[2, 1, 1], [1, 0, 1], [1, 0, 1],
+                                                                           [2, 1, 1]]
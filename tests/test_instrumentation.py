@@ -0,0 +1,177 @@
+import contextlib
+import io
+import os
+import pstats
+import sqlite3
+import subprocess
+import sys
+import tracemalloc
+
+import pytest
+
+import facebook_connector
+import instrumentation
+import iphone_connector
+import synthetic_data
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NUMBER_OF_MESSAGES = 2000
+# The stages of iphone_connector.get_cleaned_fully_merged_messages() and the stage each ran in.
+CLEANED_FULLY_MERGED_STAGES = [
+    ('load_messages', 0),
+    ('read_sql', 1),
+    ('convert_dates', 1),
+    ('dedup', 1),
+    ('load_address_book', 0),
+    ('read_sql', 1),
+    ('normalize_phones_and_emails', 1),
+    ('convert_dates', 1),
+    ('sort', 1),
+    ('merge', 0),
+    ('join_chats', 1),
+    ('read_sql', 2),
+    ('normalize_phones_and_emails', 2),
+    ('merge_address_book', 1),
+    ('dedup', 1),
+    ('merge_messages', 1),
+    ('collapse_names', 0),
+    ('sort', 0),
+    ('compact_dtypes', 0),
+]
+
+
+@pytest.fixture(scope='module')
+def backup(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    message_path, _ = synthetic_data.write_iphone_backup(backup_directory, NUMBER_OF_MESSAGES, number_of_contacts=50)
+    return backup_directory, message_path
+
+
+def _records_by_stage(loader_profile, depth=0):
+    return {record.stage: record for record in loader_profile.records if record.depth == depth}
+
+
+def test_stages_of_loading_messages(backup):
+    backup_directory, message_path = backup
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        with instrumentation.profile() as loader_profile:
+            messages_df, address_book_df = iphone_connector.get_cleaned_fully_merged_messages()
+
+    assert [(record.stage, record.depth) for record in loader_profile.records] == CLEANED_FULLY_MERGED_STAGES
+    with contextlib.closing(sqlite3.connect(message_path)) as message_con:
+        number_of_rows, number_of_texts = message_con.execute('SELECT COUNT(*), COUNT(text) FROM message').fetchone()
+    load_messages_records = loader_profile.records[:4]
+    assert [record.rows for record in load_messages_records] == [number_of_texts, number_of_rows, None,
+                                                                 number_of_texts]
+    stages = _records_by_stage(loader_profile)
+    assert stages['load_address_book'].rows == address_book_df.shape[0]
+    assert stages['merge'].rows == messages_df.shape[0]
+    assert _records_by_stage(loader_profile, depth=1)['merge_messages'].rows == messages_df.shape[0]
+    assert stages['sort'].rows is None
+    for record in loader_profile.records:
+        assert record.seconds >= 0
+        assert record.peak_mb is not None
+    # A stage's time includes the stages run within it.
+    assert stages['load_messages'].seconds >= sum(record.seconds for record in load_messages_records[1:])
+
+    loader_profile_df = loader_profile.to_dataframe()
+    assert loader_profile_df.columns.tolist() == list(instrumentation.StageRecord._fields)
+    assert loader_profile_df['stage'].tolist() == [stage for stage, _ in CLEANED_FULLY_MERGED_STAGES]
+    report = loader_profile.report().splitlines()
+    assert len(report) == len(CLEANED_FULLY_MERGED_STAGES) + 1
+    assert report[1].startswith('load_messages') and '{0:,}'.format(number_of_texts) in report[1]
+    assert report[2].startswith('  read_sql')
+    assert report[13].startswith('    normalize_phones_and_emails')
+
+
+def test_stages_of_loading_messages_with_sql(backup):
+    backup_directory, _ = backup
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        with instrumentation.profile(measure_memory=False) as loader_profile:
+            messages_df, _ = iphone_connector.get_fully_merged_messages_from_sql()
+
+    stages = _records_by_stage(loader_profile)
+    assert list(stages) == ['load_address_book', 'create_key_tables', 'load_merged_messages', 'sort',
+                            'compact_dtypes']
+    assert stages['load_merged_messages'].rows == messages_df.shape[0]
+    assert all(record.peak_mb is None for record in loader_profile.records)
+
+
+def test_stages_of_loading_facebook_messages(tmp_path):
+    synthetic_data.write_facebook_archive(str(tmp_path), number_of_messages=500, number_of_contacts=20)
+    facebook_connector.initialize(str(tmp_path))
+    with instrumentation.profile() as loader_profile:
+        messages_df, _ = facebook_connector.get_cleaned_fully_merged_messages(processes=1)
+
+    stages = _records_by_stage(loader_profile)
+    assert list(stages) == ['read_threads', 'build_dataframe']
+    assert stages['read_threads'].rows == stages['build_dataframe'].rows == messages_df.shape[0]
+    assert [record.stage for record in loader_profile.records if record.depth == 1] == ['parse']
+
+
+def test_stages_outside_a_profile_are_ignored():
+    with instrumentation.stage('ignored') as current_stage:
+        current_stage.rows = 10
+    assert current_stage is instrumentation.stage('also_ignored')
+    assert not hasattr(current_stage, 'rows')
+
+
+def test_profile_records_stages_that_raise():
+    with pytest.raises(ValueError):
+        with instrumentation.profile() as loader_profile:
+            with instrumentation.stage('outer'):
+                with instrumentation.stage('inner') as current_stage:
+                    current_stage.rows = 3
+                    raise ValueError('failed to load')
+
+    assert [(record.stage, record.depth, record.rows) for record in loader_profile.records] == [
+        ('outer', 0, None), ('inner', 1, 3)]
+    assert not tracemalloc.is_tracing()
+    # The profile is no longer active, so another can start.
+    with instrumentation.profile(measure_memory=False):
+        with pytest.raises(AssertionError):
+            with instrumentation.profile():
+                pass
+
+
+def test_peak_memory_of_nested_stages():
+    with instrumentation.profile() as loader_profile:
+        with instrumentation.stage('outer'):
+            with instrumentation.stage('inner'):
+                allocated = bytearray(8 * 2 ** 20)
+            del allocated
+
+    outer, inner = loader_profile.records
+    assert inner.peak_mb >= 8
+    # The memory allocated within inner counts towards outer's peak too.
+    assert outer.peak_mb >= inner.peak_mb
+
+
+def _run_connector(*args):
+    return subprocess.check_output([sys.executable, 'iphone_connector.py'] + list(args), cwd=REPOSITORY_DIRECTORY,
+                                   universal_newlines=True)
+
+
+def test_profile_flag(backup, tmp_path):
+    backup_directory, _ = backup
+    output = _run_connector('--backup', backup_directory, '--sql', '--profile', str(tmp_path))
+
+    report = output.split('PROFILE OF LOADING THE MESSAGES:')[1]
+    for stage in ['load_address_book', 'create_key_tables', 'load_merged_messages', 'sort', 'compact_dtypes']:
+        assert '\n' + stage in report
+    assert ' MB' in report
+    assert 'cProfile' not in output
+
+
+def test_cprofile_flag(backup, tmp_path):
+    backup_directory, _ = backup
+    cprofile_path = str(tmp_path / 'loader.prof')
+    output = _run_connector('--backup', backup_directory, '--cprofile', cprofile_path, str(tmp_path))
+
+    assert 'Wrote cProfile stats to {0}'.format(cprofile_path) in output
+    assert 'PROFILE OF LOADING THE MESSAGES' not in output
+    stats = pstats.Stats(cprofile_path)
+    profiled_functions = {function for _, _, function in stats.stats}
+    assert 'get_cleaned_fully_merged_messages' in profiled_functions
@@ -0,0 +1,133 @@
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import iphone_connector
+import message_cube
+import message_search
+import synthetic_data
+
+NUMBER_OF_MESSAGES = 2000
+# The number of messages in the backup when the cache is first built.
+NUMBER_OF_CACHED_MESSAGES = 1500
+
+
+@pytest.fixture
+def backup(tmp_path):
+    backup_directory = str(tmp_path / 'backup')
+    message_path, address_path = synthetic_data.write_iphone_backup(backup_directory, NUMBER_OF_MESSAGES,
+                                                                    number_of_contacts=50)
+    full_message_path = str(tmp_path / 'full_message_db')
+    shutil.copyfile(message_path, full_message_path)
+    # Start from an older backup, before the last messages were received.
+    with contextlib.closing(sqlite3.connect(message_path)) as message_con:
+        with message_con:
+            message_con.execute('DELETE FROM message WHERE ROWID > ?', (NUMBER_OF_CACHED_MESSAGES,))
+            message_con.execute('DELETE FROM chat_message_join WHERE message_id > ?', (NUMBER_OF_CACHED_MESSAGES,))
+    return backup_directory, message_path, address_path, full_message_path
+
+
+def _load(backup_directory, cache_dir, force_rebuild=False):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        iphone_connector.initialize(backup_directory)
+        messages_df, address_book_df = iphone_connector.get_cached_fully_merged_messages(
+            str(cache_dir), force_rebuild=force_rebuild)
+    return messages_df, address_book_df, output.getvalue()
+
+
+# Bumps the modification time of a file, as syncing the backup again would.
+def _touch(path):
+    modified_time = os.path.getmtime(path) + 10
+    os.utime(path, (modified_time, modified_time))
+
+
+# Messages sharing a date may be in either order, so compare them in a fixed one.
+def _in_stable_order(messages_df):
+    return (messages_df.astype({'full_name': object, 'phone_or_email': object})
+            .sort_values(['date', 'message_id', 'phone_or_email'], kind='mergesort')
+            .reset_index(drop=True))
+
+
+def _sorted_cube(cube):
+    return cube.reset_index().astype({'full_name': object}).sort_values(message_cube.CUBE_INDEX).reset_index(
+        drop=True)
+
+
+def test_appends_new_messages_like_a_full_rebuild(backup, tmp_path):
+    backup_directory, message_path, _, full_message_path = backup
+    cached_messages_df, _, output = _load(backup_directory, tmp_path / 'cache')
+    assert 'Building message cache' in output
+    assert cached_messages_df['message_id'].max() == NUMBER_OF_CACHED_MESSAGES
+
+    shutil.copyfile(full_message_path, message_path)
+    _touch(message_path)
+    messages_df, address_book_df, output = _load(backup_directory, tmp_path / 'cache')
+    assert 'Loading messages added since the cache was built' in output
+    cube = iphone_connector.get_cached_message_cube(str(tmp_path / 'cache'))
+    search_index_path = iphone_connector.get_search_index_path(str(tmp_path / 'cache'))
+
+    rebuilt_messages_df, rebuilt_address_book_df, _ = _load(backup_directory, tmp_path / 'rebuilt_cache',
+                                                            force_rebuild=True)
+    assert messages_df['message_id'].max() == NUMBER_OF_MESSAGES
+    assert messages_df.index.name == 'row_index'
+    assert messages_df['date'].is_monotonic_increasing
+    pd.testing.assert_frame_equal(_in_stable_order(messages_df), _in_stable_order(rebuilt_messages_df))
+    pd.testing.assert_frame_equal(address_book_df, rebuilt_address_book_df)
+    pd.testing.assert_frame_equal(_sorted_cube(cube), _sorted_cube(message_cube.build_cube(rebuilt_messages_df)))
+    # The search index holds the text of every message, old and new.
+    indexed_texts = message_search.get_texts(search_index_path, rebuilt_messages_df['message_id'].unique())
+    expected_texts = rebuilt_messages_df.dropna(subset=['text']).drop_duplicates('message_id').set_index(
+        'message_id')['text'].sort_index()
+    assert indexed_texts.tolist() == expected_texts.astype(object).tolist()
+
+    # Loading again reads the cache as is.
+    reloaded_messages_df, _, output = _load(backup_directory, tmp_path / 'cache')
+    assert 'Loaded {0:,} messages from cache'.format(messages_df.shape[0]) in output
+    pd.testing.assert_frame_equal(reloaded_messages_df, messages_df)
+
+
+def test_message_db_mtime_change_without_new_messages_reads_the_cache(backup, tmp_path):
+    backup_directory, message_path, _, _ = backup
+    cached_messages_df, _, _ = _load(backup_directory, tmp_path / 'cache')
+
+    _touch(message_path)
+    messages_df, _, output = _load(backup_directory, tmp_path / 'cache')
+
+    assert 'Loaded {0:,} messages from cache'.format(cached_messages_df.shape[0]) in output
+    pd.testing.assert_frame_equal(messages_df, cached_messages_df)
+
+
+def test_address_book_mtime_change_rebuilds(backup, tmp_path):
+    backup_directory, _, address_path, _ = backup
+    _load(backup_directory, tmp_path / 'cache')
+
+    _touch(address_path)
+    _, _, output = _load(backup_directory, tmp_path / 'cache')
+
+    assert 'Building message cache' in output
+
+
+def test_schema_change_rebuilds(backup, tmp_path):
+    backup_directory, message_path, _, _ = backup
+    _load(backup_directory, tmp_path / 'cache')
+
+    with contextlib.closing(sqlite3.connect(message_path)) as message_con:
+        message_con.execute('ALTER TABLE message ADD COLUMN new_ios_column INTEGER')
+    _, _, output = _load(backup_directory, tmp_path / 'cache')
+
+    assert 'Building message cache' in output
+
+
+def test_force_rebuild(backup, tmp_path):
+    backup_directory, _, _, _ = backup
+    _load(backup_directory, tmp_path / 'cache')
+
+    _, _, output = _load(backup_directory, tmp_path / 'cache', force_rebuild=True)
+
+    assert 'Building message cache' in output
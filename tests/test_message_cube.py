@@ -0,0 +1,96 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import iphone_connector
+import message_cube
+import synthetic_data
+
+NUMBER_OF_MESSAGES = 2000
+
+
+@pytest.fixture(scope='module')
+def messages_df(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    synthetic_data.write_iphone_backup(backup_directory, NUMBER_OF_MESSAGES, number_of_contacts=50)
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        messages_df, _ = iphone_connector.get_cleaned_fully_merged_messages()
+    return messages_df
+
+
+# The cube as the notebook would count it, grouping the merged messages themselves.
+def _grouped_counts(messages_df):
+    messages_df = messages_df.dropna(subset=['date', 'full_name'])
+    texts = messages_df['text'].astype(object)
+    counts = pd.DataFrame({
+        'full_name': messages_df['full_name'].astype(object),
+        'is_from_me': messages_df['is_from_me'] == 1,
+        'day': messages_df['date'].dt.normalize(),
+        'messages': 1,
+        'words': [len(text.split()) if isinstance(text, str) else 0 for text in texts],
+        'characters': [len(text) if isinstance(text, str) else 0 for text in texts],
+    })
+    return counts.groupby(message_cube.CUBE_INDEX)[message_cube.CUBE_COLUMNS].sum()
+
+
+def _sorted_cube(cube):
+    cube = cube.reset_index().astype({'full_name': object})
+    return cube.sort_values(message_cube.CUBE_INDEX).reset_index(drop=True)
+
+
+def test_cube_matches_groupby(messages_df):
+    cube = message_cube.build_cube(messages_df)
+
+    assert cube.index.names == message_cube.CUBE_INDEX
+    assert cube['messages'].sum() == messages_df.dropna(subset=['date', 'full_name']).shape[0]
+    pd.testing.assert_frame_equal(_sorted_cube(cube), _sorted_cube(_grouped_counts(messages_df)))
+
+
+def test_merged_cubes_match_the_whole_cube(messages_df, tmp_path):
+    is_old = messages_df['message_id'] <= NUMBER_OF_MESSAGES // 2
+    merged = message_cube.merge_cubes(message_cube.build_cube(messages_df[is_old]),
+                                      message_cube.build_cube(messages_df[~is_old]))
+    pd.testing.assert_frame_equal(_sorted_cube(merged), _sorted_cube(message_cube.build_cube(messages_df)))
+
+    path = str(tmp_path / message_cube.CUBE_FILENAME)
+    message_cube.write_cube(merged, path)
+    pd.testing.assert_frame_equal(_sorted_cube(message_cube.read_cube(path)), _sorted_cube(merged))
+
+
+def test_top_contacts_matches_groupby(messages_df):
+    cube = message_cube.build_cube(messages_df)
+    dated_messages_df = messages_df.dropna(subset=['date'])
+    by_direction = dated_messages_df.groupby(['full_name', 'is_from_me'], observed=True).size().unstack(fill_value=0)
+    expected = pd.DataFrame({'Texts exchanged': by_direction[0] + by_direction[1],
+                             'Texts received': by_direction[0],
+                             'Texts sent': by_direction[1]})
+    expected.index = expected.index.astype(object)
+
+    top_contacts = message_cube.top_contacts(cube)
+
+    assert top_contacts['Texts exchanged'].is_monotonic_decreasing
+    pd.testing.assert_frame_equal(top_contacts.sort_index(), expected.sort_index(), check_names=False)
+    top_five = message_cube.top_contacts(cube, n=5)
+    pd.testing.assert_frame_equal(top_five, top_contacts.head(5))
+    assert set(top_five.index) <= set(expected['Texts exchanged'].nlargest(5, keep='all').index)
+
+
+def test_rollup_and_dense_series_match_groupby(messages_df):
+    cube = message_cube.build_cube(messages_df)
+    dated_messages_df = messages_df.dropna(subset=['date', 'full_name'])
+    months = dated_messages_df['date'].dt.to_period('M').rename('period')
+    expected = dated_messages_df.groupby([dated_messages_df['full_name'].astype(object), months]).size()
+
+    by_month = message_cube.rollup(cube, freq='M', by=('full_name',))['messages']
+    assert by_month.to_dict() == expected.to_dict()
+
+    contacts = message_cube.top_contacts(cube, n=3).index.tolist()
+    dense = message_cube.dense_series(cube, contacts=contacts)
+    assert dense.columns.tolist() == contacts
+    assert (dense.index == pd.period_range(dense.index.min(), dense.index.max(), freq='M')).all()
+    for contact in contacts:
+        assert dense[contact].sum() == (dated_messages_df['full_name'] == contact).sum()
+        pd.testing.assert_series_equal(dense[contact][dense[contact] > 0], expected[contact], check_names=False)
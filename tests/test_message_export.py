@@ -0,0 +1,72 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import iphone_connector
+import message_export
+import synthetic_data
+
+# Small enough that batches differ in the number of contacts they hold, so their categoricals have different codes.
+CHUNK_SIZE = 180
+
+
+@pytest.fixture(scope='module')
+def backup_directory(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    synthetic_data.write_iphone_backup(backup_directory, number_of_messages=3000, number_of_contacts=400)
+    return backup_directory
+
+
+@pytest.fixture(scope='module')
+def merged_messages(backup_directory):
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        return iphone_connector.get_fully_merged_messages_from_sql()
+
+
+@pytest.mark.parametrize('export_format', message_export.EXPORT_FORMATS)
+def test_round_trip(merged_messages, tmp_path, export_format):
+    messages_df, addresses_df = merged_messages
+
+    message_export.write_messages(messages_df, str(tmp_path), export_format)
+    message_export.write_addresses(addresses_df, str(tmp_path), export_format)
+
+    read_messages_df = message_export.read_messages(str(tmp_path)).sort_index()
+    pd.testing.assert_frame_equal(read_messages_df, messages_df, check_categorical=False)
+    pd.testing.assert_frame_equal(message_export.read_addresses(str(tmp_path)), addresses_df)
+
+
+@pytest.mark.parametrize('export_format', message_export.EXPORT_FORMATS)
+def test_read_messages_of_some_years_and_columns(merged_messages, tmp_path, export_format):
+    messages_df, _ = merged_messages
+    message_export.write_messages(messages_df, str(tmp_path), export_format)
+    year = messages_df['date'].dt.year.mode()[0]
+
+    read_messages_df = message_export.read_messages(str(tmp_path), columns=['text'], years=[year]).sort_index()
+
+    assert list(read_messages_df.columns) == ['text']
+    pd.testing.assert_series_equal(read_messages_df['text'], messages_df.loc[messages_df['date'].dt.year == year,
+                                                                             'text'])
+
+
+@pytest.mark.parametrize('export_format', message_export.EXPORT_FORMATS)
+def test_streamed_batches_are_compact_and_read_back(backup_directory, tmp_path, export_format):
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        batches = list(iphone_connector.iter_fully_merged_messages(CHUNK_SIZE))
+    for i, messages_df in enumerate(batches):
+        assert isinstance(messages_df['full_name'].dtype, pd.CategoricalDtype)
+        assert messages_df['is_from_me'].dtype == 'int8'
+        message_export.write_messages(messages_df, str(tmp_path), export_format, part=i)
+    assert len(set(messages_df['full_name'].cat.codes.dtype for messages_df in batches)) > 1
+
+    read_messages_df = message_export.read_messages(str(tmp_path)).sort_index()
+
+    streamed_messages_df = pd.concat([messages_df.astype({'full_name': object, 'phone_or_email': object})
+                                      for messages_df in batches])
+    assert isinstance(read_messages_df['full_name'].dtype, pd.CategoricalDtype)
+    assert read_messages_df['is_from_me'].dtype == 'int8'
+    pd.testing.assert_frame_equal(read_messages_df.astype({'full_name': object, 'phone_or_email': object}),
+                                  streamed_messages_df)
@@ -0,0 +1,119 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import contact_normalization
+import iphone_connector
+import message_search
+import synthetic_data
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    messages_df = pd.DataFrame({
+        'message_id': [1, 2, 3],
+        'text': ['see you tonight', 'who is this tonight?', 'tonight works'],
+        'full_name': ['Mom', contact_normalization.UNKNOWN_FULL_NAME, 'Dad'],
+        'date': pd.to_datetime(['2015-01-01', '2015-01-02', '2015-01-03']),
+    })
+    index_path = str(tmp_path / message_search.SEARCH_INDEX_FILENAME)
+    message_search.update_search_index(index_path, messages_df)
+    return index_path
+
+
+def test_search_unknown_contacts_by_their_displayed_name(index_path):
+    for contacts in [contact_normalization.UNKNOWN_DISPLAY_NAME, contact_normalization.UNKNOWN_FULL_NAME,
+                     [contact_normalization.UNKNOWN_DISPLAY_NAME]]:
+        np.testing.assert_array_equal(message_search.search_messages(index_path, 'tonight', contacts=contacts), [2])
+    contacts = ['Mom', contact_normalization.UNKNOWN_DISPLAY_NAME]
+    np.testing.assert_array_equal(message_search.search_messages(index_path, 'tonight', contacts=contacts), [1, 2])
+
+
+NUMBER_OF_MESSAGES = 2000
+# Messages indexed before the rest are added by an incremental update.
+NUMBER_OF_FIRST_INDEXED_MESSAGES = 1200
+# Texts with characters that mean something to LIKE or FTS5 queries, or whose case folding isn't ASCII.
+SPECIAL_TEXTS = ['100% sure_thing', 'she said "hi" twice', 'École at noon', 'back\\slash', None]
+TERMS = ['pizza', 'PiZzA', 'love you', 'i', 'lo', 'ba', "it's", '100%', '%', '_', 'e_t', 'et', '"hi"', 'hi"', 'école',
+         'ÉCOLE', '\\', 'back\\s', 'xyzzy', 'no match at all']
+
+
+@pytest.fixture(scope='module')
+def messages_df(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    synthetic_data.write_iphone_backup(backup_directory, NUMBER_OF_MESSAGES, number_of_contacts=50)
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        messages_df, _ = iphone_connector.get_cleaned_fully_merged_messages()
+    last_message = messages_df.iloc[[-1] * len(SPECIAL_TEXTS)].copy()
+    last_message['message_id'] = messages_df['message_id'].max() + 1 + np.arange(len(SPECIAL_TEXTS))
+    last_message['text'] = SPECIAL_TEXTS
+    return pd.concat([messages_df, last_message], ignore_index=True)
+
+
+def _containing(messages_df, term):
+    matches = messages_df['text'].str.contains(term, case=False, regex=False, na=False)
+    return np.unique(messages_df.loc[matches, 'message_id'].to_numpy())
+
+
+@pytest.mark.parametrize('term', TERMS)
+def test_search_matches_str_contains(messages_df, tmp_path, term):
+    index_path = str(tmp_path / message_search.SEARCH_INDEX_FILENAME)
+    assert message_search.update_search_index(index_path, messages_df) == messages_df['message_id'].nunique() - 1
+
+    np.testing.assert_array_equal(message_search.search_messages(index_path, term), _containing(messages_df, term))
+
+
+def test_search_filters_match_the_frame(messages_df, tmp_path):
+    index_path = str(tmp_path / message_search.SEARCH_INDEX_FILENAME)
+    message_search.update_search_index(index_path, messages_df)
+    contacts = messages_df['full_name'].value_counts().index[:2].tolist()
+    since, until = messages_df['date'].quantile([.25, .75]).tolist()
+
+    for term in ['you', 'a']:
+        np.testing.assert_array_equal(message_search.search_messages(index_path, term, contacts=contacts),
+                                      _containing(messages_df[messages_df['full_name'].isin(contacts)], term))
+        np.testing.assert_array_equal(message_search.search_messages(index_path, term, contacts=contacts[0]),
+                                      _containing(messages_df[messages_df['full_name'] == contacts[0]], term))
+        in_dates = (messages_df['date'] >= since) & (messages_df['date'] < until)
+        np.testing.assert_array_equal(message_search.search_messages(index_path, term, since=since, until=until),
+                                      _containing(messages_df[in_dates], term))
+
+
+def test_incremental_update_matches_str_contains(messages_df, tmp_path):
+    index_path = str(tmp_path / message_search.SEARCH_INDEX_FILENAME)
+    first_messages_df = messages_df[messages_df['message_id'] <= NUMBER_OF_FIRST_INDEXED_MESSAGES]
+    message_search.update_search_index(index_path, first_messages_df)
+    np.testing.assert_array_equal(message_search.search_messages(index_path, 'you'),
+                                  _containing(first_messages_df, 'you'))
+
+    added = message_search.update_search_index(index_path, messages_df)
+    new_messages_df = messages_df[messages_df['message_id'] > NUMBER_OF_FIRST_INDEXED_MESSAGES]
+    assert added == new_messages_df.dropna(subset=['text'])['message_id'].nunique()
+    # Updating again with the same messages adds nothing.
+    assert message_search.update_search_index(index_path, messages_df) == 0
+
+    rebuilt_index_path = str(tmp_path / 'rebuilt_search_index.sqlite')
+    message_search.update_search_index(rebuilt_index_path, messages_df)
+    for term in TERMS:
+        expected_message_ids = _containing(messages_df, term)
+        np.testing.assert_array_equal(message_search.search_messages(index_path, term), expected_message_ids)
+        np.testing.assert_array_equal(message_search.search_messages(rebuilt_index_path, term), expected_message_ids)
+    message_ids = messages_df['message_id'].unique()
+    pd.testing.assert_series_equal(message_search.get_texts(index_path, message_ids),
+                                   message_search.get_texts(rebuilt_index_path, message_ids))
+
+
+def test_rebuild_drops_the_old_messages(messages_df, tmp_path):
+    index_path = str(tmp_path / message_search.SEARCH_INDEX_FILENAME)
+    message_search.update_search_index(index_path, messages_df)
+    first_messages_df = messages_df[messages_df['message_id'] <= NUMBER_OF_FIRST_INDEXED_MESSAGES]
+
+    message_search.update_search_index(index_path, first_messages_df, rebuild=True)
+
+    for term in ['you', 'pizza', '100%']:
+        np.testing.assert_array_equal(message_search.search_messages(index_path, term),
+                                      _containing(first_messages_df, term))
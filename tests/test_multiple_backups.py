@@ -0,0 +1,97 @@
+import contextlib
+import io
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import iphone_connector
+import synthetic_data
+
+NUMBER_OF_MESSAGES = 3000
+NUMBER_OF_CONTACTS = 60
+
+
+@pytest.fixture(scope='module')
+def full_backup(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('full_backup'))
+    message_path, _ = synthetic_data.write_iphone_backup(backup_directory, NUMBER_OF_MESSAGES, NUMBER_OF_CONTACTS)
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        fully_merged_messages_df, address_book_df = iphone_connector.get_cleaned_fully_merged_messages()
+    with contextlib.closing(sqlite3.connect(message_path)) as message_con:
+        guids = pd.read_sql_query('SELECT ROWID AS message_id, guid FROM message', message_con,
+                                  index_col='message_id')
+    fully_merged_messages_df['guid'] = fully_merged_messages_df['message_id'].map(guids['guid'])
+    return fully_merged_messages_df, address_book_df
+
+
+@pytest.fixture(scope='module')
+def backup_directories(tmp_path_factory):
+    return synthetic_data.write_iphone_backups(str(tmp_path_factory.mktemp('backups')), number_of_backups=3,
+                                               number_of_messages=NUMBER_OF_MESSAGES,
+                                               number_of_contacts=NUMBER_OF_CONTACTS, overlap=.5)
+
+
+@pytest.fixture(scope='module')
+def merged_backups(backup_directories):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return iphone_connector.get_cleaned_fully_merged_messages_from_backups(backup_directories, processes=2)
+
+
+# Compares messages by guid and participant rather than by the ids, which are renumbered when merging.
+def _by_guid(messages_df):
+    return (messages_df.drop(['message_id', 'chat_id'], axis=1)
+            .sort_values(['guid', 'phone_or_email'], kind='mergesort')
+            .reset_index(drop=True))
+
+
+def test_backups_overlap(backup_directories):
+    message_counts = []
+    for backup_directory in backup_directories:
+        with contextlib.redirect_stdout(io.StringIO()):
+            iphone_connector.initialize(backup_directory)
+        message_counts.append(iphone_connector._message_con.execute('SELECT COUNT(*) FROM message').fetchone()[0])
+
+    assert sum(message_counts) > NUMBER_OF_MESSAGES
+
+
+def test_merged_backups_match_full_backup(full_backup, merged_backups):
+    full_messages_df, _ = full_backup
+    merged_messages_df, _ = merged_backups
+
+    assert merged_messages_df.index.name == 'row_index'
+    assert not merged_messages_df.duplicated(['guid', 'phone_or_email']).any()
+    pd.testing.assert_frame_equal(_by_guid(merged_messages_df), _by_guid(full_messages_df[merged_messages_df.columns]),
+                                  check_categorical=False, check_dtype=False)
+
+
+def test_merged_backups_renumber_ids(full_backup, merged_backups):
+    full_messages_df, _ = full_backup
+    merged_messages_df, _ = merged_backups
+
+    # A message_id per guid, numbered in order of date.
+    assert merged_messages_df['date'].is_monotonic_increasing
+    assert merged_messages_df['message_id'].is_monotonic_increasing
+    assert merged_messages_df.groupby('guid', observed=True)['message_id'].nunique().eq(1).all()
+    assert merged_messages_df['message_id'].drop_duplicates().tolist() == list(
+        range(1, merged_messages_df['guid'].nunique() + 1))
+
+    # A chat_id per chat, grouping the same messages as the chats of the full backup.
+    chat_ids = pd.merge(full_messages_df[['guid', 'phone_or_email', 'chat_id']],
+                        merged_messages_df[['guid', 'phone_or_email', 'chat_id']],
+                        on=['guid', 'phone_or_email'], suffixes=('_full', '_merged'))
+    assert chat_ids.shape[0] == full_messages_df.shape[0]
+    assert chat_ids.groupby('chat_id_full')['chat_id_merged'].nunique().eq(1).all()
+    assert chat_ids.groupby('chat_id_merged')['chat_id_full'].nunique().eq(1).all()
+    assert sorted(merged_messages_df['chat_id'].dropna().unique()) == list(
+        range(1, full_messages_df['chat_id'].nunique() + 1))
+
+
+def test_merged_backups_keep_every_contact(full_backup, merged_backups):
+    _, full_address_book_df = full_backup
+    _, merged_address_book_df = merged_backups
+
+    assert not merged_address_book_df.reset_index().duplicated(['phone_or_email', 'full_name']).any()
+    assert (set(merged_address_book_df.reset_index()['phone_or_email']) ==
+            set(full_address_book_df.reset_index()['phone_or_email']))
@@ -0,0 +1,113 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import contact_normalization
+import iphone_connector
+import synthetic_data
+
+
+@pytest.fixture(scope='module')
+def merged_messages(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    synthetic_data.write_iphone_backup(backup_directory, number_of_messages=2000, number_of_contacts=50)
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        messages_df, _ = iphone_connector.get_fully_merged_messages_from_sql()
+    return messages_df
+
+
+# Returns the names of the contacts in the address book, those with the most messages first.
+def _known_contacts(messages_df):
+    return messages_df['full_name'].value_counts().drop(contact_normalization.UNKNOWN_FULL_NAME).index
+
+
+# Messages sharing a date may be in either order, so compare them in a fixed one.
+def _in_stable_order(messages_df):
+    return (messages_df.astype({'full_name': object, 'phone_or_email': object})
+            .sort_values(['date', 'message_id', 'phone_or_email'], kind='mergesort')
+            .reset_index(drop=True))
+
+
+# The values of a column in sorted order, to compare columns whose rows may be in different orders.
+def _sorted_values(column):
+    return column.astype(object).sort_values(kind='mergesort', na_position='last').reset_index(drop=True)
+
+
+def _query_messages(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return iphone_connector.query_messages(**kwargs)
+
+
+def test_query_one_contact(merged_messages):
+    contact = _known_contacts(merged_messages)[0]
+
+    pd.testing.assert_frame_equal(_in_stable_order(_query_messages(contacts=contact)),
+                                  _in_stable_order(merged_messages[merged_messages['full_name'] == contact]))
+
+
+def test_query_unknown_contacts(merged_messages):
+    is_unknown = merged_messages['full_name'] == contact_normalization.UNKNOWN_FULL_NAME
+    assert is_unknown.any()
+
+    pd.testing.assert_frame_equal(
+        _in_stable_order(_query_messages(contacts=contact_normalization.UNKNOWN_FULL_NAME)),
+        _in_stable_order(merged_messages[is_unknown]))
+
+
+def test_query_known_and_unknown_contacts(merged_messages):
+    contacts = [_known_contacts(merged_messages)[1], contact_normalization.UNKNOWN_FULL_NAME]
+
+    queried = _query_messages(contacts=contacts, from_me=False)
+
+    expected = merged_messages[merged_messages['full_name'].isin(contacts) & (merged_messages['is_from_me'] == 0)]
+    pd.testing.assert_frame_equal(_in_stable_order(queried), _in_stable_order(expected))
+
+
+@pytest.mark.parametrize('since, until', [('2014-06-01', None), (None, '2014-06-01'), ('2013-03-15', '2015-09-01'),
+                                          (pd.Timestamp('2014-06-01 12:30:00'), '2014-06-03')])
+def test_query_dates(merged_messages, since, until):
+    in_range = pd.Series(True, index=merged_messages.index)
+    if since is not None:
+        in_range &= merged_messages['date'] >= pd.Timestamp(since)
+    if until is not None:
+        in_range &= merged_messages['date'] < pd.Timestamp(until)
+    assert 0 < in_range.sum() < merged_messages.shape[0]
+
+    pd.testing.assert_frame_equal(_in_stable_order(_query_messages(since=since, until=until)),
+                                  _in_stable_order(merged_messages[in_range]))
+
+
+def test_query_dates_contacts_and_direction(merged_messages):
+    contact = _known_contacts(merged_messages)[0]
+    dates = merged_messages['date']
+    since, until = dates.quantile(.25), dates.quantile(.75)
+
+    queried = _query_messages(contacts=contact, since=since, until=until, from_me=True)
+
+    expected = merged_messages[(merged_messages['full_name'] == contact) & (merged_messages['is_from_me'] == 1) &
+                               (dates >= since) & (dates < until)]
+    assert expected.shape[0] > 0
+    pd.testing.assert_frame_equal(_in_stable_order(queried), _in_stable_order(expected))
+
+
+@pytest.mark.parametrize('columns', [['text'], ['full_name', 'date', 'text'], ['date', 'is_from_me', 'message_id']])
+def test_query_columns(merged_messages, columns):
+    queried = _query_messages(columns=columns)
+
+    assert list(queried.columns) == columns
+    assert queried.index.name == 'row_index'
+    expected = merged_messages[columns]
+    if 'date' in columns:
+        assert queried['date'].is_monotonic_increasing
+    for column in columns:
+        assert queried[column].dtype == expected[column].dtype
+        pd.testing.assert_series_equal(_sorted_values(queried[column]), _sorted_values(expected[column]),
+                                       check_dtype=False)
+
+
+def test_query_unknown_columns():
+    with pytest.raises(ValueError, match='bogus'):
+        _query_messages(columns=['text', 'bogus'])
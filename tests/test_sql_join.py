@@ -0,0 +1,53 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import contact_normalization
+import iphone_connector
+import synthetic_data
+
+
+@pytest.fixture(scope='module')
+def merged_messages(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    synthetic_data.write_iphone_backup(backup_directory, number_of_messages=2000, number_of_contacts=50)
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+        from_pandas = iphone_connector.get_cleaned_fully_merged_messages()
+        from_sql = iphone_connector.get_fully_merged_messages_from_sql()
+    return from_pandas, from_sql
+
+
+# Messages sharing a date may be in either order, so compare them in a fixed one.
+def _in_stable_order(messages_df):
+    return messages_df.sort_values(['date', 'message_id', 'phone_or_email'], kind='mergesort').reset_index(drop=True)
+
+
+def test_sql_join_matches_pandas_merges(merged_messages):
+    (pandas_messages_df, _), (sql_messages_df, _) = merged_messages
+
+    assert list(sql_messages_df.columns) == list(pandas_messages_df.columns)
+    assert sql_messages_df.index.name == pandas_messages_df.index.name == 'row_index'
+    pd.testing.assert_frame_equal(_in_stable_order(sql_messages_df), _in_stable_order(pandas_messages_df),
+                                  check_categorical=False)
+
+
+def test_sql_join_matches_pandas_merges_on_missing_values(merged_messages):
+    (pandas_messages_df, _), (sql_messages_df, _) = merged_messages
+    pandas_messages_df = _in_stable_order(pandas_messages_df)
+    sql_messages_df = _in_stable_order(sql_messages_df)
+
+    # The synthetic backup has handles missing from the address book, so these paths are exercised.
+    unknown = pandas_messages_df['full_name'] == contact_normalization.UNKNOWN_FULL_NAME
+    assert unknown.any()
+    pd.testing.assert_series_equal(sql_messages_df['full_name'] == contact_normalization.UNKNOWN_FULL_NAME, unknown)
+    for column in ['birthday', 'creation_date', 'modification_date', 'phone_or_email']:
+        pd.testing.assert_series_equal(sql_messages_df[column].isna(), pandas_messages_df[column].isna())
+
+
+def test_sql_join_matches_pandas_address_book(merged_messages):
+    (_, pandas_address_book_df), (_, sql_address_book_df) = merged_messages
+
+    pd.testing.assert_frame_equal(sql_address_book_df, pandas_address_book_df)
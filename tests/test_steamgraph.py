@@ -0,0 +1,103 @@
+import json
+
+import pandas as pd
+import pytest
+
+import message_cube
+import steamgraph
+
+# The number of messages exchanged with each contact per month, from January to July 2015.
+MONTHLY_MESSAGES = {
+    'Alex': [1, 1, 1, 1, 1, 1, 1],
+    'Bo': [2, 0, 0, 0, 0, 0, 2],
+    'Cy': [0, 0, 1, 0, 0, 0, 0],
+}
+MONTHS = ['2015-{0:02d}-01'.format(month) for month in range(1, 8)]
+
+
+@pytest.fixture(scope='module')
+def cube():
+    rows = []
+    for full_name, counts in MONTHLY_MESSAGES.items():
+        for month, count in zip(MONTHS, counts):
+            for i in range(count):
+                rows.append({'full_name': full_name, 'is_from_me': i % 2, 'text': 'hi there',
+                             'date': pd.Timestamp(month) + pd.Timedelta(days=i)})
+    return message_cube.build_cube(pd.DataFrame(rows))
+
+
+def _values_by_key(data):
+    return {series['key']: series['values'] for series in data['series']}
+
+
+def test_compact_json_shape(cube):
+    data = steamgraph.get_steamgraph_data(cube, top_n=2)
+
+    assert set(data) == {'dates', 'series', 'dateFormat'}
+    assert data['dates'] == MONTHS
+    assert data['dateFormat'] == "%b '%y"
+    assert [series['key'] for series in data['series']] == ['Alex', 'Bo', steamgraph.OTHER_SERIES_KEY]
+    assert all(set(series) == {'key', 'values'} for series in data['series'])
+    assert all(len(series['values']) == len(data['dates']) for series in data['series'])
+
+    data_json = steamgraph.get_steamgraph_json(cube, top_n=2)
+    assert ' ' not in data_json.replace("%b '%y", '')
+    assert json.loads(data_json) == data
+
+
+def test_buckets_sum_the_messages_of_each_period(cube):
+    values = _values_by_key(steamgraph.get_steamgraph_data(cube, top_n=2))
+
+    assert values == {'Alex': MONTHLY_MESSAGES['Alex'], 'Bo': MONTHLY_MESSAGES['Bo'],
+                      steamgraph.OTHER_SERIES_KEY: MONTHLY_MESSAGES['Cy']}
+    monthly_totals = [sum(counts) for counts in zip(*MONTHLY_MESSAGES.values())]
+    assert [sum(bucket) for bucket in zip(*values.values())] == monthly_totals
+
+
+def test_contacts_and_other(cube):
+    data = steamgraph.get_steamgraph_data(cube, contacts=['Cy', 'Alex'], include_other=False)
+    assert _values_by_key(data) == {'Cy': MONTHLY_MESSAGES['Cy'], 'Alex': MONTHLY_MESSAGES['Alex']}
+    assert [series['key'] for series in data['series']] == ['Cy', 'Alex']
+
+    # Nothing is left over for an "Other" series.
+    data = steamgraph.get_steamgraph_data(cube, top_n=3)
+    assert [series['key'] for series in data['series']] == ['Alex', 'Bo', 'Cy']
+
+
+@pytest.mark.parametrize('max_points, expected_dates, expected_values', [
+    # Seven months in buckets of three, the last bucket holds a single month and is scaled up by three.
+    (3, ['2015-01-01', '2015-04-01', '2015-07-01'], {'Alex': [3, 3, 3], 'Bo': [2, 0, 6], 'Cy': [1, 0, 0]}),
+    # In buckets of two, the last bucket holds a single month and is scaled up by two.
+    (4, ['2015-01-01', '2015-03-01', '2015-05-01', '2015-07-01'],
+     {'Alex': [2, 2, 2, 2], 'Bo': [2, 0, 0, 4], 'Cy': [0, 1, 0, 0]}),
+    # All the buckets are whole.
+    (7, MONTHS, MONTHLY_MESSAGES),
+])
+def test_buckets_are_summed_down_to_max_points(cube, max_points, expected_dates, expected_values):
+    data = steamgraph.get_steamgraph_data(cube, top_n=3, max_points=max_points)
+
+    assert data['dates'] == expected_dates
+    assert _values_by_key(data) == expected_values
+
+
+def test_partial_last_bucket_is_scaled_to_a_whole_bucket(cube):
+    data = steamgraph.get_steamgraph_data(cube, contacts=['Alex'], include_other=False, max_points=3)
+
+    # Alex texts at the same rate every month, so the chart stays level up to its right edge.
+    assert _values_by_key(data) == {'Alex': [3, 3, 3]}
+
+
+def test_days(cube):
+    data = steamgraph.get_steamgraph_data(cube, top_n=1, freq='D')
+
+    assert data['dates'][0] == '2015-01-01'
+    assert data['dates'][-1] == '2015-07-02'
+    assert len(data['dates']) == (pd.Timestamp('2015-07-02') - pd.Timestamp('2015-01-01')).days + 1
+    assert data['dateFormat'] == "%b %d '%y"
+    assert sum(sum(series['values']) for series in data['series']) == sum(map(sum, MONTHLY_MESSAGES.values()))
+
+
+def test_empty_cube(cube):
+    data = steamgraph.get_steamgraph_data(cube.iloc[:0])
+
+    assert data == {'dates': [], 'series': [], 'dateFormat': "%b '%y"}
@@ -0,0 +1,87 @@
+import contextlib
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import iphone_connector
+import synthetic_data
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NUMBER_OF_MESSAGES = 2000
+CHUNK_SIZE = 300
+# A message that's later received a second time, in another batch.
+DUPLICATED_MESSAGE_ID = 5
+
+
+@pytest.fixture(scope='module')
+def backup_directory(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    message_path, _ = synthetic_data.write_iphone_backup(backup_directory, NUMBER_OF_MESSAGES, number_of_contacts=50)
+    with contextlib.closing(sqlite3.connect(message_path)) as message_con:
+        with message_con:
+            columns = [row[1] for row in message_con.execute('PRAGMA table_info(message)') if row[1] != 'ROWID']
+            # A new guid as the database requires, the other columns are the same.
+            copied_columns = ["guid || '-again'" if column == 'guid' else column for column in columns]
+            message_con.execute('INSERT INTO message ({0}) SELECT {1} FROM message WHERE ROWID = ?'.format(
+                ', '.join(columns), ', '.join(copied_columns)), (DUPLICATED_MESSAGE_ID,))
+            message_con.execute('INSERT INTO chat_message_join (chat_id, message_id) '
+                                'SELECT chat_id, ? FROM chat_message_join WHERE message_id = ?',
+                                (NUMBER_OF_MESSAGES + 1, DUPLICATED_MESSAGE_ID))
+    return backup_directory
+
+
+def _call_quietly(function, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def _run_connector(*args):
+    subprocess.check_call([sys.executable, 'iphone_connector.py'] + list(args), cwd=REPOSITORY_DIRECTORY,
+                          stdout=subprocess.DEVNULL)
+
+
+# Messages sharing a date may be in either order, so compare them in a fixed one.
+def _in_stable_order(messages_df, columns=('date', 'message_id', 'phone_or_email')):
+    return (messages_df.astype({'full_name': object}).astype({'phone_or_email': object}, errors='ignore')
+            .sort_values(list(columns), kind='mergesort')
+            .reset_index(drop=True))
+
+
+def test_batches_add_up_to_the_merged_messages(backup_directory):
+    _call_quietly(iphone_connector.initialize, backup_directory)
+    messages_df, _ = _call_quietly(iphone_connector.get_fully_merged_messages_from_sql)
+    batches = _call_quietly(lambda: list(iphone_connector.iter_fully_merged_messages(CHUNK_SIZE)))
+    streamed_messages_df = pd.concat(batches)
+
+    assert len(batches) > 1
+    assert streamed_messages_df.index.equals(pd.RangeIndex(streamed_messages_df.shape[0], name='row_index'))
+    assert streamed_messages_df['message_id'].is_monotonic_increasing
+    # As documented, true duplicates are only dropped within a batch, so the copy received later is kept.
+    assert messages_df['message_id'].max() == NUMBER_OF_MESSAGES
+    duplicates = streamed_messages_df['message_id'] == NUMBER_OF_MESSAGES + 1
+    assert duplicates.any()
+    pd.testing.assert_frame_equal(_in_stable_order(streamed_messages_df[~duplicates]), _in_stable_order(messages_df),
+                                  check_categorical=False)
+
+
+def test_streamed_csv_matches_csv(backup_directory, tmp_path):
+    (tmp_path / 'streamed').mkdir()
+    (tmp_path / 'loaded').mkdir()
+    _run_connector('--backup', backup_directory, '--full', '--stream', '--chunk-size', str(CHUNK_SIZE),
+                   str(tmp_path / 'streamed'))
+    _run_connector('--backup', backup_directory, '--full', str(tmp_path / 'loaded'))
+
+    streamed_messages_df = pd.read_csv(str(tmp_path / 'streamed' / 'messages.csv'), index_col='row_index')
+    messages_df = pd.read_csv(str(tmp_path / 'loaded' / 'messages.csv'), index_col='row_index')
+    assert list(streamed_messages_df.columns) == list(messages_df.columns)
+    assert streamed_messages_df.index.tolist() == list(range(streamed_messages_df.shape[0]))
+    duplicates = streamed_messages_df['message_id'] == NUMBER_OF_MESSAGES + 1
+    pd.testing.assert_frame_equal(_in_stable_order(streamed_messages_df[~duplicates]), _in_stable_order(messages_df))
+
+    pd.testing.assert_frame_equal(pd.read_csv(str(tmp_path / 'streamed' / 'addresses.csv')),
+                                  pd.read_csv(str(tmp_path / 'loaded' / 'addresses.csv')))
@@ -0,0 +1,51 @@
+import warnings
+
+import numpy as np
+import pytest
+from bs4 import BeautifulSoup
+
+import facebook_connector
+
+# Pieces of message content, markup the fast path handles and markup it must hand over to BeautifulSoup.
+TOKENS = [
+    'hey', 'see you at 5', u'caf\xe9', u'\U0001f600', 'a < b', 'x > y', '1 & 2', 'http://example.com/?a=1&b=2',
+    ' ', '  ', '\n', '\r\n', '\t', u'\xa0', '\n \n',
+    '<b>', '</b>', '<i>', '</i>', '<p>', '</p>', '<div class="x">', '</div>', '<span>', '</span>',
+    '<a href="http://example.com/?a=1&amp;b=2">', '</a>', '<br>', '<br/>', '<br />', '</br>', '<BR>', '</BR>',
+    '<img src="x.png">', '</img>', '<hr>', '</hr>', '<input value="a&amp;b">', '</input>', '<wbr>', '</wbr>',
+    '&amp;', '&lt;', '&gt;', '&quot;', '&nbsp;', '&#39;', '&#x27;', '&#128512;', '&bogus;', '&amp', '&',
+    '<!-- a comment -->', '<!DOCTYPE html>', '<?xml version="1.0"?>', '<![CDATA[data]]>',
+    '<script>var a = "<b>";</script>', '<style>b {}</style>', '<pre>\n  x\n</pre>', '<textarea> t </textarea>',
+    '<template>t</template>', '<ruby>a<rt>b</rt><rp>(</rp></ruby>',
+    '<', '>', '</', '<b', '<a href="x', '<!--', '</>', '<3', '< b>', '<1>',
+]
+
+
+def _random_contents(number_of_contents, seed=0):
+    random_state = np.random.RandomState(seed)
+    for _ in range(number_of_contents):
+        yield ''.join(TOKENS[i] for i in random_state.randint(len(TOKENS), size=random_state.randint(1, 9)))
+
+
+def _beautiful_soup_text(content):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return BeautifulSoup(content, 'html.parser').text
+
+
+@pytest.mark.filterwarnings('ignore')
+@pytest.mark.parametrize('content', [
+    'plain text', '', ' ', '\r\n', ' \t ', '<br>\r\n</br>x', '<br>\r\n<br>x', 'a</br>  </br>b', '<p>\r\n</p>x',
+    '<img src=x>\n</img>y', 'Tom &amp; Jerry', 'x &bogus; y', '<b>bold</b> &lt;3', 'unterminated <b',
+])
+def test_matches_beautiful_soup(content):
+    assert facebook_connector.strip_html(content) == _beautiful_soup_text(content)
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_matches_beautiful_soup_on_random_markup():
+    mismatches = [(content, facebook_connector.strip_html(content), _beautiful_soup_text(content))
+                  for content in _random_contents(20000)
+                  if facebook_connector.strip_html(content) != _beautiful_soup_text(content)]
+
+    assert mismatches[:5] == []
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pytest
+from nltk import tokenize
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import text_processing
+import tfidf_engine
+
+WORDS = ['pizza', 'soccer', 'meeting', 'deadline', 'beach', 'guitar', 'concert', 'coffee', 'tonight', 'weekend',
+         'project', 'dinner', 'movie', 'train', 'birthday', 'puppy', 'garden', 'exam', 'lecture', 'pasta']
+CONTACTS = ['Alex Chen', 'Dana Rossi', 'Jordan Lee Globex', 'Mom', 'Pat Silva']
+# Barely texts, so fewer words set this contact apart than are asked for.
+SPARSE_CONTACT = 'Sam Sparse'
+TOP_N = 10
+
+
+@pytest.fixture(scope='module')
+def received_messages():
+    random_state = np.random.RandomState(0)
+    rows = []
+    for i, contact in enumerate(CONTACTS):
+        # Each contact favours a few words of their own.
+        probabilities = np.ones(len(WORDS))
+        probabilities[[(3 * i + offset) % len(WORDS) for offset in range(3)]] = 15
+        probabilities /= probabilities.sum()
+        for _ in range(30):
+            rows.append((contact, ' '.join(random_state.choice(WORDS, size=random_state.randint(2, 8),
+                                                               p=probabilities))))
+    rows.append((SPARSE_CONTACT, 'zebra crossing'))
+    return pd.DataFrame(rows, columns=['full_name', 'text']).assign(is_from_me=0)
+
+
+@pytest.fixture(scope='module')
+def contact_tfidf(received_messages, tmp_path_factory):
+    return tfidf_engine.fit_contact_tfidf(received_messages,
+                                          cache_path=str(tmp_path_factory.mktemp('tfidf') / 'contact_tfidf.pkl'))
+
+
+# The TFIDF matrix as the notebook built it before the engine existed, densified.
+@pytest.fixture(scope='module')
+def dense_tfidf(received_messages):
+    grouped_by_name = received_messages.groupby('full_name').apply(
+        lambda row: pd.Series({'count': len(row.text), 'text': ' '.join(row.text)}))
+    vectorizer = TfidfVectorizer(preprocessor=text_processing.clean_text,
+                                 tokenizer=tokenize.WordPunctTokenizer().tokenize, token_pattern=None,
+                                 stop_words=text_processing.processed_stopwords,
+                                 ngram_range=(1, 2), max_df=.9, max_features=50000)
+    matrix = vectorizer.fit_transform(grouped_by_name.text).toarray()
+    return matrix, grouped_by_name.index, pd.Series(vectorizer.get_feature_names_out())
+
+
+def _dense_record(dense_tfidf, contact):
+    matrix, names, _ = dense_tfidf
+    return matrix[np.argmax(names == contact)]
+
+
+# Checks words picked from scores match the previous dense pick, argsort()[::-1][:top_n].  Words with the same score
+# may come in either order, so the scores at each rank are compared along with the words above the last score.
+def _assert_same_top_words(words, dense_scores, word_list, top_n):
+    dense_top = dense_scores.argsort()[::-1][:top_n]
+    scores_by_word = pd.Series(dense_scores, index=word_list)
+    assert len(words) == top_n
+    np.testing.assert_allclose(scores_by_word[words].to_numpy(), dense_scores[dense_top])
+    lowest_score = dense_scores[dense_top[-1]]
+    assert (set(word for word in words if scores_by_word[word] > lowest_score) ==
+            set(word_list.iloc[dense_top][dense_scores[dense_top] > lowest_score]))
+
+
+def test_matrix_matches_dense_implementation(contact_tfidf, dense_tfidf):
+    matrix, names, word_list = dense_tfidf
+
+    assert contact_tfidf.names.tolist() == names.tolist()
+    assert contact_tfidf.word_list.tolist() == word_list.tolist()
+    np.testing.assert_allclose(contact_tfidf.matrix.toarray(), matrix)
+    assert contact_tfidf.text_counts.tolist() == [30] * len(CONTACTS) + [1]
+
+
+@pytest.mark.parametrize('contact', CONTACTS + [SPARSE_CONTACT])
+def test_top_words_match_dense_implementation(contact_tfidf, dense_tfidf, contact):
+    words = contact_tfidf.top_words(contact, TOP_N)['Word'].tolist()
+
+    _assert_same_top_words(words, _dense_record(dense_tfidf, contact), dense_tfidf[2], TOP_N)
+
+
+def test_sparse_contact_is_padded_to_top_n(contact_tfidf):
+    assert contact_tfidf.get_record(SPARSE_CONTACT).nnz < TOP_N
+
+    words = contact_tfidf.top_words(SPARSE_CONTACT, TOP_N)['Word']
+
+    assert words.shape[0] == TOP_N
+    assert set(words.iloc[:3]) == {'zebra', 'crossing', 'zebra crossing'}
+
+
+@pytest.mark.parametrize('contact, other_contact', [('Mom', 'Alex Chen'), (SPARSE_CONTACT, 'Pat Silva'),
+                                                    ('Pat Silva', SPARSE_CONTACT)])
+def test_top_words_diff_match_dense_implementation(contact_tfidf, dense_tfidf, contact, other_contact):
+    words = contact_tfidf.top_words_diff(contact, other_contact, TOP_N)['Word'].tolist()
+
+    dense_scores = _dense_record(dense_tfidf, contact) - _dense_record(dense_tfidf, other_contact)
+    _assert_same_top_words(words, dense_scores, dense_tfidf[2], TOP_N)
+
+
+def test_unknown_contact(contact_tfidf):
+    assert contact_tfidf.top_words('Nobody') is None
+    assert contact_tfidf.top_words_diff('Mom', 'Nobody') is None
+
+
+def test_top_words_by_group_match_dense_implementation(contact_tfidf, dense_tfidf):
+    matrix, names, word_list = dense_tfidf
+    labels = ['family' if name in ('Mom', 'Dana Rossi') else 'friends' for name in names]
+
+    top_words = tfidf_engine.top_words_by_group(contact_tfidf.matrix, labels, contact_tfidf.word_list, TOP_N)
+
+    assert top_words.columns.tolist() == ['friends', 'family']
+    for label in ['friends', 'family']:
+        in_group = np.array(labels) == label
+        dense_scores = matrix[in_group].mean(axis=0) - matrix[~in_group].mean(axis=0)
+        _assert_same_top_words(top_words[label].tolist(), dense_scores, word_list, TOP_N)
+
+
+def test_persisted_matrix_is_reused(received_messages, tmp_path, capsys):
+    cache_path = str(tmp_path / 'contact_tfidf.pkl')
+    tfidf_engine.fit_contact_tfidf(received_messages, cache_path=cache_path)
+    capsys.readouterr()
+
+    tfidf_engine.fit_contact_tfidf(received_messages, cache_path=cache_path)
+    assert 'Loaded TFIDF matrix' in capsys.readouterr().out
+
+    changed_messages = received_messages.assign(text=received_messages['text'] + ' extra')
+    tfidf_engine.fit_contact_tfidf(changed_messages, cache_path=cache_path)
+    assert 'Loaded TFIDF matrix' not in capsys.readouterr().out
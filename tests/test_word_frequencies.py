@@ -0,0 +1,109 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import contact_normalization
+import iphone_connector
+import synthetic_data
+import word_frequencies
+
+
+@pytest.fixture(scope='module')
+def backup_directory(tmp_path_factory):
+    backup_directory = str(tmp_path_factory.mktemp('backup'))
+    synthetic_data.write_iphone_backup(backup_directory, number_of_messages=2000, number_of_contacts=50)
+    return backup_directory
+
+
+@pytest.fixture
+def small_cache(backup_directory, monkeypatch):
+    with contextlib.redirect_stdout(io.StringIO()):
+        iphone_connector.initialize(backup_directory)
+    # Far fewer entries than contacts, as with a large address book and the default size.
+    cache = word_frequencies.TermFrequencyCache(4)
+    monkeypatch.setattr(word_frequencies, '_term_frequency_cache', cache)
+    return cache
+
+
+def _call_quietly(function, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def test_total_doesnt_evict_contacts(small_cache):
+    with contextlib.redirect_stdout(io.StringIO()):
+        messages_df = iphone_connector.query_messages(columns=['full_name'])
+    contacts = messages_df['full_name'].value_counts().index[:2]
+    contact_term_frequencies = [_call_quietly(word_frequencies.get_term_frequencies, contact, False)
+                                for contact in contacts]
+    assert messages_df['full_name'].nunique() > small_cache.max_size
+
+    _call_quietly(word_frequencies.get_total_term_frequencies, False)
+    _call_quietly(word_frequencies.get_total_term_frequencies, True)
+
+    assert len(small_cache) == 4
+    for contact, term_frequencies in zip(contacts, contact_term_frequencies):
+        assert small_cache.get((contact, False)) is term_frequencies
+    assert (None, False) in small_cache and (None, True) in small_cache
+
+
+@pytest.mark.parametrize('from_me', [True, False])
+def test_total_is_the_sum_of_every_contact(small_cache, from_me):
+    with contextlib.redirect_stdout(io.StringIO()):
+        texts = iphone_connector.query_messages(from_me=from_me, columns=['text'])['text']
+
+    counts, number_of_texts = _call_quietly(word_frequencies.get_total_term_frequencies, from_me)
+
+    assert number_of_texts == texts.shape[0]
+    pd.testing.assert_series_equal(counts.sort_index(), word_frequencies.count_terms(texts).sort_index())
+
+
+@pytest.fixture
+def displayed_messages(small_cache):
+    with contextlib.redirect_stdout(io.StringIO()):
+        messages_df, _ = iphone_connector.get_fully_merged_messages_from_sql()
+    messages_df['full_name'] = contact_normalization.to_display_names(messages_df['full_name'])
+    return messages_df
+
+
+def _refuse_to_query(*args, **kwargs):
+    raise AssertionError('the messages should be read from the passed dataframe')
+
+
+@pytest.mark.parametrize('from_me', [True, False])
+def test_counts_the_passed_messages_like_the_backup(displayed_messages, monkeypatch, from_me):
+    contact = displayed_messages['full_name'].value_counts().drop(contact_normalization.UNKNOWN_DISPLAY_NAME).index[0]
+    queried = _call_quietly(word_frequencies.get_term_frequencies, contact, from_me)
+    queried_total = _call_quietly(word_frequencies.get_total_term_frequencies, from_me)
+    word_frequencies.clear_cache()
+
+    monkeypatch.setattr(iphone_connector, 'query_messages', _refuse_to_query)
+    counts, number_of_texts = word_frequencies.get_term_frequencies(contact, from_me, displayed_messages)
+    total_counts, total_number_of_texts = word_frequencies.get_total_term_frequencies(from_me, displayed_messages)
+
+    assert number_of_texts == queried[1]
+    pd.testing.assert_series_equal(counts.sort_index(), queried[0].sort_index())
+    assert total_number_of_texts == queried_total[1]
+    pd.testing.assert_series_equal(total_counts.sort_index(), queried_total[0].sort_index())
+
+
+def test_unknown_contacts_by_their_displayed_name(displayed_messages, small_cache):
+    is_unknown = ((displayed_messages['full_name'] == contact_normalization.UNKNOWN_DISPLAY_NAME) &
+                  (displayed_messages['is_from_me'] == 0))
+    assert is_unknown.any()
+
+    counts, number_of_texts = word_frequencies.get_term_frequencies(contact_normalization.UNKNOWN_DISPLAY_NAME,
+                                                                    False, displayed_messages)
+
+    assert number_of_texts == is_unknown.sum()
+    pd.testing.assert_series_equal(counts, word_frequencies.count_terms(displayed_messages.loc[is_unknown, 'text']))
+    # Asking by the stored name finds the same counts in the cache, and so does loading them from the backup.
+    assert _call_quietly(word_frequencies.get_term_frequencies, contact_normalization.UNKNOWN_FULL_NAME,
+                         False)[0] is counts
+    word_frequencies.clear_cache()
+    queried_counts, queried_number_of_texts = _call_quietly(word_frequencies.get_term_frequencies,
+                                                            contact_normalization.UNKNOWN_DISPLAY_NAME, False)
+    assert queried_number_of_texts == number_of_texts
+    pd.testing.assert_series_equal(queried_counts.sort_index(), counts.sort_index())
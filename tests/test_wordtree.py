@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import wordtree
+
+TEXTS = [
+    'I love you so much',
+    'i love you too',
+    'I love pizza',
+    'we love you, really',
+    'they love it',
+    'love',
+    # Contains the root word, but not as a word of its own.
+    'lovely day',
+    'no match here',
+    None,
+]
+
+
+def _node(count, children=None):
+    return {'count': count, 'children': children or {}}
+
+
+def test_find_phrase_windows():
+    windows = wordtree.find_phrase_windows(TEXTS, 'Love', depth=2)
+
+    assert windows == [
+        (('i',), ('love',), ('you', 'so')),
+        (('i',), ('love',), ('you', 'too')),
+        (('i',), ('love',), ('pizza',)),
+        (('we',), ('love',), ('you,', 'really')),
+        (('they',), ('love',), ('it',)),
+        ((), ('love',), ()),
+    ]
+    assert wordtree.find_phrase_windows(TEXTS, 'Love', depth=2, lowercase=False) == []
+    assert wordtree.find_phrase_windows(TEXTS, 'I', depth=1, lowercase=False) == [
+        ((), ('I',), ('love',)),
+        ((), ('I',), ('love',)),
+    ]
+    # Punctuation around a word doesn't stop it matching the root words.
+    assert wordtree.find_phrase_windows(TEXTS, 'love you', depth=1) == [
+        (('i',), ('love', 'you'), ('so',)),
+        (('i',), ('love', 'you'), ('too',)),
+        (('we',), ('love', 'you,'), ('really',)),
+    ]
+
+
+def test_build_word_tree_counts_every_branch():
+    windows = wordtree.find_phrase_windows(TEXTS, 'love', depth=2)
+
+    prefix_tree, suffix_tree = wordtree.build_word_tree(windows, max_branches=len(windows))
+
+    assert prefix_tree == {'i': _node(3), 'we': _node(1), 'they': _node(1)}
+    assert suffix_tree == {
+        'you': _node(2, {'so': _node(1), 'too': _node(1)}),
+        'pizza': _node(1),
+        'you,': _node(1, {'really': _node(1)}),
+        'it': _node(1),
+    }
+
+
+@pytest.mark.parametrize('max_branches, expected_prefix_tree, expected_suffix_tree', [
+    # Ties are broken alphabetically, so "it" is kept over "pizza" and "you," and "they" over "we".
+    (2, {'i': _node(3), 'they': _node(1)},
+     {'you': _node(2, {'so': _node(1), 'too': _node(1)}), 'it': _node(1)}),
+    (1, {'i': _node(3)}, {'you': _node(2, {'so': _node(1)})}),
+])
+def test_build_word_tree_prunes_to_max_branches(max_branches, expected_prefix_tree, expected_suffix_tree):
+    windows = wordtree.find_phrase_windows(TEXTS, 'love', depth=2)
+
+    prefix_tree, suffix_tree = wordtree.build_word_tree(windows, max_branches=max_branches)
+
+    assert prefix_tree == expected_prefix_tree
+    assert suffix_tree == expected_suffix_tree
+
+
+@pytest.mark.parametrize('tree_type, expected_phrases', [
+    ('double', ['i love you so', 'i love you', 'i love', 'love', 'love', 'love']),
+    ('suffix', ['love you so', 'love you', 'love', 'love', 'love', 'love']),
+    ('prefix', ['i love', 'i love', 'i love', 'love', 'love', 'love']),
+])
+def test_phrases_are_cut_where_they_leave_the_pruned_tree(tree_type, expected_phrases):
+    phrases = wordtree.get_word_tree_phrases(TEXTS, 'love', depth=2, max_branches=1, tree_type=tree_type)
+
+    assert phrases == expected_phrases
+    assert json.loads(wordtree.get_word_tree_json(phrases)) == [['Phrases']] + [[phrase] for phrase in phrases]
+
+
+def test_phrases_are_whole_when_nothing_is_pruned():
+    phrases = wordtree.get_word_tree_phrases(TEXTS, 'love', depth=2, max_branches=wordtree.DEFAULT_MAX_BRANCHES)
+
+    assert phrases == ['i love you so', 'i love you too', 'i love pizza', 'we love you, really', 'they love it',
+                       'love']
@@ -0,0 +1,62 @@
+"""
+
+This module holds the text cleaning shared by the TFIDF and word cloud code of the notebook.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import copy
+import re
+import string
+
+from nltk import tokenize
+from wordcloud import STOPWORDS
+
+_PUNCTUATION = copy.copy(string.punctuation)
+_PUNCTUATION += u'“”‘’\ufffc\uff0c'  # Include some UTF-8 punctuation that occurred.
+_PUNCT_REGEX = re.compile(u'[{0}]'.format(_PUNCTUATION))
+_SPACES_REGEX = re.compile(r'\s{2,}')
+_NUMBERS_REGEX = re.compile(r'\d+')
+_WORD_TOKENIZER = tokenize.WordPunctTokenizer()
+
+
+def clean_text(input_str):
+    """
+    Lowercases a text and removes its punctuation and numbers.
+
+    Args:
+        input_str: the text to clean
+
+    Returns:
+        the cleaned text
+    """
+    processed = input_str.lower()
+    processed = _PUNCT_REGEX.sub('', processed)
+    # Also try: processed = _NUMBERS_REGEX.sub('_NUMBER_', processed)
+    processed = _NUMBERS_REGEX.sub('', processed)
+    processed = _SPACES_REGEX.sub(' ', processed)
+
+    return processed
+
+
+def split_words(input_str):
+    """
+    Splits a text into words and runs of punctuation, e.g. after cleaning it with clean_text().
+
+    Note:
+        Pass this, rather than the tokenize method of a tokenizer, to anything that gets pickled: it's pickled by
+        reference, whereas a pickled tokenizer can fail to tokenize once loaded back.
+
+    Args:
+        input_str: the text to split
+
+    Returns:
+        a list of the words
+    """
+    return _WORD_TOKENIZER.tokenize(input_str)
+
+
+# The normal stopwords list contains words like "i'll" which is unprocessed.
+processed_stopwords = [clean_text(word) for word in STOPWORDS]
@@ -0,0 +1,253 @@
+"""
+
+This module builds the TFIDF matrices the notebook uses to find the words that set a contact, a year or a cluster of
+contacts apart from the rest.
+
+The matrices stay sparse throughout: comparing a group of rows against the mean of the others only needs the column
+sums of the matrix, and the top words are picked with np.argpartition rather than sorting the whole vocabulary.  The
+TFIDF matrix of texts received per contact is persisted to disk by fit_contact_tfidf() and reused until the messages
+change.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import hashlib
+import numpy as np
+import os
+import pandas as pd
+import pickle
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import text_processing
+
+DEFAULT_TFIDF_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.sms_analysis_cache', 'contact_tfidf.pkl')
+# Bump this whenever create_vectorizer() changes so persisted matrices are refit.
+TFIDF_VERSION = 2
+
+
+def create_vectorizer():
+    """
+    Returns an unfitted vectorizer with the settings the notebook uses, texts are cleaned with
+    text_processing.clean_text() and stopwords are dropped.
+    """
+    return TfidfVectorizer(preprocessor=text_processing.clean_text,
+                           tokenizer=text_processing.split_words,
+                           token_pattern=None,
+                           stop_words=text_processing.processed_stopwords,
+                           ngram_range=(1, 2), max_df=.9, max_features=50000)
+
+
+def get_word_list(vectorizer):
+    """
+    Returns the words of a fitted vectorizer as a series, indexed by their column in the TFIDF matrix.
+    """
+    try:
+        return pd.Series(vectorizer.get_feature_names_out())
+    except AttributeError:
+        # scikit-learn < 1.0
+        return pd.Series(vectorizer.get_feature_names())
+
+
+def group_texts(texts, groups, min_texts_required=None):
+    """
+    Joins texts into a single string per group, missing texts are left out.
+
+    Args:
+        texts: a series of texts
+        groups: a series of the group of each text, with the same index as texts
+        min_texts_required: if passed, groups with fewer texts than this are dropped
+
+    Returns:
+        a dataframe indexed by group with the "count" of texts and the joined "text"
+    """
+    texts = texts[texts.notnull()]
+    grouped = texts.groupby(groups, observed=True, sort=True).agg(['size', ' '.join])
+    grouped.columns = ['count', 'text']
+    if min_texts_required is not None:
+        grouped = grouped[grouped['count'] >= min_texts_required]
+    return grouped
+
+
+def top_indices(scores, top_n):
+    """
+    Returns the indices of the top_n highest scores, highest first, without sorting every score.
+    """
+    top_n = min(top_n, len(scores))
+    if top_n <= 0:
+        return np.array([], dtype=np.intp)
+    top = np.argpartition(-scores, top_n - 1)[:top_n]
+    return top[np.argsort(-scores[top], kind='mergesort')]
+
+
+def score_group_against_rest(matrix, in_group):
+    """
+    Scores each word by its mean TFIDF within a group of rows minus its mean TFIDF within the other rows.
+
+    Args:
+        matrix: a sparse TFIDF matrix
+        in_group: a boolean array with an entry per row of matrix, true for the rows in the group
+
+    Returns:
+        a dense array with a score per column of matrix
+    """
+    in_group = np.asarray(in_group, dtype=bool)
+    group_size = in_group.sum()
+    other_size = in_group.shape[0] - group_size
+    group_sum = np.asarray(matrix.T.dot(in_group.astype(np.float64))).ravel()
+    other_sum = np.asarray(matrix.sum(axis=0)).ravel() - group_sum
+    group_mean = group_sum / group_size if group_size else group_sum
+    other_mean = other_sum / other_size if other_size else other_sum
+    return group_mean - other_mean
+
+
+def top_words_by_group(matrix, labels, word_list, top_n=15):
+    """
+    Returns the top words of each group of rows, i.e. those with the highest score_group_against_rest().
+
+    Args:
+        matrix: a sparse TFIDF matrix
+        labels: the group of each row of matrix, e.g. a year per row
+        word_list: the words of the matrix's columns, see get_word_list()
+        top_n: number of top words per group to include in the result
+
+    Returns:
+        a dataframe with a column of top words per group, in the order the groups first appear in labels
+    """
+    labels = pd.Series(labels).reset_index(drop=True)
+    top_words = []
+    for label in labels.unique():
+        scores = score_group_against_rest(matrix, (labels == label).to_numpy())
+        words = word_list.iloc[top_indices(scores, top_n)].reset_index(drop=True)
+        top_words.append(words.rename(label))
+    return pd.concat(top_words, axis=1)
+
+
+class ContactTfidf(object):
+    """
+    A TFIDF matrix with a row per contact, built from the texts each contact sent.
+
+    Attributes:
+        vectorizer: the fitted vectorizer
+        matrix: the sparse TFIDF matrix, in CSR format
+        names: the full name of each row of matrix
+        text_counts: the number of texts each row of matrix is built from
+        word_list: the word of each column of matrix
+        fingerprint: identifies the messages the matrix was built from
+    """
+
+    def __init__(self, vectorizer, matrix, names, text_counts, fingerprint=None):
+        self.vectorizer = vectorizer
+        self.matrix = matrix.tocsr()
+        self.names = pd.Index(names, name='full_name')
+        self.text_counts = np.asarray(text_counts)
+        self.word_list = get_word_list(vectorizer)
+        self.fingerprint = fingerprint
+        self._row_by_name = {name: row for row, name in enumerate(self.names)}
+
+    def get_record(self, contact):
+        """
+        Returns the row of the matrix for a contact as a 1 x words sparse matrix, or None if the contact isn't found.
+        """
+        row = self._row_by_name.get(contact)
+        return None if row is None else self.matrix[row]
+
+    def top_words(self, contact, top_n=25):
+        """
+        Returns a dataframe of the words with the highest TFIDF for a contact, or None if the contact isn't found.
+        """
+        record = self.get_record(contact)
+        if record is None:
+            return None
+        return self.__top_words_of_sparse_scores(record, top_n)
+
+    def top_words_diff(self, contact, other_contact, top_n=25):
+        """
+        Returns a dataframe of the words whose TFIDF for contact exceeds that for other_contact by the most, or None
+        if either contact isn't found.
+        """
+        record = self.get_record(contact)
+        other_record = self.get_record(other_contact)
+        if record is None or other_record is None:
+            return None
+        return self.__top_words_of_sparse_scores(record - other_record, top_n)
+
+    def transform_groups(self, texts, groups, min_texts_required=100):
+        """
+        Builds a TFIDF matrix of texts joined per group with the fitted vectorizer, e.g. per year.
+
+        Args:
+            texts: a series of texts
+            groups: a series of the group of each text, with the same index as texts
+            min_texts_required: groups with fewer texts than this are dropped
+
+        Returns:
+            a tuple of the sparse TFIDF matrix and the index of its groups, or None if no group has enough texts
+        """
+        grouped = group_texts(texts, groups, min_texts_required)
+        if grouped.shape[0] == 0:
+            return None
+        return self.vectorizer.transform(grouped['text']), grouped.index
+
+    # The words that set the contact apart have a positive score, so usually the top words are found among the
+    # stored entries of the sparse scores alone.  A contact with fewer than top_n of them is padded with the highest
+    # scoring remaining words, in the order a dense sort of every score gives, so top_n words are always returned.
+    def __top_words_of_sparse_scores(self, scores, top_n):
+        scores = scores.tocsr()
+        positive = scores.data > 0
+        if positive.sum() >= top_n:
+            columns, values = scores.indices[positive], scores.data[positive]
+            top_columns = columns[top_indices(values, top_n)]
+        else:
+            top_columns = np.argsort(scores.toarray().ravel(), kind='mergesort')[::-1][:top_n]
+        return pd.DataFrame({'Word': self.word_list.iloc[top_columns]}).reset_index(drop=True)
+
+
+# Identifies the texts, and how they're grouped, that a contact TFIDF is fit on.
+def __get_fingerprint(texts, names):
+    fingerprint = hashlib.sha1(str(TFIDF_VERSION).encode('utf-8'))
+    hashes = pd.util.hash_pandas_object(pd.DataFrame({'text': texts.astype(object), 'name': names.astype(object)}),
+                                        index=False)
+    fingerprint.update(hashes.to_numpy().tobytes())
+    return fingerprint.hexdigest()
+
+
+def fit_contact_tfidf(messages_df, cache_path=None, force_refit=False):
+    """
+    Fits a vectorizer on the texts received from each contact and returns their TFIDF matrix.  The result is saved
+    to disk and loaded back on later calls, as long as the received texts haven't changed.
+
+    Args:
+        messages_df: merged messages, must contain text, full_name and is_from_me columns
+        cache_path: the file to persist the result in, defaults to DEFAULT_TFIDF_CACHE_PATH
+        force_refit: if true, ignore any persisted result
+
+    Returns:
+        a ContactTfidf
+    """
+    cache_path = cache_path or DEFAULT_TFIDF_CACHE_PATH
+    received = messages_df[messages_df['is_from_me'] == 0]
+    received = received[received['text'].notnull()]
+    fingerprint = __get_fingerprint(received['text'], received['full_name'])
+
+    if not force_refit and os.path.isfile(cache_path):
+        with open(cache_path, 'rb') as cache_file:
+            contact_tfidf = pickle.load(cache_file)
+        if contact_tfidf.fingerprint == fingerprint:
+            print('Loaded TFIDF matrix from {0}'.format(cache_path))
+            return contact_tfidf
+
+    grouped_by_name = group_texts(received['text'], received['full_name'])
+    vectorizer = create_vectorizer()
+    matrix = vectorizer.fit_transform(grouped_by_name['text'])
+    contact_tfidf = ContactTfidf(vectorizer, matrix, grouped_by_name.index.astype(object), grouped_by_name['count'],
+                                 fingerprint)
+
+    cache_directory = os.path.dirname(cache_path)
+    if cache_directory and not os.path.isdir(cache_directory):
+        os.makedirs(cache_directory)
+    with open(cache_path, 'wb') as cache_file:
+        pickle.dump(contact_tfidf, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    return contact_tfidf
@@ -0,0 +1,213 @@
+"""
+
+This module counts how often each word is used in the texts exchanged with each contact, for the notebook's word
+clouds.
+
+Counting is the slow part of drawing a word cloud, so the counts for each contact and direction, i.e. texts you sent
+or received, are kept in a least recently used cache.  A cloud can then be redrawn, e.g. with more words, from the
+cached counts via WordCloud.generate_from_frequencies() rather than splitting every text into words again.
+
+Texts are cleaned with text_processing.clean_text() and stopwords are dropped, as for the TFIDF matrices.  Like the
+merged messages, a group message you sent counts once per participant, so the counts across all your texts are the
+sum of the counts for each contact, see get_total_term_frequencies().
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import pandas as pd
+
+import contact_normalization
+import iphone_connector
+import text_processing
+
+# Words that are common in texts but say little about them, on top of the usual stopwords.
+EXTRA_STOPWORDS = ['go', 'ya', 'come', 'back', 'good', 'sound']
+WORD_CLOUD_STOPWORDS = frozenset(text_processing.processed_stopwords + EXTRA_STOPWORDS)
+# The number of (contact, direction) counts kept in memory.
+TERM_FREQUENCY_CACHE_SIZE = 128
+
+
+class TermFrequencyCache(object):
+    """
+    A mapping of bounded size that evicts the least recently used entry when full.
+
+    Attributes:
+        max_size: the number of entries kept
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the entry for a key, marking it as the most recently used, or None if the key isn't cached.
+        """
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        """
+        Adds an entry, evicting the least recently used entries if the cache is full.
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drops every entry, e.g. after loading new messages.
+        """
+        self._entries.clear()
+
+
+_term_frequency_cache = TermFrequencyCache(TERM_FREQUENCY_CACHE_SIZE)
+
+
+# Cleans and splits texts into a series of words, with the index of the text each word came from.
+def __split_into_words(texts, stopwords):
+    words = texts.dropna().astype(object).map(text_processing.clean_text).str.split().explode()
+    return words[words.notnull() & ~words.isin(stopwords)]
+
+
+# Returns the counts of texts without any words.
+def __no_counts():
+    return pd.Series([], dtype='int64', index=pd.Index([], dtype=object, name='word'), name='count')
+
+
+def count_terms(texts, stopwords=WORD_CLOUD_STOPWORDS):
+    """
+    Counts how often each word is used across texts.
+
+    Args:
+        texts: a series of texts
+        stopwords: words to leave out, in the form text_processing.clean_text() returns them
+
+    Returns:
+        a series of counts indexed by word, the most used word first
+    """
+    counts = __split_into_words(texts, stopwords).value_counts()
+    counts.index.name = 'word'
+    return counts.rename('count')
+
+
+def count_terms_by_contact(messages_df, stopwords=WORD_CLOUD_STOPWORDS):
+    """
+    Counts how often each word is used in the texts exchanged with each contact.
+
+    Args:
+        messages_df: merged messages, must contain full_name and text columns
+        stopwords: see count_terms()
+
+    Returns:
+        a dict from full name to a tuple of the contact's counts, as returned by count_terms(), and their number of
+        texts
+    """
+    words = __split_into_words(messages_df['text'], stopwords)
+    words_by_contact = pd.DataFrame({'full_name': messages_df['full_name'].loc[words.index], 'word': words})
+    counts_by_contact = words_by_contact.groupby('full_name', observed=True)['word'].value_counts()
+    counts_by_contact = {full_name: counts.droplevel('full_name')
+                         for full_name, counts in counts_by_contact.groupby(level='full_name', observed=True)}
+    texts_by_contact = messages_df.groupby('full_name', observed=True).size()
+
+    term_frequencies = {}
+    for full_name, number_of_texts in texts_by_contact.items():
+        counts = counts_by_contact.get(full_name, __no_counts())
+        term_frequencies[full_name] = (counts.rename('count'), int(number_of_texts))
+    return term_frequencies
+
+
+def get_term_frequencies(contact, from_me, messages_df=None):
+    """
+    Returns how often each word is used in the texts exchanged with a contact, counting them on the first call for
+    this contact and direction and reading them from the cache on later calls.
+
+    Args:
+        contact: the full name of the contact, or the name the notebook displays, see
+            contact_normalization.to_display_names()
+        from_me: if True texts you sent the contact are counted, if False texts the contact sent you
+        messages_df: if passed, the merged messages already loaded, e.g. the notebook's, to count the texts of rather
+            than loading them from the backup.  Its full names may be stored or displayed names
+
+    Returns:
+        a tuple of the counts, as returned by count_terms(), and the number of texts they're based on
+    """
+    # Keyed on the stored name so the counts are shared whichever name the contact was asked for by.
+    full_name = contact_normalization.to_full_name(contact)
+    key = (full_name, bool(from_me))
+    term_frequencies = _term_frequency_cache.get(key)
+    if term_frequencies is None:
+        if messages_df is None:
+            texts = iphone_connector.query_messages(contacts=full_name, from_me=from_me, columns=['text'])['text']
+        else:
+            is_contact = (messages_df['full_name'].isin({contact, full_name}) &
+                          (messages_df['is_from_me'] == int(bool(from_me))))
+            texts = messages_df.loc[is_contact, 'text']
+        term_frequencies = (count_terms(texts), texts.shape[0])
+        _term_frequency_cache.put(key, term_frequencies)
+    return term_frequencies
+
+
+def sum_term_frequencies(term_frequencies):
+    """
+    Adds up counts, e.g. those of every contact.
+
+    Args:
+        term_frequencies: an iterable of tuples as returned by get_term_frequencies()
+
+    Returns:
+        a tuple of the summed counts, the most used word first, and the total number of texts
+    """
+    term_frequencies = list(term_frequencies)
+    number_of_texts = sum(number for _, number in term_frequencies)
+    counts = [counts for counts, _ in term_frequencies if not counts.empty]
+    if not counts:
+        return __no_counts(), number_of_texts
+    summed = pd.concat(counts).groupby(level='word').sum().sort_values(ascending=False, kind='mergesort')
+    return summed.rename('count'), number_of_texts
+
+
+def get_total_term_frequencies(from_me, messages_df=None):
+    """
+    Returns how often each word is used across all the texts you sent, or received, by summing the counts of each
+    contact.  The messages are loaded once to count every contact, only the total is added to the cache since there
+    are often more contacts than fit in it, and adding them would evict the counts of the contacts being looked at.
+
+    Args:
+        from_me: if True texts you sent are counted, if False texts you received
+        messages_df: if passed, the merged messages already loaded, e.g. the notebook's, to count rather than loading
+            them from the backup
+
+    Returns:
+        a tuple of the counts, as returned by count_terms(), and the number of texts they're based on
+    """
+    key = (None, bool(from_me))
+    total_term_frequencies = _term_frequency_cache.get(key)
+    if total_term_frequencies is None:
+        if messages_df is None:
+            messages_df = iphone_connector.query_messages(from_me=from_me, columns=['full_name', 'text'])
+        else:
+            messages_df = messages_df[messages_df['is_from_me'] == int(bool(from_me))]
+        term_frequencies_by_contact = count_terms_by_contact(messages_df)
+        total_term_frequencies = sum_term_frequencies(term_frequencies_by_contact.values())
+        _term_frequency_cache.put(key, total_term_frequencies)
+    return total_term_frequencies
+
+
+def clear_cache():
+    """
+    Drops every cached count, call this after loading new messages.
+    """
+    _term_frequency_cache.clear()
@@ -1,5 +1,174 @@
+import json
+import os
+import re
+import string
+
 from string import Template
 
+# The default number of words kept before and after the root word.
+DEFAULT_DEPTH = 6
+# The default number of branches kept after each word of the tree, the most common ones are kept.
+DEFAULT_MAX_BRANCHES = 8
+
+_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wordtree_template.html')
+_WORD_REGEX = re.compile(r'\S+')
+# Loaded on first use by __get_html_template().
+_html_template = None
+
+
+# Reads and compiles the HTML template once, later calls reuse it.
+def __get_html_template():
+    global _html_template
+    if _html_template is None:
+        with open(_TEMPLATE_PATH, 'r') as my_file:
+            _html_template = Template(my_file.read())
+    return _html_template
+
+
+# Compares words ignoring the punctuation around them, e.g. "feel," matches "feel".
+def __normalize_word(word):
+    return word.strip(string.punctuation)
+
+
+def __find_root_occurrences(words, root_words):
+    normalized = [__normalize_word(word) for word in words]
+    for i in range(len(words) - len(root_words) + 1):
+        if normalized[i:i + len(root_words)] == root_words:
+            yield i
+
+
+def find_phrase_windows(texts, root_word, depth=DEFAULT_DEPTH, lowercase=True):
+    """
+        Finds every occurrence of the root word in the texts, along with the words around it.  Texts that don't
+        contain the root word are skipped before being split into words.
+
+    Args:
+        texts: an iterable of texts
+        root_word: the word, or words, the tree is rooted at
+        depth: the number of words to keep before and after the root word
+        lowercase: if true, the texts and root word are lowercased
+
+    Returns:
+        a list of tuples of the words before the root word, nearest first, the root words and the words after it
+    """
+    if lowercase:
+        root_word = root_word.lower()
+    root_words = [__normalize_word(word) for word in root_word.split()]
+    # Quickly filter on the longest root word, all of it has to be in the text for the root word to be.
+    longest_root_word = max(root_words, key=len) if root_words else ''
+    if not longest_root_word:
+        return []
+
+    windows = []
+    for text in texts:
+        if not isinstance(text, str):
+            continue
+        if lowercase:
+            text = text.lower()
+        if longest_root_word not in text:
+            continue
+        words = _WORD_REGEX.findall(text)
+        for i in __find_root_occurrences(words, root_words):
+            end = i + len(root_words)
+            windows.append((tuple(reversed(words[max(0, i - depth):i])), tuple(words[i:end]),
+                            tuple(words[end:end + depth])))
+    return windows
+
+
+# Counts the sequences in a trie of nested dicts: word -> {'count': ..., 'children': {...}}.
+def __count_sequences(sequences):
+    root = {}
+    for sequence in sequences:
+        children = root
+        for word in sequence:
+            node = children.get(word)
+            if node is None:
+                node = children[word] = {'count': 0, 'children': {}}
+            node['count'] += 1
+            children = node['children']
+    return root
+
+
+# Keeps the max_branches most common children of each node of a trie, in place.
+def __prune(children, max_branches):
+    if len(children) > max_branches:
+        kept = sorted(children, key=lambda word: (-children[word]['count'], word))[:max_branches]
+        for word in set(children) - set(kept):
+            del children[word]
+    for node in children.values():
+        __prune(node['children'], max_branches)
+    return children
+
+
+# Cuts a sequence at its first word that was pruned from the trie.
+def __truncate(sequence, trie):
+    children = trie
+    for i, word in enumerate(sequence):
+        if word not in children:
+            return sequence[:i]
+        children = children[word]['children']
+    return sequence
+
+
+def build_word_tree(windows, max_branches=DEFAULT_MAX_BRANCHES):
+    """
+        Builds the prefix and suffix trees of the windows found by find_phrase_windows(), keeping only the most
+        common branches after each word.
+
+    Args:
+        windows: phrase windows as returned by find_phrase_windows()
+        max_branches: the number of branches kept after each word
+
+    Returns:
+        a tuple of the prefix tree, read from the root word backwards, and the suffix tree.  Each tree is a dict from
+        word to a dict of the number of windows through that word, "count", and the words after it, "children"
+    """
+    prefix_tree = __prune(__count_sequences(prefix for prefix, _, _ in windows), max_branches)
+    suffix_tree = __prune(__count_sequences(suffix for _, _, suffix in windows), max_branches)
+    return prefix_tree, suffix_tree
+
+
+def get_word_tree_phrases(texts, root_word, depth=DEFAULT_DEPTH, max_branches=DEFAULT_MAX_BRANCHES, lowercase=True,
+                          tree_type='double'):
+    """
+        Builds the phrases to draw a word tree from, i.e. the words around each occurrence of the root word cut
+        wherever they leave the pruned tree, so only what the tree shows is sent to the browser.
+
+    Args:
+        texts: an iterable of texts
+        root_word: the word, or words, the tree is rooted at
+        depth: the number of words to keep before and after the root word
+        max_branches: the number of branches kept after each word
+        lowercase: if true, the texts and root word are lowercased
+        tree_type: the type of word tree, double, suffix, or prefix
+
+    Returns:
+        a list of phrases, one per occurrence of the root word
+    """
+    windows = find_phrase_windows(texts, root_word, depth, lowercase)
+    prefix_tree, suffix_tree = build_word_tree(windows, max_branches)
+    phrases = []
+    for prefix, root, suffix in windows:
+        prefix = __truncate(prefix, prefix_tree) if tree_type != 'suffix' else ()
+        suffix = __truncate(suffix, suffix_tree) if tree_type != 'prefix' else ()
+        phrases.append(' '.join(tuple(reversed(prefix)) + root + suffix))
+    return phrases
+
+
+def get_word_tree_json(phrases):
+    """
+        Formats phrases as JSON for get_word_tree_html().
+
+    Args:
+        phrases: an iterable of phrases, e.g. as returned by get_word_tree_phrases()
+
+    Returns:
+        JSON to pass directly to the google data visualization API
+    """
+    array_for_json = [[phrase] for phrase in phrases]
+    array_for_json.insert(0, ['Phrases'])
+    return json.dumps(array_for_json)
+
 
 def get_word_tree_html(json_formatted, root_word, lowercase=True, tree_type='double'):
     """
@@ -16,9 +185,27 @@ def get_word_tree_html(json_formatted, root_word, lowercase=True, tree_type='dou
     Returns:
         HTML that will draw a word tree using the Google visualization API when rendered
     """
+    return __get_html_template().substitute(root_word=root_word,
+                                            tree_type=tree_type,
+                                            json_formatted=json_formatted.lower() if lowercase else json_formatted)
 
-    with open('wordtree_template.html', 'r') as my_file:
-        html_template = Template(my_file.read())
-    return html_template.substitute(root_word=root_word,
-                                    tree_type=tree_type,
-                                    json_formatted=json_formatted.lower() if lowercase else json_formatted)
+
+def get_word_tree_html_for_texts(texts, root_word, depth=DEFAULT_DEPTH, max_branches=DEFAULT_MAX_BRANCHES,
+                                 lowercase=True, tree_type='double'):
+    """
+        Generates HTML that will draw a word tree of the texts, pruned as described in get_word_tree_phrases().
+
+    Args:
+        texts: an iterable of texts, they needn't be restricted to those containing the root word
+        root_word: the word to use as the root of the tree
+        depth: the number of words to keep before and after the root word
+        max_branches: the number of branches kept after each word
+        lowercase: if true, lowercase the passed texts
+        tree_type: the type of word tree, double, suffix, or prefix
+
+    Returns:
+        HTML that will draw a word tree using the Google visualization API when rendered
+    """
+    phrases = get_word_tree_phrases(texts, root_word, depth, max_branches, lowercase, tree_type)
+    return get_word_tree_html(get_word_tree_json(phrases), root_word.lower() if lowercase else root_word,
+                              lowercase=False, tree_type=tree_type)